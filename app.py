@@ -1,123 +1,493 @@
-import sys
+import os
 import cv2
-import numpy as np
-from datetime import datetime
-from threading import Thread
+from threading import Thread, Event, local
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
 import queue
 import time
-import base64
-import requests
+import uuid
 
-from module.detection_module import ObjectDetector
-from utils.audio import play_event_sound, play_score_sound 
-from utils.processing import check_object_center, warp_crop_to_original, calculate_score
+from module.pipeline_module import Stage, StagedPipeline
+from utils import metrics
+from utils.audio import play_score_sound
+from utils.logger import get_logger
+from utils.processing import (check_object_center, extract_crop_features, find_crop_homography, transform_point,
+                              calculate_score, get_aim_point)
+from utils.reference import get_reference_target
+from utils.matching import MATCHER_EXACT, create_matcher
+from utils.tracking import HomographyTracker
+from utils.target_library import TargetEntry, get_target_library
 
-# Thay thế bằng địa chỉ IP chính xác của máy Mac của bạn
-SERVER_MAC_URL = "http://192.168.1.196:5000"
+TARGET_DEFINITION_PATH = "targets/bia_so_4.json"
+
+DEFAULT_LANE = "lane1"
+
+log = get_logger("processing")
+
+
+class Shot:
+    """Một phát bắn đi qua các công đoạn detect -> register -> score -> render -> publish."""
+    def __init__(self, frame, capture_time, center_coords, lane_id=DEFAULT_LANE, frame_ref=None, capture_ts=None,
+                 candidates=None):
+        self.seq = None
+        self.frame = frame
+        self.frame_ref = frame_ref
+        # Các frame dự phòng của loạt chụp (kém nét hơn frame chính), chỉ dùng khi frame chính không thấy bia
+        self.candidates = candidates or []
+        self.capture_time = capture_time
+        self.capture_ts = capture_ts
+        self.center_coords = center_coords
+        self.lane_id = lane_id
+        self.status = None
+        self.obj_crop = None
+        self.shot_point = None
+        self.H = None
+        self.transformed_point = None
+        self.score = 0
+        self.processed_image = None
+        self.result_data = {}
+        # Loại bia (TargetEntry) dùng để đăng ký và chấm điểm phát bắn này
+        self.entry = None
+        self.timings = {}
+        self.error = None
+
+    def release(self):
+        """Nhả slot vòng đệm đang giữ frame gốc (gọi nhiều lần cũng không sao)."""
+        self.frame = None
+        if self.frame_ref is not None:
+            self.frame_ref.release()
+            self.frame_ref = None
+        self.release_candidates()
+
+    def release_candidates(self):
+        for frame_ref in self.candidates:
+            frame_ref.release()
+        self.candidates = []
+
+    def use_candidate(self, index):
+        """Chuyển sang frame dự phòng thứ 'index' làm frame chính, nhả các frame còn lại."""
+        frame_ref = self.candidates.pop(index)
+        if self.frame_ref is not None:
+            self.frame_ref.release()
+        self.frame_ref, self.frame, self.capture_ts = frame_ref, frame_ref.array, frame_ref.received_at
+        self.release_candidates()
+
+
+class LaneContext:
+    """
+    Dữ liệu xử lý riêng của một làn bắn: loại bia, nơi gửi kết quả và tracker.
+    target_path là file định nghĩa một loại bia, hoặc một thư mục thư viện bia: khi đó loại bia
+    của mỗi phát bắn được nhận dạng tự động từ ảnh crop (xem utils.target_library).
+    """
+    def __init__(self, lane_id, target_path=TARGET_DEFINITION_PATH, publisher=None):
+        self.lane_id = lane_id
+        if os.path.isdir(target_path):
+            self.library = get_target_library(target_path)
+            self.entry = self.library.entries[0]
+        else:
+            self.library = None
+            self.entry = TargetEntry(target_path)
+        # ResultPublisher gửi kết quả trên luồng riêng; None = không gửi (chạy offline/benchmark)
+        self.publisher = publisher
+        # Homography của lần bắn trước trên làn này (thuộc loại bia self.entry)
+        self.tracker = HomographyTracker()
+
+    @property
+    def recognizes(self):
+        return self.library is not None and len(self.library) > 1
+
+    def describe(self):
+        if self.recognizes:
+            return f"tự nhận dạng trong {', '.join(entry.name for entry in self.library.entries)}"
+        return f"bia '{self.entry.name}'"
+
+
+# --- Đăng ký ảnh crop trong process pool (vượt qua GIL trên 4 nhân của Pi) ---
+_PROCESS_MATCHERS = {}
+
+def _init_register_process(image_paths):
+    """Initializer của tiến trình con: tải sẵn đặc trưng các loại bia để phát bắn đầu không phải chờ."""
+    cv2.setNumThreads(1)
+    for image_path in image_paths:
+        get_reference_target(image_path)
+
+def _register_in_process(obj_crop, matcher_type, image_path, crop_features=None):
+    matcher = _PROCESS_MATCHERS.get(matcher_type)
+    if matcher is None:
+        matcher = _PROCESS_MATCHERS[matcher_type] = create_matcher(matcher_type)
+    # get_reference_target giữ registry theo đường dẫn nên mỗi process chỉ tải mỗi loại bia một lần
+    reference = get_reference_target(image_path)
+    stats = {}
+    H = find_crop_homography(None, obj_crop, reference=reference, matcher=matcher, stats=stats,
+                             crop_features=crop_features)
+    return H, stats
 
-ORIGINAL_IMAGE_PATH = "images/original/bia_so_4.jpg"
-DEFAULT_MASK_PATH = "images/mask/mask_bia_so_4.jpg"
 
 class ProcessingWorker(Thread):
-    def __init__(self, process_queue, detector):
+    """
+    Nhận các phát bắn từ process_queue và đưa qua pipeline nhiều công đoạn
+    (detect -> register -> score -> render -> publish), mỗi công đoạn có hàng đợi và số worker riêng.
+    Kết quả được phát âm thanh và gửi đi theo đúng thứ tự bắn.
+    Nhiều làn bắn dùng chung một worker: công đoạn detect gom các phát bắn đang chờ
+    (tối đa detect_batch_size) thành một lần gọi mô hình.
+    """
+    def __init__(self, process_queue, detector, matcher_type=MATCHER_EXACT, publisher=None,
+                 register_workers=2, render_workers=1, use_process_pool=False, stage_queue_size=8,
+                 detect_batch_size=4, detector_wait_timeout=120.0, recognize_top_n=2):
         super().__init__()
         self.process_queue = process_queue
+        # Detector có thể được nạp sau (set_detector) trên luồng khởi động; công đoạn detect chờ tới khi có
         self.detector = detector
-        self.original_img = cv2.imread(ORIGINAL_IMAGE_PATH)
-        self.mask = cv2.imread(DEFAULT_MASK_PATH, cv2.IMREAD_GRAYSCALE)
+        self.detector_ready = Event()
+        self.detector_wait_timeout = detector_wait_timeout
+        # Lỗi nạp detector (set_detector_failed): phát bắn bị báo lỗi ngay thay vì chờ và giữ slot vòng đệm
+        self.detector_error = None
+        if detector is not None:
+            self.detector_ready.set()
+        self.matcher_type = matcher_type
+        # Số loại bia ứng viên (theo độ giống) được thử đăng ký khi làn dùng thư viện bia
+        self.recognize_top_n = recognize_top_n
+        self._thread_local = local()
+        # Dữ liệu riêng của từng làn bắn (xem add_lane); làn mặc định dùng cho chế độ một camera
+        self.lanes = {}
+        self.add_lane(DEFAULT_LANE, TARGET_DEFINITION_PATH, publisher)
+        # Process pool được tạo trong run() (khi các làn đã đăng ký loại bia), xem _start_process_pool
+        self.use_process_pool = use_process_pool
+        self.register_workers = register_workers
+        self.process_pool = None
+        self.stages = [
+            Stage("detect", self._stage_detect, workers=1, queue_size=stage_queue_size, batch_size=detect_batch_size),
+            Stage("register", self._stage_register, workers=register_workers, queue_size=stage_queue_size),
+            Stage("score", self._stage_score, workers=1, queue_size=stage_queue_size),
+            Stage("render", self._stage_render, workers=render_workers, queue_size=stage_queue_size),
+        ]
+        self.pipeline = StagedPipeline(self.stages, sink=self._stage_publish, on_error=self._on_stage_error)
+        metrics.gauge("queue_depth", "Số phần tử đang chờ trong hàng đợi", func=process_queue.qsize, queue="processing")
+        for stage in self.stages:
+            metrics.gauge("queue_depth", func=stage.queue.qsize, queue=f"stage_{stage.name}")
+        # Gọi với mỗi Shot đã xử lý xong (theo thứ tự bắn), ví dụ để benchmark thu thập shot.timings
+        self.on_shot_done = None
         self.daemon = True
         self.running = True
-        print("💡 ProcessingWorker đã khởi động.")
-    
-    def run(self):
-        while self.running:
-            try:
-                # <<< SỬA ĐỔI: Nhận thêm 'center_coords' từ hàng đợi >>>
-                frame, capture_time, center_coords = self.process_queue.get(timeout=0.1)
-                self._process_frame(frame, capture_time, center_coords)
-                self.process_queue.task_done()
-            except queue.Empty:
-                continue
-            except Exception as e:
-                print(f"Lỗi trong luồng xử lý: {e}")
-    
-    # <<< SỬA ĐỔI: Thêm 'center_coords' vào hàm _process_frame >>>
-    def _process_frame(self, frame, capture_time, center_coords):
-        print(f"✅ Bắt đầu xử lý ảnh chụp lúc {capture_time}...")
-        
-        # <<< SỬA ĐỔI: Truyền tâm ngắm vào hàm check_object_center >>>
-        results = self.detector.detect(frame, conf=0.5)
-        status, obj_crop, shot_point = check_object_center(results, frame, center_coords, conf_threshold=0.5)
-        
-        result_data = {
-            'time': capture_time,
-            'target': 'Bia số 4',
-            'score': '--',
-            'image_data': ''
-        }
-        
-        processed_image = frame.copy()
-        score = 0
-        
-        if status == "TRÚNG" and obj_crop is not None:
-            warped_img, transformed_point = warp_crop_to_original(self.original_img, obj_crop, shot_point)
-            
-            if warped_img is not None and transformed_point is not None:
-                print("Đã warp thành công. Đang tính điểm.")
-                score = calculate_score(transformed_point, self.original_img, self.mask)
-                cv2.drawMarker(warped_img, (int(transformed_point[0]), int(transformed_point[1])), 
-                               (0, 0, 255), cv2.MARKER_CROSS, markerSize=20, thickness=2)
-                processed_image = warped_img
+        log.info("💡 ProcessingWorker đã khởi động.")
+
+    def add_lane(self, lane_id, target_path=TARGET_DEFINITION_PATH, publisher=None):
+        """Đăng ký (hoặc cập nhật) một làn bắn với loại bia và ResultPublisher riêng."""
+        self.lanes[lane_id] = LaneContext(lane_id, target_path, publisher)
+        log.info("🎯 Làn %s: %s", lane_id, self.lanes[lane_id].describe())
+        return self.lanes[lane_id]
+
+    def _lane(self, lane_id):
+        return self.lanes.get(lane_id) or self.lanes[DEFAULT_LANE]
+
+    def set_detector(self, detector):
+        """Gắn detector đã nạp và warm-up xong; các phát bắn đang chờ sẽ được xử lý tiếp."""
+        self.detector = detector
+        self.detector_ready.set()
+        log.info("🎯 Detector sẵn sàng, bắt đầu chấm điểm.")
+
+    def set_detector_failed(self, error):
+        """Detector không nạp được: đánh thức các phát bắn đang chờ để chúng thất bại ngay."""
+        self.detector_error = error
+        self.detector_ready.set()
+        log.error("❌ Detector không khởi động được, các phát bắn sẽ không được chấm điểm: %s", error)
+
+    def set_matcher(self, matcher_type):
+        """Đổi backend match (chính xác/xấp xỉ) ngay trong phiên bắn."""
+        self.matcher_type = matcher_type
+        log.info("🔧 Đã chuyển matcher sang: %s", matcher_type)
+
+    def _matcher(self):
+        # Mỗi luồng register có matcher riêng (chỉ mục FLANN không dùng chung giữa các luồng)
+        matcher = getattr(self._thread_local, 'matcher', None)
+        if matcher is None or getattr(self._thread_local, 'matcher_type', None) != self.matcher_type:
+            matcher = self._thread_local.matcher = create_matcher(self.matcher_type)
+            self._thread_local.matcher_type = self.matcher_type
+        return matcher
+
+    def reset_tracking(self, lane_id=None):
+        """Bỏ homography và ROI đã lưu (ví dụ khi đổi zoom), lần bắn sau sẽ chạy lại toàn bộ pipeline."""
+        for lid, ctx in self.lanes.items():
+            if lane_id is None or lid == lane_id:
+                ctx.tracker.invalidate()
+        if self.detector is not None:
+            self.detector.reset_roi(lane_id)
+
+    @staticmethod
+    def _crop_box(frame, center_coords, shot_point, obj_crop):
+        """Khôi phục bounding box (x1, y1, x2, y2) trên khung hình từ ảnh crop và điểm bắn tương đối."""
+        center_x, center_y = get_aim_point(frame, center_coords)
+        x1, y1 = center_x - shot_point[0], center_y - shot_point[1]
+        h_crop, w_crop = obj_crop.shape[:2]
+        return x1, y1, x1 + w_crop, y1 + h_crop
+
+    def _use_tracked(self, shot, tracked):
+        """Dùng lại bounding box + homography của lần bắn trước khi bia nằm yên."""
+        (x1, y1, x2, y2), H = tracked
+        center_x, center_y = get_aim_point(shot.frame, shot.center_coords)
+        if not (x1 <= center_x <= x2 and y1 <= center_y <= y2):
+            log.info("❌ TRƯỢT | Tâm ngắm không nằm trong mục tiêu (bia không dịch chuyển).")
+            shot.status, shot.obj_crop, shot.shot_point = "TRƯỢT", None, (center_x, center_y)
+            return
+        log.info("♻️ Bia không dịch chuyển, dùng lại homography của lần bắn trước.")
+        shot.status, shot.obj_crop = "TRÚNG", shot.frame[y1:y2, x1:x2].copy()
+        shot.shot_point, shot.H = (center_x - x1, center_y - y1), H
+        shot.result_data.update({"tracked": True})
+
+    # --- Các công đoạn của pipeline ---
+
+    def _stage_detect(self, shots):
+        """
+        Tìm bia cho một nhóm phát bắn: phát nào bia nằm yên thì dùng lại kết quả tracker,
+        các phát còn lại chạy YOLO chung một batch. H = None nghĩa là phải đăng ký lại.
+        """
+        to_detect = []
+        for shot in shots:
+            ctx = self._lane(shot.lane_id)
+            log.info("✅ [%s] Bắt đầu xử lý ảnh chụp lúc %s...", shot.lane_id, shot.capture_time)
+            shot.entry = ctx.entry
+            shot.result_data = {
+                'time': shot.capture_time,
+                'target': shot.entry.name,
+                'score': '--',
+                'shot_id': uuid.uuid4().hex
+            }
+            tracked = ctx.tracker.lookup(shot.frame)
+            if tracked is None:
+                to_detect.append(shot)
             else:
-                print("❌ Warp thất bại. Đang tính điểm trên ảnh crop.")
-                h_orig, w_orig = self.original_img.shape[:2]
-                h_crop, w_crop = obj_crop.shape[:2]
-                resized_obj_crop = cv2.resize(obj_crop, (w_orig, h_orig))
-                scaled_shot_point_x = int(shot_point[0] * w_orig / w_crop)
-                scaled_shot_point_y = int(shot_point[1] * h_orig / h_crop)
-                scaled_shot_point = (scaled_shot_point_x, scaled_shot_point_y)
-                score = calculate_score(scaled_shot_point, self.original_img, self.mask)
-                cv2.drawMarker(resized_obj_crop, scaled_shot_point, 
-                               (0, 0, 255), cv2.MARKER_CROSS, markerSize=20, thickness=2)
-                processed_image = resized_obj_crop
-            
-            result_data.update({"score": score})
-            play_score_sound(score)
-            
-        elif status == "TRƯỢT":
-            print("❌ Bắn không trúng mục tiêu.")
-            result_data.update({
+                shot.release_candidates()
+                self._use_tracked(shot, tracked)
+        if not to_detect:
+            return
+
+        if not self.detector_ready.is_set():
+            log.info("⏳ Detector đang khởi động, %d phát bắn chờ chấm điểm...", len(to_detect))
+            if not self.detector_ready.wait(self.detector_wait_timeout):
+                raise RuntimeError("Detector chưa sẵn sàng")
+        if self.detector is None:
+            raise RuntimeError(f"Detector không khởi động được: {self.detector_error}")
+
+        # Frame chính và các frame dự phòng của loạt chụp đi chung một lần gọi mô hình
+        frames, keys, spans = [], [], []
+        for shot in to_detect:
+            shot_frames = [shot.frame] + [frame_ref.array for frame_ref in shot.candidates]
+            spans.append((len(frames), len(shot_frames)))
+            frames.extend(shot_frames)
+            keys.extend([shot.lane_id] * len(shot_frames))
+        start = time.perf_counter()
+        flat_results = self.detector.detect_batch(frames, conf=0.5, keys=keys)
+        detection_ms = (time.perf_counter() - start) * 1000.0
+        for shot, (offset, count) in zip(to_detect, spans):
+            shot.timings['detection'] = detection_ms
+            results = self._pick_candidate(shot, flat_results[offset:offset + count])
+            start = time.perf_counter()
+            shot.status, shot.obj_crop, shot.shot_point = check_object_center(
+                results, shot.frame, shot.center_coords, conf_threshold=0.5
+            )
+            shot.timings['check_object_center'] = (time.perf_counter() - start) * 1000.0
+            if shot.status == "TRÚNG" and shot.obj_crop is not None:
+                # Lần sau chỉ cần chạy detector quanh vị trí bia này
+                box = self._crop_box(shot.frame, shot.center_coords, shot.shot_point, shot.obj_crop)
+                self.detector.confirm_box(box, key=shot.lane_id)
+
+    @staticmethod
+    def _pick_candidate(shot, candidate_results):
+        """Chọn frame nét nhất mà detector thấy bia (frame chính nếu không frame nào thấy). Trả về kết quả detect của nó."""
+        for index, results in enumerate(candidate_results):
+            if results and results[0].boxes:
+                break
+        else:
+            index = 0
+        if index > 0:
+            log.info("🔁 [%s] Frame nét nhất không thấy bia, dùng frame thứ %d của loạt chụp.", shot.lane_id, index + 1)
+            shot.use_candidate(index - 1)
+        else:
+            shot.release_candidates()
+        return candidate_results[index]
+
+    def _stage_register(self, shot):
+        if shot.status != "TRÚNG" or shot.obj_crop is None or shot.H is not None:
+            return
+        ctx = self._lane(shot.lane_id)
+        # ORB của ảnh crop chỉ trích xuất một lần, dùng chung cho nhận dạng và mọi lần thử đăng ký
+        crop_features = extract_crop_features(shot.obj_crop)
+        candidates = [shot.entry]
+        if ctx.recognizes:
+            start = time.perf_counter()
+            ranked = ctx.library.recognize(crop_features[1], top_n=self.recognize_top_n)
+            shot.timings['recognize'] = (time.perf_counter() - start) * 1000.0
+            if ranked:
+                log.info("📚 [%s] Nhận dạng bia: %s", shot.lane_id,
+                         ", ".join(f"{entry.name} ({similarity:.2f})" for entry, similarity in ranked))
+                candidates = [entry for entry, _ in ranked]
+        # Thử đăng ký lần lượt với các loại bia ứng viên, dừng ở loại đầu tiên tìm được homography
+        for entry in candidates:
+            H, match_stats = self._register(shot.obj_crop, entry, crop_features)
+            if H is not None:
+                break
+        shot.entry = entry if H is not None else candidates[0]
+        shot.result_data['target'] = shot.entry.name
+        if match_stats:
+            log.info("🔗 Matcher %s: %d/%d inliers, %.1f ms",
+                     match_stats['matcher'], match_stats['inliers'], match_stats['matches'], match_stats['match_ms'])
+            shot.result_data.update({
+                "inliers": match_stats['inliers'],
+                "match_ms": round(match_stats['match_ms'], 1)
+            })
+        if H is not None:
+            # Lưu homography + bounding box để các phát bắn sau dùng lại
+            box = self._crop_box(shot.frame, shot.center_coords, shot.shot_point, shot.obj_crop)
+            ctx.entry = shot.entry
+            ctx.tracker.update(shot.frame, box, H)
+        shot.H = H
+
+    def _register(self, obj_crop, entry, crop_features=None):
+        if self.process_pool is not None:
+            return self.process_pool.submit(_register_in_process, obj_crop, self.matcher_type, entry.image_path,
+                                            crop_features).result()
+        match_stats = {}
+        H = find_crop_homography(entry.original_img, obj_crop, reference=entry.reference,
+                                 matcher=self._matcher(), stats=match_stats, crop_features=crop_features)
+        return H, match_stats
+
+    def _scaled_shot_point(self, shot):
+        h_orig, w_orig = shot.entry.original_img.shape[:2]
+        h_crop, w_crop = shot.obj_crop.shape[:2]
+        return (int(shot.shot_point[0] * w_orig / w_crop), int(shot.shot_point[1] * h_orig / h_crop))
+
+    def _stage_score(self, shot):
+        if shot.status == "TRÚNG" and shot.obj_crop is not None:
+            if shot.H is not None:
+                shot.transformed_point = transform_point(shot.H, shot.shot_point)
+            if shot.transformed_point is not None:
+                log.debug("Đã warp thành công. Đang tính điểm.")
+                shot.score = calculate_score(shot.transformed_point, shot.entry.score_map)
+            else:
+                log.info("❌ Warp thất bại. Đang tính điểm trên ảnh crop.")
+                shot.H = None
+                shot.score = calculate_score(self._scaled_shot_point(shot), shot.entry.score_map)
+            shot.result_data.update({"score": shot.score})
+        elif shot.status == "TRƯỢT":
+            log.info("❌ Bắn không trúng mục tiêu.")
+            shot.result_data.update({
                 "score": 0,
                 "target": "Không trúng mục tiêu"
             })
-            # Giữ lại logic vẽ marker cũ của bạn cho trường hợp này
-            processed_image = cv2.resize(frame, (500, 500))
-            center = (processed_image.shape[1] // 2, processed_image.shape[0] // 2)
-            cv2.drawMarker(processed_image, center, 
-                           (0, 0, 255), cv2.MARKER_CROSS, markerSize=20, thickness=2)
-            play_score_sound(0)
-            
         else: # Bao gồm cả trường hợp "KHÔNG_PHÁT_HIỆN"
-            print("⚠ Không xử lý được kết quả.")
-            result_data.update({
+            log.info("⚠ Không xử lý được kết quả.")
+            shot.result_data.update({
                 "score": 0,
                 "target": "Không xử lý được"
             })
-            processed_image = cv2.resize(frame, (500, 500))
-            center = (processed_image.shape[1] // 2, processed_image.shape[0] // 2)
-            cv2.drawMarker(processed_image, center, 
-                           (0, 0, 255), cv2.MARKER_CROSS, markerSize=20, thickness=2)
-            play_score_sound(0)
-        
-        _, img_buffer = cv2.imencode('.jpg', processed_image)
-        result_data['image_data'] = base64.b64encode(img_buffer).decode('utf-8')
-        
-        try:
-            requests.post(f"{SERVER_MAC_URL}/processed_data_upload", json=result_data, timeout=5)
-            print("🚀 Đã gửi dữ liệu xử lý lên server thành công.")
-        except requests.exceptions.RequestException as e:
-            print(f"❌ Lỗi khi gửi dữ liệu xử lý: {e}")
+
+    def _stage_render(self, shot):
+        if shot.status == "TRÚNG" and shot.obj_crop is not None:
+            h_orig, w_orig = shot.entry.original_img.shape[:2]
+            if shot.H is not None:
+                processed_image = cv2.warpPerspective(shot.obj_crop, shot.H, (w_orig, h_orig), flags=cv2.INTER_LINEAR)
+                marker = (int(shot.transformed_point[0]), int(shot.transformed_point[1]))
+            else:
+                processed_image = cv2.resize(shot.obj_crop, (w_orig, h_orig))
+                marker = self._scaled_shot_point(shot)
+        else:
+            # Giữ lại logic vẽ marker cũ của bạn cho trường hợp này
+            processed_image = cv2.resize(shot.frame, (500, 500))
+            marker = (processed_image.shape[1] // 2, processed_image.shape[0] // 2)
+        cv2.drawMarker(processed_image, marker, (0, 0, 255), cv2.MARKER_CROSS, markerSize=20, thickness=2)
+        shot.processed_image = processed_image
+        # Không cần frame gốc nữa: nhả slot trong vòng đệm để vòng lặp chụp có thể ghi đè
+        shot.release()
+
+    def _stage_publish(self, shot):
+        """Công đoạn cuối, luôn chạy theo đúng thứ tự bắn."""
+        shot.release()
+        if shot.error is None:
+            play_score_sound(shot.score)
+            # Nén ảnh và gửi lên server do ResultPublisher làm, phát bắn sau không phải chờ mạng
+            publisher = self._lane(shot.lane_id).publisher
+            if publisher is not None:
+                publisher.publish(shot.result_data, shot.processed_image)
+            if shot.capture_ts is not None:
+                # Từ lúc frame tới vòng lặp chụp (gần lúc bóp cò) tới lúc phát điểm
+                shot.timings['trigger_to_score'] = (time.monotonic() - shot.capture_ts) * 1000.0
+            for stage_name, elapsed_ms in shot.timings.items():
+                metrics.histogram("stage_latency_ms", "Độ trễ từng công đoạn xử lý phát bắn", stage=stage_name,
+                                  lane=shot.lane_id).observe(elapsed_ms)
+            metrics.counter("shots_processed_total", "Số phát bắn đã xử lý xong", lane=shot.lane_id,
+                            status=shot.status or "unknown").inc()
+        else:
+            metrics.counter("shot_errors_total", "Số phát bắn lỗi trong pipeline", lane=shot.lane_id).inc()
+        if self.on_shot_done is not None:
+            self.on_shot_done(shot)
+
+    def _on_stage_error(self, stage_name, shot, error):
+        log.error("Lỗi trong luồng xử lý (%s): %s", stage_name, error)
+
+    def _process_frame(self, frame, capture_time, center_coords, lane_id=DEFAULT_LANE):
+        """Xử lý tuần tự một phát bắn qua tất cả công đoạn trên luồng hiện tại (dùng khi không chạy pipeline)."""
+        shot = Shot(frame, capture_time, center_coords, lane_id)
+        for stage in self.stages:
+            start = time.perf_counter()
+            stage.func([shot]) if stage.batched else stage.func(shot)
+            shot.timings[stage.name] = (time.perf_counter() - start) * 1000.0
+        self._stage_publish(shot)
+        return shot
+
+    def _start_process_pool(self):
+        """
+        Tiến trình con dùng context 'spawn': lúc này camera, GPIO, stream, âm thanh và metrics đều đã chạy
+        luồng riêng, fork một tiến trình đa luồng có thể kẹt ở lock do luồng khác đang giữ.
+        """
+        image_paths = set()
+        for ctx in self.lanes.values():
+            entries = ctx.library.entries if ctx.library is not None else [ctx.entry]
+            image_paths.update(entry.image_path for entry in entries)
+        self.process_pool = ProcessPoolExecutor(max_workers=self.register_workers,
+                                                mp_context=multiprocessing.get_context("spawn"),
+                                                initializer=_init_register_process,
+                                                initargs=(sorted(image_paths),))
+
+    def run(self):
+        if self.use_process_pool:
+            self._start_process_pool()
+        self.pipeline.start()
+        while self.running:
+            try:
+                frame_refs, capture_time, center_coords, lane_id = self.process_queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            try:
+                # frame_refs: các frame của loạt chụp, nét nhất trước
+                frame_ref = frame_refs[0]
+                shot = Shot(frame_ref.array, capture_time, center_coords, lane_id,
+                            frame_ref=frame_ref, capture_ts=frame_ref.received_at, candidates=list(frame_refs[1:]))
+                # Chặn khi công đoạn đầu đầy thay vì bỏ phát bắn
+                self.pipeline.submit(shot)
+            except Exception as e:
+                for frame_ref in frame_refs:
+                    frame_ref.release()
+                log.error("Lỗi trong luồng xử lý: %s", e)
+            finally:
+                self.process_queue.task_done()
+
+    def drain(self, timeout=10.0):
+        """
+        Chờ các phát bắn đang chờ/đang xử lý đi hết tới công đoạn publish (gọi khi tắt máy, sau khi các làn
+        ngừng chụp và trước khi dừng ResultPublisher). Trả về False nếu hết 'timeout' mà vẫn còn phát bắn.
+        """
+        deadline = time.monotonic() + timeout
+        while self.process_queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.05)
+        drained = self.pipeline.drain(max(0.0, deadline - time.monotonic()))
+        if not drained or self.process_queue.unfinished_tasks:
+            log.warning("⚠️ Hết %.0fs mà pipeline vẫn còn phát bắn chưa xử lý xong.", timeout)
+            return False
+        return True
 
     def stop(self):
         self.running = False
-        print("🛑 ProcessingWorker đã dừng.")
\ No newline at end of file
+        self.pipeline.stop()
+        if self.process_pool is not None:
+            self.process_pool.shutdown(wait=False, cancel_futures=True)
+        log.info("🛑 ProcessingWorker đã dừng.")
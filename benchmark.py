@@ -0,0 +1,217 @@
+"""
+Benchmark đầu-cuối: chạy vòng lặp chụp của Lane và pipeline ProcessingWorker thật trên footage đã ghi,
+với GPIO giả lập (log trigger của footage), âm thanh null và server giả lập (tools/fake_server.py).
+
+Ví dụ:
+    python benchmark.py --footage recordings/session1 --speed max --output bench.json
+    python benchmark.py --footage recordings/session1 --lanes 2 --baseline bench.json --output bench_new.json
+
+Kết quả (JSON): p50/p95/p99 cho từng công đoạn, FPS preview, FPS chụp và bộ nhớ cao nhất (ru_maxrss),
+kèm commit git và cấu hình, để so sánh hồi quy giữa các thay đổi.
+"""
+import os
+
+# Phải đặt trước khi import các module dùng GPIO/âm thanh
+os.environ.setdefault("TRIGGER_BACKEND", "fake")
+os.environ.setdefault("AUDIO_BACKEND", "null")
+
+import argparse
+import json
+import platform
+import queue
+import resource
+import subprocess
+import tempfile
+import time
+from threading import Lock
+
+import numpy as np
+
+import main as app_main
+from app import ProcessingWorker
+from module.detection_module import ObjectDetector
+from module.lane_module import Lane
+from tools.fake_server import FakeServer
+from utils.audio import init_audio, stop_audio
+
+# Tên trong báo cáo -> khóa trong shot.timings
+# 'register' là công đoạn tìm homography (find_crop_homography), 'score' là calculate_score
+SHOT_METRICS = {
+    'detection': 'detection',
+    'check_object_center': 'check_object_center',
+    'find_crop_homography': 'register',
+    'calculate_score': 'score',
+    'render': 'render',
+    'trigger_to_score': 'trigger_to_score',
+}
+PUBLISHER_METRICS = ('encode', 'publish')
+
+
+def percentiles(samples):
+    if not samples:
+        return None
+    values = np.asarray(samples, dtype=np.float64)
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {'count': int(values.size), 'p50': round(float(p50), 2), 'p95': round(float(p95), 2),
+            'p99': round(float(p99), 2), 'max': round(float(values.max()), 2)}
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def max_rss_mb():
+    # Linux trả về KB, macOS trả về byte
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(rss / (1024 * 1024) if platform.system() == "Darwin" else rss / 1024, 1)
+
+
+class ShotCollector:
+    """Nhận các Shot đã xử lý xong từ ProcessingWorker.on_shot_done."""
+    def __init__(self):
+        self.lock = Lock()
+        self.timings = {name: [] for name in SHOT_METRICS}
+        self.completed = 0
+        self.errors = 0
+
+    def __call__(self, shot):
+        with self.lock:
+            self.completed += 1
+            if shot.error is not None:
+                self.errors += 1
+                return
+            for name, key in SHOT_METRICS.items():
+                if key in shot.timings:
+                    self.timings[name].append(shot.timings[key])
+
+
+def compare(report, baseline_path):
+    """In chênh lệch p95 so với một lần benchmark trước."""
+    with open(baseline_path, 'r') as f:
+        baseline = json.load(f)
+    print(f"\n📊 So với {baseline_path} (commit {baseline.get('commit')}):")
+    for name, stats in report['stages'].items():
+        old = baseline.get('stages', {}).get(name)
+        if stats and old:
+            delta = stats['p95'] - old['p95']
+            pct = (delta / old['p95'] * 100.0) if old['p95'] else 0.0
+            print(f"   {name:<22} p95 {old['p95']:>8.2f} -> {stats['p95']:>8.2f} ms ({pct:+.1f}%)")
+    for key in ('preview_fps', 'capture_fps', 'max_rss_mb'):
+        if key in baseline:
+            print(f"   {key:<22} {baseline[key]} -> {report[key]}")
+
+
+def run(args):
+    app_main.load_config()
+    detector_config = dict(app_main.DETECTOR_CONFIG)
+    if args.backend:
+        detector_config['backend'] = args.backend
+    if args.model:
+        detector_config['model'] = args.model
+    pipeline_config = app_main.PIPELINE_CONFIG
+
+    server = FakeServer().start()
+    # AUDIO_BACKEND=null: luồng phát âm thanh vẫn chạy nhưng với NullBackend
+    init_audio()
+    spool_dir = tempfile.mkdtemp(prefix="bench_spool_")
+    processing_queue = queue.Queue(maxsize=pipeline_config['queue_size'])
+    detector = ObjectDetector(model_path=detector_config['model'], backend=detector_config['backend'],
+                              imgsz=detector_config['imgsz'], threads=detector_config['threads'])
+    worker = ProcessingWorker(process_queue=processing_queue, detector=detector,
+                              matcher_type=args.matcher or app_main.MATCHER_TYPE,
+                              register_workers=pipeline_config['register_workers'],
+                              render_workers=pipeline_config['render_workers'],
+                              use_process_pool=pipeline_config['process_pool'],
+                              stage_queue_size=pipeline_config['stage_queue_size'],
+                              detect_batch_size=pipeline_config['detect_batch_size'])
+    collector = ShotCollector()
+    worker.on_shot_done = collector
+
+    template = app_main.LANE_CONFIGS[0]
+    lanes = []
+    for i in range(args.lanes):
+        lane_id = f"bench{i + 1}"
+        section = dict(template, id=lane_id, trigger_pin=100 + i, server_url=None,
+                       spool=os.path.join(spool_dir, f"{lane_id}.db"),
+                       camera=dict(template.get('camera', {}), source='replay', path=args.footage, speed=args.speed))
+        lanes.append(Lane(section, server.url, processing_queue, worker, ring_depth=app_main.RING_DEPTH))
+
+    worker.start()
+    start = time.monotonic()
+    for lane in lanes:
+        lane.start()
+    for lane in lanes:
+        lane.join()
+    capture_elapsed = time.monotonic() - start
+
+    # Chờ pipeline xử lý hết các phát bắn đã trigger; phát bắn bị làn bỏ (vòng đệm/hàng đợi đầy) không bao giờ tới
+    triggered = sum(lane.camera.triggers_fired for lane in lanes)
+    dropped = sum(lane.shots_dropped for lane in lanes)
+    expected = triggered - dropped
+    deadline = time.monotonic() + args.drain_timeout
+    while collector.completed < expected and time.monotonic() < deadline:
+        time.sleep(0.05)
+    time.sleep(0.5)  # cho ResultPublisher gửi lô cuối
+
+    stages = {name: percentiles(samples) for name, samples in collector.timings.items()}
+    for name in PUBLISHER_METRICS:
+        stages[name] = percentiles([ms for lane in lanes for ms in lane.result_publisher.timing_samples[name]])
+
+    frames_played = sum(lane.camera.frames_played for lane in lanes)
+    frames_encoded = sum(lane.preview_encoder.frames_encoded for lane in lanes)
+    report = {
+        'commit': git_commit(),
+        'timestamp': time.strftime("%Y-%m-%dT%H:%M:%S"),
+        'footage': args.footage,
+        'speed': args.speed,
+        'lanes': args.lanes,
+        'detector': detector_config,
+        'pipeline': pipeline_config,
+        'shots': {'triggered': triggered, 'dropped': dropped, 'completed': collector.completed,
+                  'errors': collector.errors},
+        'stages': stages,
+        'capture_fps': round(frames_played / capture_elapsed, 1) if capture_elapsed > 0 else 0.0,
+        'preview_fps': round(frames_encoded / capture_elapsed, 1) if capture_elapsed > 0 else 0.0,
+        'max_rss_mb': max_rss_mb(),
+        'server': {'counts': dict(server.state.counts)},
+    }
+
+    app_main.shutdown(lanes, worker)
+    stop_audio()
+    server.stop()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark pipeline chấm điểm trên footage đã ghi.")
+    parser.add_argument("--footage", required=True, help="Thư mục frame hoặc file video (xem ReplayCamera)")
+    parser.add_argument("--speed", choices=("realtime", "max"), default="max")
+    parser.add_argument("--lanes", type=int, default=1, help="Số làn cùng phát lại footage")
+    parser.add_argument("--backend", default=None, help="Ghi đè detector.backend trong config.json")
+    parser.add_argument("--model", default=None, help="Ghi đè detector.model trong config.json")
+    parser.add_argument("--matcher", choices=("exact", "approx"), default=None)
+    parser.add_argument("--drain-timeout", type=float, default=60.0)
+    parser.add_argument("--output", default="benchmark.json")
+    parser.add_argument("--baseline", default=None, help="File JSON của lần chạy trước để so sánh")
+    args = parser.parse_args()
+
+    report = run(args)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=4, ensure_ascii=False)
+
+    shots = report['shots']
+    print(f"\n⏱️ Kết quả benchmark ({shots['completed']}/{shots['triggered']} phát bắn, {shots['dropped']} bị bỏ):")
+    for name, stats in report['stages'].items():
+        if stats:
+            print(f"   {name:<22} p50 {stats['p50']:>8.2f}  p95 {stats['p95']:>8.2f}  p99 {stats['p99']:>8.2f} ms")
+    print(f"   Chụp: {report['capture_fps']} FPS | Preview: {report['preview_fps']} FPS | RSS cao nhất: {report['max_rss_mb']} MB")
+    print(f"💾 Đã lưu kết quả vào {args.output}")
+    if args.baseline:
+        compare(report, args.baseline)
+
+
+if __name__ == '__main__':
+    main()
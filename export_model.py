@@ -0,0 +1,86 @@
+"""
+Export mô hình YOLO (.pt) sang ONNX với kích thước đầu vào cố định, tùy chọn lượng tử hóa int8.
+
+Ví dụ:
+    python export_model.py --model my_model.pt --imgsz 640
+    python export_model.py --model my_model.pt --imgsz 640 --int8 --calib-dir captures/
+"""
+import argparse
+import glob
+import os
+
+import cv2
+
+from module.detection_module import preprocess
+
+
+class ImageCalibrationReader:
+    """Đọc ảnh chụp thực tế làm dữ liệu hiệu chuẩn cho lượng tử hóa tĩnh int8."""
+    def __init__(self, image_paths, input_name, imgsz):
+        self.image_paths = list(image_paths)
+        self.input_name = input_name
+        self.imgsz = imgsz
+        self.index = 0
+
+    def get_next(self):
+        while self.index < len(self.image_paths):
+            path = self.image_paths[self.index]
+            self.index += 1
+            image = cv2.imread(path)
+            if image is None:
+                continue
+            blob, _, _ = preprocess(image, self.imgsz)
+            return {self.input_name: blob}
+        return None
+
+    def rewind(self):
+        self.index = 0
+
+
+def export_onnx(model_path, imgsz):
+    from ultralytics import YOLO
+    onnx_path = YOLO(model_path).export(format="onnx", imgsz=imgsz, dynamic=False, simplify=True)
+    print(f"✅ Đã export ONNX: {onnx_path}")
+    return onnx_path
+
+
+def quantize_int8(onnx_path, imgsz, calib_dir=None, max_images=200):
+    import onnxruntime as ort
+    from onnxruntime.quantization import QuantType, QuantFormat, quantize_dynamic, quantize_static
+
+    output_path = os.path.splitext(onnx_path)[0] + ".int8.onnx"
+    image_paths = []
+    if calib_dir:
+        for pattern in ("*.jpg", "*.jpeg", "*.png"):
+            image_paths.extend(sorted(glob.glob(os.path.join(calib_dir, pattern))))
+        image_paths = image_paths[:max_images]
+
+    if image_paths:
+        input_name = ort.InferenceSession(onnx_path, providers=["CPUExecutionProvider"]).get_inputs()[0].name
+        reader = ImageCalibrationReader(image_paths, input_name, imgsz)
+        print(f"⏳ Lượng tử hóa tĩnh int8 với {len(image_paths)} ảnh hiệu chuẩn...")
+        quantize_static(onnx_path, output_path, reader, quant_format=QuantFormat.QDQ,
+                        activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8)
+    else:
+        print("⚠️ Không có ảnh hiệu chuẩn, dùng lượng tử hóa động int8 (chỉ trọng số).")
+        quantize_dynamic(onnx_path, output_path, weight_type=QuantType.QUInt8)
+    print(f"✅ Đã lượng tử hóa int8: {output_path}")
+    return output_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export mô hình YOLO sang ONNX (tùy chọn int8).")
+    parser.add_argument("--model", default="my_model.pt", help="Đường dẫn mô hình .pt")
+    parser.add_argument("--imgsz", type=int, default=640, help="Kích thước đầu vào cố định")
+    parser.add_argument("--int8", action="store_true", help="Lượng tử hóa int8 sau khi export")
+    parser.add_argument("--calib-dir", default=None, help="Thư mục ảnh chụp thực tế để hiệu chuẩn int8")
+    args = parser.parse_args()
+
+    onnx_path = export_onnx(args.model, args.imgsz)
+    if args.int8:
+        onnx_path = quantize_int8(onnx_path, args.imgsz, args.calib_dir)
+    print(f'👉 Cấu hình trong config.json: "detector": {{"backend": "onnx", "model": "{onnx_path}", "imgsz": {args.imgsz}}}')
+
+
+if __name__ == '__main__':
+    main()
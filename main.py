@@ -1,221 +1,200 @@
-import sys
 import cv2
-import numpy as np
-from datetime import datetime
-from threading import Thread
 import queue
 import time
-import requests
-from collections import deque
-import RPi.GPIO as GPIO
-import json
-import os
 
-from module.camera_module import Camera
 from module.detection_module import ObjectDetector
-from app import ProcessingWorker 
-from utils.audio import play_event_sound
+from module.lane_module import Lane
+from app import ProcessingWorker, DEFAULT_LANE, TARGET_DEFINITION_PATH
+from utils.audio import init_audio, play_event_sound, stop_audio
+from utils.startup import StartupOrchestrator
+from utils.metrics import MetricsServer, MetricsPusher
+from utils.config_store import ConfigStore
+from utils.logger import get_logger
+
+log = get_logger("main")
 
 SERVER_MAC_URL = "http://192.168.1.196:5000"
 CONFIG_FILE = "config.json"
 
-GPIO.cleanup()
-GPIO.setmode(GPIO.BCM)
 TRIGGER_PIN = 17
-GPIO.setup(TRIGGER_PIN, GPIO.IN, pull_up_down=GPIO.PUD_DOWN) 
-
-RING_BUFFER = deque(maxlen=2)
-CALIBRATED_CENTER = None
-CURRENT_ZOOM = 1.0
 
-def save_config():
-    config_data = { 'zoom': CURRENT_ZOOM, 'center': CALIBRATED_CENTER }
-    try:
-        with open(CONFIG_FILE, 'w') as f:
-            json.dump(config_data, f, indent=4)
-        print(f"💾 Đã lưu cấu hình: {config_data}")
-    except Exception as e:
-        print(f"❌ Lỗi khi lưu file cấu hình: {e}")
+MATCHER_TYPE = "exact"
+# Mỗi phát bắn đang xử lý ghim slot vòng đệm: số phát bắn đồng thời = (ring_depth - số frame của loạt) / top_k
+RING_DEPTH = 12
+DETECTOR_CONFIG = { 'backend': 'torch', 'model': 'my_model.pt', 'imgsz': 640, 'threads': 4 }
+PIPELINE_CONFIG = { 'register_workers': 2, 'render_workers': 1, 'process_pool': False, 'stage_queue_size': 8,
+                    'queue_size': 32, 'detect_batch_size': 4 }
+# Thời gian tối đa chờ card âm thanh (giây); hết thời gian thì chạy tiếp không có âm thanh
+AUDIO_INIT_TIMEOUT = 10.0
+# Endpoint metric cục bộ (port = null để tắt) và chu kỳ đẩy metric lên server (giây, 0 để tắt)
+METRICS_CONFIG = { 'port': 9108, 'push_interval': 10.0 }
+# Mỗi phần tử là cấu hình một làn bắn: id, zoom, center, target, trigger_pin, camera, server_url
+LANE_CONFIGS = []
+LANES = []
+# Cấu hình nằm trong bộ nhớ; luồng của store gộp các thay đổi và ghi file (nguyên tử) ở nền
+CONFIG_STORE = ConfigStore(CONFIG_FILE)
+
+def default_lane_config(zoom=1.0, center=None):
+    return { 'id': DEFAULT_LANE, 'zoom': zoom, 'center': center, 'target': TARGET_DEFINITION_PATH,
+             'trigger_pin': TRIGGER_PIN, 'camera': { 'source': 'picamera2', 'num': 0, 'width': 960, 'height': 1280,
+                                                      'lores': { 'width': 480, 'height': 640 } },
+             'server_url': None }
+
+def save_config(lane_id=None, section=None, matcher_type=None):
+    """Ghi thay đổi vào CONFIG_STORE (chỉ trong bộ nhớ, không chặn); file được lưu ở nền."""
+    global MATCHER_TYPE
+    if section is not None:
+        CONFIG_STORE.update_lane(lane_id, section)
+    if matcher_type is not None:
+        MATCHER_TYPE = matcher_type
+        CONFIG_STORE.update(matcher=matcher_type)
 
 def load_config():
-    global CURRENT_ZOOM, CALIBRATED_CENTER
-    try:
-        if os.path.exists(CONFIG_FILE):
-            with open(CONFIG_FILE, 'r') as f:
-                config_data = json.load(f)
-                CURRENT_ZOOM = config_data.get('zoom', 1.0)
-                CALIBRATED_CENTER = config_data.get('center', None)
-                print(f"✅ Đã tải cấu hình từ phiên trước: Zoom={CURRENT_ZOOM}, Tâm={CALIBRATED_CENTER}")
-    except Exception as e:
-        print(f"❌ Lỗi khi tải file cấu hình, sử dụng giá trị mặc định: {e}")
-
-def report_initial_config():
-    """Gửi cấu hình đã tải từ file lên server."""
-    config_data = { 'zoom': CURRENT_ZOOM, 'center': CALIBRATED_CENTER }
-    try:
-        requests.post(f"{SERVER_MAC_URL}/report_config", json=config_data, timeout=10)
-        print(f"📢 Đã báo cáo cấu hình ban đầu lên server: {config_data}")
-    except requests.exceptions.RequestException as e:
-        print(f"⚠️ Không thể báo cáo cấu hình ban đầu: {e}")
-
-class SenderWorker(Thread):
-    def __init__(self, frame_queue):
-        super().__init__()
-        self.frame_queue = frame_queue
-        self.daemon = True
-        self.running = True
-    def run(self):
-        while self.running:
-            try:
-                jpg_buffer = self.frame_queue.get_nowait()
-                try:
-                    requests.post(f"{SERVER_MAC_URL}/video_upload", data=jpg_buffer, headers={'Content-Type': 'image/jpeg'}, timeout=0.5)
-                except requests.exceptions.RequestException as e:
-                    print(f"LỖI SENDER: {e}")
-                self.frame_queue.task_done()
-            except queue.Empty:
-                time.sleep(0.01)
-                continue
-    def stop(self):
-        self.running = False
-
-class CommandPoller(Thread):
-    def __init__(self, command_queue):
-        super().__init__()
-        self.command_queue = command_queue
-        self.daemon = True
-        self.running = True
-    def run(self):
-        while self.running:
-            try:
-                response = requests.get(f"{SERVER_MAC_URL}/get_command", timeout=1.0)
-                if response.status_code == 200:
-                    command = response.json()
-                    if command:
-                        self.command_queue.put(command)
-            except requests.exceptions.RequestException as e:
-                pass
-            time.sleep(1)
-    def stop(self):
-        self.running = False
-
-def set_zoom(picam2, zoom_factor, stream_size):
-    if zoom_factor < 1.0: zoom_factor = 1.0
-    full_width, full_height = picam2.camera_properties['PixelArraySize']
-    stream_width, stream_height = stream_size
-    target_aspect_ratio = stream_width / stream_height
-    crop_width = full_width / zoom_factor
-    crop_height = full_height / zoom_factor
-    new_crop_width = crop_height * target_aspect_ratio
-    if new_crop_width <= crop_width:
-        crop_width = new_crop_width
-    else:
-        crop_height = crop_width / target_aspect_ratio
-    crop_x = (full_width - crop_width) / 2
-    crop_y = (full_height - crop_height) / 2
-    crop_region = (int(crop_x), int(crop_y), int(crop_width), int(crop_height))
-    picam2.set_controls({"ScalerCrop": crop_region})
-    print(f"🔎 Đã thiết lập zoom kỹ thuật số: {zoom_factor}x")
+    global LANE_CONFIGS, MATCHER_TYPE, RING_DEPTH, DETECTOR_CONFIG, PIPELINE_CONFIG, METRICS_CONFIG
+    # File cấu hình cũ (một camera, zoom/center ở cấp trên cùng) được ConfigStore nâng cấp thành một làn
+    config_data = CONFIG_STORE.load()
+    LANE_CONFIGS = [{ **default_lane_config(), **section } for section in config_data.get('lanes') or [{}]]
+    # Điền các trường mặc định còn thiếu (file cũ/được nâng cấp); store chỉ lưu lại nếu thật sự khác
+    CONFIG_STORE.update(lanes=LANE_CONFIGS)
+    MATCHER_TYPE = config_data.get('matcher', "exact")
+    RING_DEPTH = int(config_data.get('ring_depth', RING_DEPTH))
+    DETECTOR_CONFIG = { **DETECTOR_CONFIG, **config_data.get('detector', {}) }
+    PIPELINE_CONFIG = { **PIPELINE_CONFIG, **config_data.get('pipeline', {}) }
+    METRICS_CONFIG = { **METRICS_CONFIG, **config_data.get('metrics', {}) }
+    lanes_str = ", ".join(f"{c.get('id')}(Zoom={c.get('zoom')}, Tâm={c.get('center')})" for c in LANE_CONFIGS)
+    log.info("✅ Đã tải cấu hình: %s, Matcher=%s", lanes_str, MATCHER_TYPE)
+
+def apply_external_config(old, new, processing_worker):
+    """
+    File cấu hình bị sửa tay trong lúc chạy: zoom/tâm ngắm được đưa vào hàng đợi lệnh của làn
+    (áp dụng trên vòng lặp chụp như lệnh từ server), matcher áp dụng ngay. Các trường khác cần khởi động lại.
+    """
+    old_lanes = { s.get('id'): s for s in old.get('lanes', []) }
+    for section in new.get('lanes', []):
+        lane = next((l for l in LANES if l.lane_id == section.get('id')), None)
+        if lane is None:
+            log.warning("⚠️ Làn '%s' mới trong file cấu hình, cần khởi động lại để áp dụng.", section.get('id'))
+            continue
+        if section.get('zoom') is not None and float(section['zoom']) != lane.zoom:
+            lane.command_queue.put({ 'type': 'zoom', 'value': section['zoom'] })
+        if section.get('center') and section['center'] != lane.center:
+            center = section['center']
+            # Tâm ngắm trong file cấu hình luôn theo tọa độ preview gốc, không phụ thuộc tỉ lệ livestream
+            if isinstance(center, dict):
+                center = { **center, 'scale': 1.0 }
+            lane.command_queue.put({ 'type': 'center', 'value': center })
+        previous = old_lanes.get(section.get('id'), {})
+        restart_keys = [k for k in ('camera', 'trigger_pin', 'target', 'server_url', 'burst')
+                        if k in section and section.get(k) != previous.get(k)]
+        if restart_keys:
+            log.warning("⚠️ [%s] Đã đổi %s trong file cấu hình, cần khởi động lại để áp dụng.", lane.lane_id, restart_keys)
+    if new.get('matcher') in ("exact", "approx") and new['matcher'] != processing_worker.matcher_type:
+        processing_worker.set_matcher(new['matcher'])
+
+def lane_server_url(lane_id):
+    """Một làn dùng thẳng server gốc (tương thích server cũ); nhiều làn thì mỗi làn một kênh riêng."""
+    if len(LANE_CONFIGS) == 1:
+        return SERVER_MAC_URL
+    return f"{SERVER_MAC_URL}/lanes/{lane_id}"
+
+def shutdown(lanes, processing_worker, drain_timeout=10.0):
+    """
+    Tắt theo thứ tự để không mất kết quả: ngừng chụp/trigger, chờ pipeline xử lý xong các phát bắn
+    đang dở (chúng còn publish() vào spool), rồi mới dừng ResultPublisher và đóng spool.
+    """
+    for lane in lanes:
+        lane.stop_capture()
+    processing_worker.drain(drain_timeout)
+    processing_worker.stop()
+    processing_worker.join(timeout=2.0)
+    for lane in lanes:
+        lane.stop_workers()
 
 def main():
-    global CALIBRATED_CENTER, CURRENT_ZOOM
-    
     load_config()
-    Thread(target=report_initial_config, daemon=True).start()
-    
-    stream_width, stream_height = 480, 640
-    cam = Camera(width=stream_width, height=stream_height)
-    
-    processing_queue = queue.Queue(maxsize=5)
-    frame_queue = queue.Queue(maxsize=10)
-    command_queue = queue.Queue(maxsize=5)
-
-    detector = ObjectDetector(model_path="my_model.pt")
-    
-    processing_worker = ProcessingWorker(process_queue=processing_queue, detector=detector)
-    sender_worker = SenderWorker(frame_queue)
-    command_poller = CommandPoller(command_queue)
-    
-    workers = [processing_worker, sender_worker, command_poller]
-    for worker in workers:
-        worker.start()
-
-    cam.start()
-    set_zoom(cam.picam2, CURRENT_ZOOM, (stream_width, stream_height))
-    
-    print("✅ Hệ thống đã sẵn sàng!")
-    play_event_sound(-1)
-    print("🎥 Bắt đầu livestream...")
-    
-    previous_button_state = GPIO.LOW
-    last_status_print_time = 0
-    
+
+    processing_queue = queue.Queue(maxsize=PIPELINE_CONFIG['queue_size'])
+
+    # Detector và pipeline xử lý dùng chung cho mọi làn; phát bắn của các làn được gom batch ở công đoạn detect.
+    # Detector được nạp + warm-up trên luồng khởi động (xem bên dưới), camera và preview không phải chờ.
+    processing_worker = ProcessingWorker(process_queue=processing_queue, detector=None,
+                                         matcher_type=MATCHER_TYPE,
+                                         register_workers=PIPELINE_CONFIG['register_workers'],
+                                         render_workers=PIPELINE_CONFIG['render_workers'],
+                                         use_process_pool=PIPELINE_CONFIG['process_pool'],
+                                         stage_queue_size=PIPELINE_CONFIG['stage_queue_size'],
+                                         detect_batch_size=PIPELINE_CONFIG['detect_batch_size'])
+
+    # Gọi từ vòng lặp chụp khi server đổi zoom/tâm/matcher: chỉ cập nhật bộ nhớ, không chạm đĩa
+    on_config_changed = lambda lane_id, section: save_config(lane_id, section, processing_worker.matcher_type)
+    for section in LANE_CONFIGS:
+        lane_id = section.get('id', DEFAULT_LANE)
+        LANES.append(Lane(section, lane_server_url(lane_id), processing_queue, processing_worker,
+                          ring_depth=RING_DEPTH, on_config_changed=on_config_changed))
+
+    metrics_server = None
+    if METRICS_CONFIG.get('port'):
+        try:
+            metrics_server = MetricsServer(port=int(METRICS_CONFIG['port'])).start()
+        except OSError as e:
+            log.warning("⚠️ Không mở được endpoint metrics: %s", e)
+    metrics_pusher = None
+    if METRICS_CONFIG.get('push_interval'):
+        metrics_pusher = MetricsPusher(SERVER_MAC_URL, interval=float(METRICS_CONFIG['push_interval']),
+                                       source=",".join(lane.lane_id for lane in LANES))
+        metrics_pusher.start()
+
+    CONFIG_STORE.subscribe(lambda old, new: apply_external_config(old, new, processing_worker))
+    CONFIG_STORE.start()
+
+    # Camera/preview lên ngay; detector, âm thanh và báo cáo cấu hình khởi tạo song song
+    processing_worker.start()
+    for lane in LANES:
+        lane.start()
+
+    startup = StartupOrchestrator()
+    startup.add("detector", lambda: ObjectDetector(
+        model_path=DETECTOR_CONFIG['model'],
+        backend=DETECTOR_CONFIG['backend'],
+        imgsz=DETECTOR_CONFIG['imgsz'],
+        threads=DETECTOR_CONFIG['threads'],
+    ), on_ready=processing_worker.set_detector, on_failed=processing_worker.set_detector_failed)
+    startup.add("audio", lambda: init_audio(timeout=AUDIO_INIT_TIMEOUT))
+    startup.add("config_report", lambda: all([lane.report_config() for lane in LANES]))
+    startup.start()
+
+    announced = False
     try:
-        while True:
-            try:
-                command = command_queue.get_nowait()
-                if command.get('type') == 'center':
-                    new_center = command.get('value')
-                    if new_center:
-                        CALIBRATED_CENTER = { 'x': int(new_center.get('x')), 'y': int(new_center.get('y')) }
-                        print(f"🎯 Tâm ngắm đã được cập nhật thành: {CALIBRATED_CENTER}")
-                        save_config()
-                elif command.get('type') == 'zoom':
-                    zoom_value = command.get('value')
-                    if zoom_value:
-                        CURRENT_ZOOM = float(zoom_value)
-                        set_zoom(cam.picam2, CURRENT_ZOOM, (stream_width, stream_height))
-                        save_config()
-            except queue.Empty:
-                pass
-            
-            frame = cam.capture_frame()
-            if frame is None:
+        while any(lane.is_alive() for lane in LANES):
+            if announced:
+                time.sleep(0.5)
                 continue
-
-            if CALIBRATED_CENTER:
-                center_to_draw = (CALIBRATED_CENTER['x'], CALIBRATED_CENTER['y'])
+            # wait_all đồng thời là nhịp chờ của vòng lặp cho tới khi mọi bước khởi động xong
+            if not startup.wait_all(timeout=0.5):
+                continue
+            announced = True
+            failed = startup.failed()
+            if failed:
+                log.warning("⚠️ Hệ thống chạy với %d làn bắn nhưng khởi động thất bại: %s. Trạng thái khởi động: %s",
+                            len(LANES), ", ".join(failed), startup.status())
             else:
-                h, w, _ = frame.shape
-                center_to_draw = (w // 2, h // 2)
-            
-            cv2.drawMarker(frame, center_to_draw, (0, 0, 255), markerType=cv2.MARKER_CROSS, markerSize=30, thickness=2)
-            RING_BUFFER.append(frame)
-
-            _, jpg_buffer = cv2.imencode('.jpg', frame, [int(cv2.IMWRITE_JPEG_QUALITY), 75])
-            if not frame_queue.full():
-                frame_queue.put(jpg_buffer.tobytes())
-            
-            current_time = time.time()
-            if current_time - last_status_print_time > 3:
-                print("Hệ thống đang hoạt động, chờ trigger...")
-                last_status_print_time = current_time
-            
-            current_button_state = GPIO.input(TRIGGER_PIN)
-            if current_button_state == GPIO.HIGH and previous_button_state == GPIO.LOW:
-                capture_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                print(f"📸 Chụp ảnh lúc {capture_time}...")
-                play_event_sound(-3)
-                if len(RING_BUFFER) > 0 and not processing_queue.full():
-                    frame_to_process = RING_BUFFER[0]
-                    processing_queue.put((frame_to_process.copy(), capture_time, CALIBRATED_CENTER))
-
-            previous_button_state = current_button_state
-            time.sleep(0.01)
-                
+                log.info("✅ Hệ thống đã sẵn sàng với %d làn bắn! Trạng thái khởi động: %s", len(LANES), startup.status())
+            if startup.is_ready("audio"):
+                play_event_sound(-1)
     except KeyboardInterrupt:
-        print("\n🛑 Thoát...")
+        log.info("🛑 Thoát...")
     finally:
-        print("Đang dừng các luồng phụ...")
-        for worker in workers:
-            worker.stop()
-        for worker in workers:
-            worker.join()
-        
-        cam.stop()
+        log.info("Đang dừng các luồng phụ...")
+        shutdown(LANES, processing_worker)
+        stop_audio()
+        # Ghi nốt các thay đổi cấu hình còn đang chờ gộp
+        CONFIG_STORE.stop()
+        if metrics_pusher is not None:
+            metrics_pusher.stop()
+        if metrics_server is not None:
+            metrics_server.stop()
         cv2.destroyAllWindows()
-        GPIO.cleanup()
-        print("Đã dọn dẹp và thoát.")
+        log.info("Đã dọn dẹp và thoát.")
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
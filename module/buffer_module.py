@@ -0,0 +1,170 @@
+import numpy as np
+from threading import Lock
+from typing import Optional
+
+
+class FrameRef:
+    """
+    Tham chiếu tới một slot đang được ghim trong FrameRingBuffer.
+    Slot không bị ghi đè cho tới khi release() được gọi.
+    """
+    __slots__ = ("ring", "index", "timestamp", "received_at", "_released")
+
+    def __init__(self, ring, index, timestamp, received_at=None):
+        self.ring = ring
+        self.index = index
+        self.timestamp = timestamp
+        self.received_at = timestamp if received_at is None else received_at
+        self._released = False
+
+    @property
+    def array(self) -> np.ndarray:
+        return self.ring.frames[self.index]
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self.ring._unpin(self.index)
+
+    def detach(self) -> "DetachedFrame":
+        """Chép frame ra ngoài vòng đệm và nhả slot ngay (dùng khi quá nhiều slot đang bị ghim)."""
+        detached = DetachedFrame(self.array.copy(), self.timestamp, self.received_at)
+        self.release()
+        return detached
+
+
+class DetachedFrame:
+    """
+    Bản sao frame nằm ngoài vòng đệm (khi mọi slot đều đang bị ghim), cùng giao diện với FrameRef.
+    release() không làm gì; bộ nhớ được giải phóng khi không còn ai giữ tham chiếu.
+    """
+    __slots__ = ("array", "timestamp", "received_at")
+
+    def __init__(self, array, timestamp, received_at=None):
+        self.array = array
+        self.timestamp = timestamp
+        self.received_at = timestamp if received_at is None else received_at
+
+    def release(self):
+        pass
+
+    def detach(self) -> "DetachedFrame":
+        return self
+
+
+class FrameRingBuffer:
+    """
+    Vòng đệm frame cấp phát sẵn, mỗi slot có thời điểm chụp (time.monotonic(), dùng để chọn frame theo trigger)
+    và thời điểm frame tới vòng lặp chụp (received_at, dùng để đo độ trễ). Hai giá trị chỉ khác nhau khi
+    phát lại footage nhanh hơn thời gian thực.
+    Frame được chép thẳng vào slot có sẵn thay vì cấp phát mảng mới mỗi lần,
+    và được ghim/nhả khi chuyển sang luồng xử lý thay vì .copy().
+
+    Khi mọi slot đều bị ghim, write() trả về False và giữ một bản sao của frame mới nhất ngoài vòng đệm
+    để phát bắn kế tiếp vẫn có frame đúng thời điểm. nearest()/window() nhận 'max_offset' (giây):
+    frame lệch khỏi thời điểm bóp cò quá mức đó bị loại thay vì trả về frame cũ của phát bắn trước.
+    """
+    def __init__(self, depth: int = 4):
+        self.depth = max(2, int(depth))
+        self.frames = None
+        self.timestamps = np.full(self.depth, np.nan)
+        self.received = np.full(self.depth, np.nan)
+        self.pins = np.zeros(self.depth, dtype=np.int32)
+        self.next_index = 0
+        self.overflow = None
+        self.lock = Lock()
+
+    def _allocate(self, frame: np.ndarray):
+        self.frames = np.empty((self.depth,) + frame.shape, dtype=frame.dtype)
+        self.timestamps[:] = np.nan
+        self.received[:] = np.nan
+        self.pins[:] = 0
+
+    def write(self, frame: np.ndarray, timestamp: float, received_at: Optional[float] = None) -> bool:
+        """
+        Chép frame vào slot kế tiếp chưa bị ghim. Trả về False nếu mọi slot đều đang được ghim.
+        """
+        if received_at is None:
+            received_at = timestamp
+        with self.lock:
+            if self.frames is None or self.frames.shape[1:] != frame.shape or self.frames.dtype != frame.dtype:
+                if self.pins.any():
+                    return False
+                self._allocate(frame)
+            for offset in range(self.depth):
+                index = (self.next_index + offset) % self.depth
+                if self.pins[index] == 0:
+                    break
+            else:
+                self.overflow = DetachedFrame(frame.copy(), timestamp, received_at)
+                return False
+            self.overflow = None
+            # Đánh dấu slot đang ghi để không ai ghim được trong lúc chép
+            self.timestamps[index] = np.nan
+            self.next_index = (index + 1) % self.depth
+        np.copyto(self.frames[index], frame)
+        with self.lock:
+            self.timestamps[index] = timestamp
+            self.received[index] = received_at
+        return True
+
+    def _pin(self, index: int) -> FrameRef:
+        self.pins[index] += 1
+        return FrameRef(self, index, float(self.timestamps[index]), float(self.received[index]))
+
+    def _unpin(self, index: int):
+        with self.lock:
+            self.pins[index] -= 1
+
+    def _valid(self, timestamp: float, max_offset: Optional[float]) -> np.ndarray:
+        valid = ~np.isnan(self.timestamps)
+        if max_offset is not None:
+            valid &= np.abs(np.nan_to_num(self.timestamps, nan=np.inf) - timestamp) <= max_offset
+        return valid
+
+    def _overflow_near(self, timestamp: float, max_offset: Optional[float]) -> Optional[DetachedFrame]:
+        overflow = self.overflow
+        if overflow is None or (max_offset is not None and abs(overflow.timestamp - timestamp) > max_offset):
+            return None
+        return overflow
+
+    def nearest(self, timestamp: float, max_offset: Optional[float] = None):
+        """
+        Ghim và trả về frame có thời điểm chụp gần 'timestamp' nhất (FrameRef, hoặc DetachedFrame nếu
+        bản sao ngoài vòng đệm gần hơn). None nếu không có frame nào lệch không quá 'max_offset'.
+        """
+        with self.lock:
+            valid = self._valid(timestamp, max_offset)
+            overflow = self._overflow_near(timestamp, max_offset)
+            if not valid.any():
+                return overflow
+            diffs = np.where(valid, np.abs(self.timestamps - timestamp), np.inf)
+            index = int(np.argmin(diffs))
+            if overflow is not None and abs(overflow.timestamp - timestamp) < diffs[index]:
+                return overflow
+            return self._pin(index)
+
+    def window(self, timestamp: float, before: int, after: int, max_offset: Optional[float] = None) -> list:
+        """
+        Ghim các frame quanh 'timestamp': tối đa 'before' frame trước và 'after' frame sau (theo thời gian),
+        chỉ lấy frame lệch không quá 'max_offset'. Bản sao ngoài vòng đệm (nếu có) được tính như một frame.
+        """
+        with self.lock:
+            valid = np.nonzero(self._valid(timestamp, max_offset))[0]
+            order = valid[np.argsort(self.timestamps[valid])]
+            frames = [(float(self.timestamps[i]), int(i)) for i in order]
+            overflow = self._overflow_near(timestamp, max_offset)
+            if overflow is not None:
+                frames = sorted(frames + [(overflow.timestamp, -1)])
+            earlier = [f for f in frames if f[0] <= timestamp][-before:] if before > 0 else []
+            later = [f for f in frames if f[0] > timestamp][:after] if after > 0 else []
+            return [overflow if i < 0 else self._pin(i) for _, i in earlier + later]
+
+    def pinned_slots(self) -> int:
+        """Số slot đang bị ghim (mỗi phát bắn đang xử lý giữ ít nhất một slot)."""
+        with self.lock:
+            return int(np.count_nonzero(self.pins))
+
+    def __len__(self):
+        with self.lock:
+            return int((~np.isnan(self.timestamps)).sum())
@@ -1,11 +1,111 @@
-from picamera2 import Picamera2
-
-class Camera:
-    def __init__(self, width=1280, height=720):
-        self.picam2 = Picamera2()
-        preview_config = self.picam2.create_preview_configuration(
-            main={"size": (width, height), "format": "RGB888"}
-        )
+import csv
+import glob
+import os
+import queue
+import time
+from threading import Thread
+
+import cv2
+
+from utils.logger import get_logger
+
+log = get_logger("camera")
+
+# Các nguồn camera có thể chọn trong cấu hình làn ("camera" -> "source")
+SOURCE_PICAMERA2 = "picamera2"
+SOURCE_OPENCV = "opencv"
+SOURCE_REPLAY = "replay"
+
+REPLAY_REALTIME = "realtime"
+REPLAY_MAX = "max"
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+
+_END_OF_LOOP = "loop"
+_END_OF_REPLAY = "end"
+
+
+def lores_size_for(stream_size, lores_size):
+    """
+    Kích thước luồng preview (lores) cùng tỉ lệ khung với luồng chính: ScalerCrop áp dụng chung cho
+    cả hai luồng nên lệch tỉ lệ sẽ làm ảnh preview bị kéo giãn và tọa độ tâm ngắm quy đổi sai.
+    Kích thước làm tròn về số chẵn (YUV420 yêu cầu).
+    """
+    if lores_size is None:
+        return None
+    stream_width, stream_height = stream_size
+    width = int(lores_size[0]) // 2 * 2
+    height = int(round(width * stream_height / stream_width)) // 2 * 2
+    if (width, height) != tuple(lores_size):
+        log.warning("⚠️ Luồng preview %s lệch tỉ lệ với luồng chính %s, dùng %s.", tuple(lores_size), stream_size, (width, height))
+    return width, height
+
+
+class CameraSource:
+    """
+    Giao diện chung của nguồn khung hình: start() -> capture_frames() lặp lại -> stop().
+
+    Hai luồng: luồng chính (stream_size, độ phân giải đầy đủ để chấm điểm) và luồng preview nhỏ
+    (lores_size, để nén livestream). capture_frames() trả về (frame chính, frame preview) dạng BGR;
+    không cấu hình lores thì frame preview chính là frame chính. (None, None) nếu chưa có frame;
+    finished = True khi nguồn đã hết. frame_timestamp() là thời điểm (giây, cùng đồng hồ với TriggerEvent)
+    của frame vừa lấy, dùng để ghi vào vòng đệm.
+    """
+    name = None
+
+    def __init__(self, width, height, lores_size=None):
+        self.stream_size = (width, height)
+        self.lores_size = lores_size_for(self.stream_size, lores_size)
+        self.finished = False
+
+    @property
+    def preview_size(self):
+        return self.lores_size or self.stream_size
+
+    def make_lores(self, frame):
+        if self.lores_size is None:
+            return frame
+        return cv2.resize(frame, self.lores_size, interpolation=cv2.INTER_AREA)
+
+    def start(self):
+        pass
+
+    def frame_timestamp(self):
+        """Camera thật: frame vừa lấy là frame mới nhất, đóng dấu bằng đồng hồ monotonic ngay sau khi lấy."""
+        return time.monotonic()
+
+    def capture_frame(self):
+        raise NotImplementedError
+
+    def capture_frames(self):
+        frame = self.capture_frame()
+        if frame is None:
+            return None, None
+        return frame, self.make_lores(frame)
+
+    def set_zoom(self, zoom_factor):
+        pass
+
+    def stop(self):
+        pass
+
+
+class Camera(CameraSource):
+    """
+    Camera Pi qua Picamera2. Import picamera2 chỉ khi thật sự dùng nguồn này.
+    Có lores_size thì ISP xuất đồng thời luồng chính RGB888 và luồng lores YUV420 từ cùng một lần chụp.
+    """
+    name = SOURCE_PICAMERA2
+
+    def __init__(self, width=1280, height=720, camera_num=0, lores_size=None):
+        super().__init__(width, height, lores_size)
+        from picamera2 import Picamera2
+        self.picam2 = Picamera2(camera_num)
+        streams = {'main': {"size": (width, height), "format": "RGB888"}}
+        if self.lores_size is not None:
+            # Trên Pi, luồng lores chỉ hỗ trợ định dạng YUV
+            streams['lores'] = {"size": self.lores_size, "format": "YUV420"}
+        preview_config = self.picam2.create_preview_configuration(**streams)
         self.picam2.configure(preview_config)
 
 #khởi động
@@ -14,6 +114,274 @@ class Camera:
 #chụp hình
     def capture_frame(self):
         return self.picam2.capture_array()
+
+    def capture_frames(self):
+        if self.lores_size is None:
+            frame = self.capture_frame()
+            return frame, frame
+        # Lấy cả hai luồng từ cùng một request để frame preview và frame chấm điểm khớp thời điểm
+        request = self.picam2.capture_request()
+        try:
+            frame = request.make_array("main")
+            lores = request.make_array("lores")
+        finally:
+            request.release()
+        # Mảng YUV420 của lores có độ rộng bằng stride (được căn lề), cắt bỏ phần đệm sau khi đổi màu
+        return frame, cv2.cvtColor(lores, cv2.COLOR_YUV2BGR_I420)[:, :self.lores_size[0]]
+#zoom kỹ thuật số (ScalerCrop giữ đúng tỉ lệ khung của stream)
+    def set_zoom(self, zoom_factor):
+        if zoom_factor < 1.0: zoom_factor = 1.0
+        full_width, full_height = self.picam2.camera_properties['PixelArraySize']
+        stream_width, stream_height = self.stream_size
+        target_aspect_ratio = stream_width / stream_height
+        crop_width = full_width / zoom_factor
+        crop_height = full_height / zoom_factor
+        new_crop_width = crop_height * target_aspect_ratio
+        if new_crop_width <= crop_width:
+            crop_width = new_crop_width
+        else:
+            crop_height = crop_width / target_aspect_ratio
+        crop_x = (full_width - crop_width) / 2
+        crop_y = (full_height - crop_height) / 2
+        crop_region = (int(crop_x), int(crop_y), int(crop_width), int(crop_height))
+        self.picam2.set_controls({"ScalerCrop": crop_region})
+        log.info("🔎 Đã thiết lập zoom kỹ thuật số: %sx", zoom_factor)
 #thoát
     def stop(self):
         self.picam2.stop()
+
+
+def software_zoom(frame, zoom_factor, stream_size):
+    """Zoom kỹ thuật số bằng phần mềm: cắt vùng giữa theo tỉ lệ khung của stream rồi resize về stream_size."""
+    stream_width, stream_height = stream_size
+    h, w = frame.shape[:2]
+    if zoom_factor > 1.0 or (w, h) != (stream_width, stream_height):
+        target_aspect_ratio = stream_width / stream_height
+        crop_width, crop_height = w / max(1.0, zoom_factor), h / max(1.0, zoom_factor)
+        if crop_height * target_aspect_ratio <= crop_width:
+            crop_width = crop_height * target_aspect_ratio
+        else:
+            crop_height = crop_width / target_aspect_ratio
+        x, y = int((w - crop_width) / 2), int((h - crop_height) / 2)
+        frame = frame[y:y + int(crop_height), x:x + int(crop_width)]
+        frame = cv2.resize(frame, (stream_width, stream_height), interpolation=cv2.INTER_LINEAR)
+    return frame
+
+
+class OpenCVCamera(CameraSource):
+    """Webcam USB / thiết bị V4L2 qua OpenCV, dùng khi chạy trên máy dev. Zoom làm bằng phần mềm."""
+    name = SOURCE_OPENCV
+
+    def __init__(self, width=1280, height=720, device=0, lores_size=None):
+        super().__init__(width, height, lores_size)
+        self.device = device
+        self.capture = None
+        self.zoom = 1.0
+
+    def start(self):
+        backend = cv2.CAP_V4L2 if isinstance(self.device, int) and os.name == "posix" else cv2.CAP_ANY
+        self.capture = cv2.VideoCapture(self.device, backend)
+        self.capture.set(cv2.CAP_PROP_FRAME_WIDTH, self.stream_size[0])
+        self.capture.set(cv2.CAP_PROP_FRAME_HEIGHT, self.stream_size[1])
+        # Giữ bộ đệm driver nhỏ nhất để frame đọc ra là frame mới nhất
+        self.capture.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        if not self.capture.isOpened():
+            raise RuntimeError(f"Không mở được camera OpenCV: {self.device}")
+
+    def capture_frame(self):
+        ok, frame = self.capture.read()
+        if not ok:
+            return None
+        return software_zoom(frame, self.zoom, self.stream_size)
+
+    def set_zoom(self, zoom_factor):
+        self.zoom = max(1.0, float(zoom_factor))
+        log.info("🔎 Đã thiết lập zoom phần mềm: %sx", self.zoom)
+
+    def stop(self):
+        if self.capture is not None:
+            self.capture.release()
+
+
+def load_timestamp_log(path):
+    """Đọc file thời điểm (mỗi dòng một số giây, bỏ dòng trống và dòng '#'). Không có file -> []."""
+    if not path or not os.path.exists(path):
+        return []
+    with open(path, 'r') as f:
+        return sorted(float(line.split(',')[0]) for line in f if line.strip() and not line.startswith('#'))
+
+
+class ReplayCamera(CameraSource):
+    """
+    Phát lại footage đã ghi để tái hiện lỗi hiệu năng và đo throughput ngoài Pi.
+
+    'path' là một thư mục ảnh hoặc một file video:
+      - Thư mục: các ảnh frame (sắp theo tên) + tùy chọn 'frames.csv' (cột file,timestamp tính bằng giây)
+        và 'triggers.txt' (mỗi dòng một thời điểm bóp cò, cùng đồng hồ với frames.csv).
+      - Video: thời điểm lấy từ CAP_PROP_POS_MSEC, log trigger ở '<video>.triggers.txt'.
+    Không có thời điểm thì coi như quay đều ở 'fps'.
+
+    speed = "realtime" giữ đúng nhịp như lúc ghi, "max" phát nhanh nhất có thể.
+    attach_trigger(gpio, pin) cho FakeGPIO phát cạnh trigger khi footage chạy tới thời điểm trong log.
+    Trigger phát lại không qua chống dội theo đồng hồ thật (log đã được lọc lúc ghi), nên "max" không
+    nuốt mất những lần bóp cò sát nhau; triggers_fired chỉ đếm các cạnh đã thực sự tới TriggerInput.
+    Frame và trigger được đóng dấu bằng thời điểm ghi dời sang đồng hồ monotonic (_clock_offset + timestamp),
+    không phải lúc vòng lặp chụp nhận frame, nên ở "max" khoảng cách frame/trigger vẫn đúng như lúc ghi.
+    """
+    name = SOURCE_REPLAY
+
+    def __init__(self, path, width=480, height=640, speed=REPLAY_REALTIME, loop=False, fps=30.0, triggers=None,
+                 prefetch=4, lores_size=None):
+        super().__init__(width, height, lores_size)
+        self.path = path
+        self.speed = speed
+        self.loop = loop
+        self.fps = fps
+        self.is_video = os.path.isfile(path)
+        self.frames = [] if self.is_video else self._load_frame_index(path)
+        default_log = f"{path}.triggers.txt" if self.is_video else os.path.join(path, "triggers.txt")
+        self.trigger_times = load_timestamp_log(triggers or default_log)
+        self.gpio = None
+        self.trigger_pin = None
+        self.frames_played = 0
+        self.triggers_fired = 0
+        self._queue = queue.Queue(maxsize=max(1, prefetch))
+        self._reader = Thread(target=self._read_loop, daemon=True)
+        self._running = False
+        self._clock_offset = None
+        self._last_timestamp = None
+        self._next_trigger = 0
+
+    def _load_frame_index(self, directory):
+        index_path = os.path.join(directory, "frames.csv")
+        if os.path.exists(index_path):
+            with open(index_path, 'r', newline='') as f:
+                rows = [(os.path.join(directory, r['file']), float(r['timestamp'])) for r in csv.DictReader(f)]
+            return sorted(rows, key=lambda r: r[1])
+        files = sorted(p for p in glob.glob(os.path.join(directory, "*")) if p.lower().endswith(IMAGE_EXTENSIONS))
+        return [(p, i / self.fps) for i, p in enumerate(files)]
+
+    def attach_trigger(self, gpio, pin):
+        self.gpio = gpio
+        self.trigger_pin = pin
+
+    def _iter_frames(self):
+        """Sinh (ảnh BGR, timestamp) theo thứ tự ghi."""
+        if self.is_video:
+            capture = cv2.VideoCapture(self.path)
+            try:
+                index = 0
+                while self._running:
+                    ok, frame = capture.read()
+                    if not ok:
+                        return
+                    pos_ms = capture.get(cv2.CAP_PROP_POS_MSEC)
+                    yield frame, (pos_ms / 1000.0 if pos_ms > 0 else index / self.fps)
+                    index += 1
+            finally:
+                capture.release()
+        else:
+            for file_path, timestamp in self.frames:
+                if not self._running:
+                    return
+                frame = cv2.imread(file_path)
+                if frame is not None:
+                    yield frame, timestamp
+
+    def _read_loop(self):
+        # Giải mã trước vài frame trên luồng riêng để tốc độ đọc đĩa không lẫn vào số đo của pipeline
+        while self._running:
+            for frame, timestamp in self._iter_frames():
+                if (frame.shape[1], frame.shape[0]) != self.stream_size:
+                    frame = cv2.resize(frame, self.stream_size, interpolation=cv2.INTER_LINEAR)
+                # Luồng preview cũng được tạo sẵn ở đây, ngoài vòng lặp chụp
+                self._queue.put((frame, self.make_lores(frame), timestamp))
+            if not self.loop:
+                break
+            # Hết một vòng: báo capture_frames đặt lại đồng hồ và log trigger
+            self._queue.put((None, None, _END_OF_LOOP))
+        self._queue.put((None, None, _END_OF_REPLAY))
+
+    def start(self):
+        if not self.is_video and not self.frames:
+            raise RuntimeError(f"Không có frame nào để phát lại trong: {self.path}")
+        self._running = True
+        self._reader.start()
+        log.info("📼 Phát lại footage '%s' (%s, %d lần trigger)", self.path, self.speed, len(self.trigger_times))
+
+    def _fire_triggers(self, timestamp):
+        while self._next_trigger < len(self.trigger_times) and self.trigger_times[self._next_trigger] <= timestamp:
+            trigger_time = self.trigger_times[self._next_trigger]
+            self._next_trigger += 1
+            if self.gpio is not None and self.gpio.fire(self.trigger_pin, debounce=False,
+                                                        timestamp=self._clock_offset + trigger_time):
+                self.triggers_fired += 1
+
+    def frame_timestamp(self):
+        if self._last_timestamp is None:
+            return time.monotonic()
+        return self._last_timestamp
+
+    def capture_frame(self):
+        return self.capture_frames()[0]
+
+    def capture_frames(self):
+        try:
+            frame, lores, timestamp = self._queue.get(timeout=1.0)
+        except queue.Empty:
+            return None, None
+        if frame is None:
+            if timestamp == _END_OF_LOOP:
+                self._clock_offset = None
+                self._next_trigger = 0
+            else:
+                self.finished = True
+            return None, None
+
+        if self._clock_offset is None:
+            # Vòng phát mới bắt đầu sau frame cuối của vòng trước (ở "max" đồng hồ phát lại có thể đi trước
+            # đồng hồ thật), để timestamp trong vòng đệm không bị lùi
+            start = time.monotonic()
+            if self._last_timestamp is not None:
+                start = max(start, self._last_timestamp + 1.0 / self.fps)
+            self._clock_offset = start - timestamp
+        if self.speed == REPLAY_REALTIME:
+            delay = self._clock_offset + timestamp - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        self.frames_played += 1
+        self._last_timestamp = self._clock_offset + timestamp
+        # Trigger tới hạn được phát cùng frame này; Lane ghi frame vào vòng đệm trước khi đọc sự kiện trigger,
+        # nên ring_buffer.nearest() chọn đúng frame ghi gần lúc bóp cò nhất
+        self._fire_triggers(timestamp)
+        return frame, lores
+
+    def stop(self):
+        self._running = False
+        # Giải phóng luồng đọc nếu nó đang chờ chỗ trống trong hàng đợi
+        while not self._queue.empty():
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                break
+
+
+def create_camera(config):
+    """
+    Tạo nguồn camera từ cấu hình làn ("camera": {"source", "num", "width", "height", "lores", "path", ...}).
+    "lores": {"width", "height"} bật chế độ hai luồng (preview nhỏ + luồng chính độ phân giải đầy đủ).
+    """
+    source = config.get('source', SOURCE_PICAMERA2)
+    width, height = config.get('width', 480), config.get('height', 640)
+    lores = config.get('lores')
+    lores_size = (lores['width'], lores['height']) if lores else None
+    if source == SOURCE_REPLAY:
+        return ReplayCamera(config['path'], width=width, height=height,
+                            speed=config.get('speed', REPLAY_REALTIME), loop=config.get('loop', False),
+                            fps=config.get('fps', 30.0), triggers=config.get('triggers'), lores_size=lores_size)
+    if source == SOURCE_OPENCV:
+        return OpenCVCamera(width=width, height=height, device=config.get('device', config.get('num', 0)),
+                            lores_size=lores_size)
+    if source != SOURCE_PICAMERA2:
+        log.warning("⚠️ Nguồn camera không hợp lệ '%s', dùng '%s'.", source, SOURCE_PICAMERA2)
+    return Camera(width=width, height=height, camera_num=config.get('num', 0), lores_size=lores_size)
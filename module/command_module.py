@@ -0,0 +1,147 @@
+import queue
+import time
+import requests
+from threading import Thread, Event
+
+from utils import metrics
+from utils.logger import get_logger
+from utils.network import create_session
+
+log = get_logger("command")
+
+# Trạng thái gửi kèm ack: đã áp dụng, bị từ chối (loại lệnh lạ hoặc giá trị không hợp lệ), lỗi khi áp dụng
+COMMAND_APPLIED = "applied"
+COMMAND_REJECTED = "rejected"
+COMMAND_FAILED = "failed"
+
+
+class CommandPoller(Thread):
+    """
+    Nhận lệnh từ server qua HTTP long-poll trên một kết nối keep-alive:
+    GET /command_stream?after=<seq> được server giữ tới khi có lệnh mới (hoặc hết thời gian chờ),
+    nên lệnh tới gần như ngay lập tức và lúc rảnh không có request lặp mỗi giây.
+    Mỗi lệnh có số thứ tự 'seq'; sau khi áp dụng, vòng lặp chính gọi ack() để báo lại cho server.
+    Server gửi kèm header X-Command-Epoch (đổi mỗi lần server khởi động lại) và X-Command-Seq (seq mới nhất);
+    epoch đổi hoặc seq lùi lại thì đếm lại từ đầu để không bỏ sót lệnh của server vừa khởi động lại.
+    Server cũ chưa có /command_stream thì quay về polling /get_command, và thử lại /command_stream
+    sau mỗi 'probe_interval' giây (server có thể chỉ tạm trả 404 khi đang cập nhật).
+    """
+    def __init__(self, command_queue, server_url, wait_timeout=25.0, max_backoff=10.0, probe_interval=60.0,
+                 lane="default"):
+        super().__init__()
+        self.lane = lane
+        self._received_counter = metrics.counter("commands_received_total", "Số lệnh nhận từ server", lane=lane)
+        self._error_counter = metrics.counter("command_poll_errors_total", "Số lần long-poll lệnh thất bại", lane=lane)
+        self._ack_error_counter = metrics.counter("command_ack_errors_total", "Số lần gửi ack lệnh thất bại", lane=lane)
+        self._poll_histogram = metrics.histogram("command_poll_ms", "Thời gian một lượt long-poll lệnh",
+                                                 buckets=(10, 100, 1000, 5000, 10000, 30000), lane=lane)
+        self.command_queue = command_queue
+        self.server_url = server_url
+        self.wait_timeout = wait_timeout
+        self.max_backoff = max_backoff
+        self.session = create_session(pool_size=2)
+        self.last_seq = 0
+        self.epoch = None
+        self.legacy_mode = False
+        self.probe_interval = probe_interval
+        self._legacy_since = None
+        self.acks = queue.Queue()
+        self._stop_event = Event()
+        self._ack_thread = Thread(target=self._ack_loop, daemon=True)
+        self.daemon = True
+        self.running = True
+
+    def _sync_sequence(self, response):
+        """Server khởi động lại (epoch đổi hoặc seq mới nhất nhỏ hơn seq đã nhận): đếm lại seq từ 0."""
+        epoch = response.headers.get('X-Command-Epoch')
+        latest = response.headers.get('X-Command-Seq')
+        restarted = epoch is not None and self.epoch is not None and epoch != self.epoch
+        if not restarted and latest is not None:
+            try:
+                restarted = int(latest) < self.last_seq
+            except ValueError:
+                pass
+        if restarted:
+            log.warning("⚠️ Server lệnh đã khởi động lại (seq %d -> %s), nhận lệnh lại từ đầu.", self.last_seq, latest)
+            self.last_seq = 0
+        if epoch is not None:
+            self.epoch = epoch
+
+    def _poll_stream(self):
+        params = {'after': self.last_seq, 'timeout': self.wait_timeout}
+        if self.epoch is not None:
+            params['epoch'] = self.epoch
+        response = self.session.get(
+            f"{self.server_url}/command_stream",
+            params=params,
+            timeout=(2.0, self.wait_timeout + 5.0),
+        )
+        if response.status_code == 404:
+            log.warning("⚠️ Server chưa hỗ trợ /command_stream, quay về polling /get_command "
+                        "(thử lại sau %.0fs).", self.probe_interval)
+            self.legacy_mode = True
+            self._legacy_since = time.monotonic()
+            return
+        response.raise_for_status()
+        self._sync_sequence(response)
+        if response.status_code == 204:
+            return
+        for command in response.json().get('commands', []):
+            seq = int(command.get('seq', 0))
+            if seq and seq <= self.last_seq:
+                continue
+            self.last_seq = max(self.last_seq, seq)
+            self.command_queue.put(command)
+            self._received_counter.inc()
+
+    def _poll_legacy(self):
+        response = self.session.get(f"{self.server_url}/get_command", timeout=1.0)
+        if response.status_code == 200:
+            command = response.json()
+            if command:
+                self.command_queue.put(command)
+                self._received_counter.inc()
+        self._stop_event.wait(1.0)
+
+    def run(self):
+        self._ack_thread.start()
+        backoff = 0.0
+        while self.running:
+            try:
+                if self.legacy_mode and time.monotonic() - self._legacy_since >= self.probe_interval:
+                    # Thử lại long-poll; vẫn 404 thì _poll_stream bật lại legacy_mode
+                    self.legacy_mode = False
+                with self._poll_histogram.time():
+                    if self.legacy_mode:
+                        self._poll_legacy()
+                    else:
+                        self._poll_stream()
+                backoff = 0.0
+            except (requests.exceptions.RequestException, ValueError):
+                self._error_counter.inc()
+                # Mất kết nối: thử kết nối lại với thời gian chờ tăng dần
+                backoff = min(self.max_backoff, max(0.5, backoff * 2))
+                self._stop_event.wait(backoff)
+
+    def ack(self, command, status=COMMAND_APPLIED):
+        """Báo cho server kết quả áp dụng lệnh (COMMAND_APPLIED/REJECTED/FAILED), không chặn vòng lặp chính."""
+        seq = command.get('seq')
+        if seq is not None:
+            self.acks.put({'seq': seq, 'type': command.get('type'), 'status': status})
+
+    def _ack_loop(self):
+        while self.running:
+            try:
+                ack = self.acks.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            try:
+                self.session.post(f"{self.server_url}/command_ack", json=ack, timeout=2.0)
+            except requests.exceptions.RequestException as e:
+                self._ack_error_counter.inc()
+                log.warning("⚠️ Không gửi được xác nhận lệnh #%s: %s", ack['seq'], e)
+
+    def stop(self):
+        self.running = False
+        self._stop_event.set()
+        self.session.close()
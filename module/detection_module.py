@@ -1,13 +1,282 @@
-from ultralytics import YOLO
-import torch
+import time
+import cv2
+import numpy as np
+
+from utils import metrics
+from utils.logger import get_logger
+
+log = get_logger("detector")
+
+# Các backend suy luận có thể chọn trong config.json ("detector" -> "backend")
+BACKEND_TORCH = "torch"
+BACKEND_ONNX = "onnx"
+
+
+class _Array:
+    """Bọc mảng NumPy với .cpu().numpy() để giống tensor của Ultralytics."""
+    def __init__(self, data):
+        self.data = data
+
+    def cpu(self):
+        return self
+
+    def numpy(self):
+        return self.data
+
+    def __len__(self):
+        return len(self.data)
+
+
+class Boxes:
+    def __init__(self, xyxy, conf, cls):
+        self.xyxy = _Array(np.asarray(xyxy, dtype=np.float32).reshape(-1, 4))
+        self.conf = _Array(np.asarray(conf, dtype=np.float32).reshape(-1))
+        self.cls = _Array(np.asarray(cls, dtype=np.float32).reshape(-1))
+
+    def __len__(self):
+        return len(self.conf)
+
+
+class Detections:
+    """Kết quả cùng dạng results[0].boxes.xyxy/.conf của Ultralytics để check_object_center dùng được."""
+    def __init__(self, boxes: Boxes):
+        self.boxes = boxes
+
+    @classmethod
+    def empty(cls):
+        return cls(Boxes(np.zeros((0, 4), dtype=np.float32), np.zeros(0, dtype=np.float32),
+                         np.zeros(0, dtype=np.float32)))
+
+
+def letterbox(frame, size):
+    """Resize giữ tỉ lệ rồi đệm viền về (size, size). Trả về (ảnh, tỉ lệ, (pad_x, pad_y))."""
+    h, w = frame.shape[:2]
+    ratio = min(size / h, size / w)
+    new_w, new_h = int(round(w * ratio)), int(round(h * ratio))
+    resized = cv2.resize(frame, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+    pad_x, pad_y = (size - new_w) // 2, (size - new_h) // 2
+    canvas = np.full((size, size, 3), 114, dtype=np.uint8)
+    canvas[pad_y:pad_y + new_h, pad_x:pad_x + new_w] = resized
+    return canvas, ratio, (pad_x, pad_y)
+
+
+def preprocess(frame, size):
+    """Frame BGR -> tensor float32 NCHW RGB [0, 1] cho mô hình ONNX."""
+    canvas, ratio, pad = letterbox(frame, size)
+    blob = cv2.cvtColor(canvas, cv2.COLOR_BGR2RGB).transpose(2, 0, 1)[np.newaxis].astype(np.float32) / 255.0
+    return blob, ratio, pad
+
+
+class TorchBackend:
+    """Backend gốc: Ultralytics/PyTorch. Import torch chỉ khi thật sự dùng backend này."""
+    name = BACKEND_TORCH
+
+    def __init__(self, model_path, imgsz=640, threads=4):
+        import torch
+        from ultralytics import YOLO
+        torch.set_num_threads(threads)
+        self.device = "cuda" if torch.cuda.is_available() else "cpu"
+        self.model = YOLO(model_path).to(self.device)
+        self.imgsz = imgsz
+
+    def detect(self, frame, conf=0.5, imgsz=None):
+        return self.model.predict(frame, conf=conf, imgsz=imgsz or self.imgsz, device=self.device, verbose=False)
+
+    def detect_batch(self, frames, conf=0.5, imgsz=None):
+        """Suy luận nhiều frame trong một lần gọi mô hình. Trả về danh sách kết quả cùng dạng detect()."""
+        results = self.model.predict(list(frames), conf=conf, imgsz=imgsz or self.imgsz, device=self.device, verbose=False)
+        return [[r] for r in results]
+
+
+class OnnxBackend:
+    """
+    Backend ONNX Runtime cho mô hình YOLO đã export (xem export_model.py), hỗ trợ cả mô hình int8.
+    Kích thước đầu vào cố định theo mô hình nếu export với kích thước tĩnh.
+    """
+    name = BACKEND_ONNX
+
+    def __init__(self, model_path, imgsz=640, threads=4, iou_threshold=0.45):
+        import onnxruntime as ort
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = threads
+        options.inter_op_num_threads = 1
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+        fixed_size = model_input.shape[2] if len(model_input.shape) == 4 else None
+        self.dynamic_input = not isinstance(fixed_size, int)
+        self.imgsz = imgsz if self.dynamic_input else fixed_size
+        self.device = "cpu"
+        self.iou_threshold = iou_threshold
+
+    def detect(self, frame, conf=0.5, imgsz=None):
+        # Mô hình export kích thước tĩnh chỉ nhận đúng kích thước đó
+        size = imgsz if (imgsz and self.dynamic_input) else self.imgsz
+        blob, ratio, (pad_x, pad_y) = preprocess(frame, size)
+        output = self.session.run(None, {self.input_name: blob})[0]
+        # Đầu ra YOLOv8: (1, 4 + số lớp, số anchor) -> (số anchor, 4 + số lớp)
+        preds = np.squeeze(output, axis=0).T
+        class_scores = preds[:, 4:]
+        class_ids = np.argmax(class_scores, axis=1)
+        scores = class_scores[np.arange(len(preds)), class_ids]
+        keep = scores >= conf
+        preds, scores, class_ids = preds[keep], scores[keep], class_ids[keep]
+        if len(preds) == 0:
+            return [Detections.empty()]
+
+        cx, cy, bw, bh = preds[:, 0], preds[:, 1], preds[:, 2], preds[:, 3]
+        xyxy = np.stack([cx - bw / 2, cy - bh / 2, cx + bw / 2, cy + bh / 2], axis=1)
+        xyxy[:, [0, 2]] = (xyxy[:, [0, 2]] - pad_x) / ratio
+        xyxy[:, [1, 3]] = (xyxy[:, [1, 3]] - pad_y) / ratio
+        h, w = frame.shape[:2]
+        xyxy[:, [0, 2]] = xyxy[:, [0, 2]].clip(0, w)
+        xyxy[:, [1, 3]] = xyxy[:, [1, 3]].clip(0, h)
+
+        nms_boxes = [[float(x1), float(y1), float(x2 - x1), float(y2 - y1)] for x1, y1, x2, y2 in xyxy]
+        indices = cv2.dnn.NMSBoxes(nms_boxes, scores.astype(float).tolist(), conf, self.iou_threshold)
+        # NMSBoxes trả về tuple rỗng khi không giữ box nào; ép kiểu để dùng làm chỉ số
+        indices = np.asarray(indices, dtype=np.int64).reshape(-1)
+        if len(indices) == 0:
+            return [Detections.empty()]
+        order = indices[np.argsort(-scores[indices])]
+        return [Detections(Boxes(xyxy[order], scores[order], class_ids[order]))]
+
+    def detect_batch(self, frames, conf=0.5, imgsz=None):
+        # Mô hình export với batch cố định = 1 nên chạy lần lượt từng frame
+        return [self.detect(frame, conf=conf, imgsz=imgsz) for frame in frames]
+
+
+def to_detections(results, offset=(0, 0)):
+    """Chuyển kết quả của bất kỳ backend nào về Detections, cộng thêm offset (x, y) cho các box."""
+    if not results or results[0].boxes is None or len(results[0].boxes) == 0:
+        return Detections.empty()
+    boxes = results[0].boxes
+    xyxy = boxes.xyxy.cpu().numpy().astype(np.float32).copy()
+    xyxy[:, [0, 2]] += offset[0]
+    xyxy[:, [1, 3]] += offset[1]
+    return Detections(Boxes(xyxy, boxes.conf.cpu().numpy(), boxes.cls.cpu().numpy()))
+
+
+def create_backend(backend, model_path, imgsz=640, threads=4):
+    if backend == BACKEND_ONNX:
+        return OnnxBackend(model_path, imgsz=imgsz, threads=threads)
+    if backend != BACKEND_TORCH:
+        log.warning("⚠️ Backend detector không hợp lệ '%s', dùng '%s'.", backend, BACKEND_TORCH)
+    return TorchBackend(model_path, imgsz=imgsz, threads=threads)
+
 
 class ObjectDetector:
-    def __init__(self, model_path="my_model.pt"):
-        device = "cuda" if torch.cuda.is_available() else "cpu"
-        print(f"🔍 Detector running on: {device}")
-        self.model = YOLO(model_path).to(device)
-        self.device = device
-
-    def detect(self, frame, conf=0.5):
-        return self.model.predict(frame, conf=conf, device=self.device, verbose=False)
- # nhận diện mặt bia tin cậy trên 50%
\ No newline at end of file
+    """
+    Detector bia. Khi đã biết bounding box của bia (confirm_box), chỉ chạy mô hình trên cửa sổ
+    quanh box đó với kích thước đầu vào nhỏ hơn; không thấy gì, hoặc box chạm mép cửa sổ (bia có thể đã dịch
+    ra ngoài ROI và bị cắt), thì quay lại chạy toàn khung hình.
+    Box được lưu theo 'key' (mã làn bắn) để nhiều làn dùng chung một detector.
+    """
+    def __init__(self, model_path="my_model.pt", backend=BACKEND_TORCH, imgsz=640, threads=4, warmup=True,
+                 roi_imgsz=320, roi_padding=0.25, roi_border_margin=2):
+        self.backend = create_backend(backend, model_path, imgsz=imgsz, threads=threads)
+        self.device = self.backend.device
+        self.imgsz = self.backend.imgsz
+        self.roi_imgsz = roi_imgsz
+        self.roi_padding = roi_padding
+        self.roi_border_margin = roi_border_margin
+        self.last_boxes = {}
+        self._roi_miss_counter = metrics.counter("detector_roi_misses_total", "Số lần không thấy bia trong ROI")
+        self._roi_border_counter = metrics.counter("detector_roi_border_total",
+                                                   "Số lần box chạm mép ROI, phải chạy lại toàn khung hình")
+        self._batch_histogram = metrics.histogram("detector_batch_size", "Số frame mỗi lần gọi detect_batch",
+                                                  buckets=(1, 2, 4, 8))
+        log.info("🔍 Detector running on: %s (%s, imgsz=%s)", self.device, self.backend.name, self.imgsz)
+        if warmup:
+            self.warmup()
+
+    def warmup(self, runs=2):
+        """Chạy thử vài lần để phát bắn đầu tiên không phải chịu thời gian khởi tạo của runtime."""
+        dummy = np.zeros((self.imgsz, self.imgsz, 3), dtype=np.uint8)
+        start = time.perf_counter()
+        for _ in range(runs):
+            self.backend.detect(dummy, conf=0.5)
+        log.info("🔥 Detector đã warm-up trong %.0f ms", (time.perf_counter() - start) * 1000)
+
+    def confirm_box(self, box, key=None):
+        """Ghi nhận bounding box (x1, y1, x2, y2) của bia vừa trúng để lần sau suy luận theo ROI."""
+        self.last_boxes[key] = tuple(int(v) for v in box)
+
+    def reset_roi(self, key=None):
+        """Bỏ ROI của một làn, hoặc của tất cả các làn nếu key = None."""
+        if key is None:
+            self.last_boxes.clear()
+        else:
+            self.last_boxes.pop(key, None)
+
+    def _roi_window(self, frame, key=None):
+        box = self.last_boxes.get(key)
+        if box is None:
+            return None
+        h, w = frame.shape[:2]
+        x1, y1, x2, y2 = box
+        pad_x = int((x2 - x1) * self.roi_padding)
+        pad_y = int((y2 - y1) * self.roi_padding)
+        rx1, ry1, rx2, ry2 = max(0, x1 - pad_x), max(0, y1 - pad_y), min(w, x2 + pad_x), min(h, y2 + pad_y)
+        if rx2 <= rx1 or ry2 <= ry1:
+            return None
+        return rx1, ry1, rx2, ry2
+
+    def _touches_roi_border(self, detections, window, frame_shape):
+        """Box nằm sát mép cửa sổ ROI ở phía không trùng mép khung hình: bia có thể bị cắt bởi ROI."""
+        rx1, ry1, rx2, ry2 = window
+        h, w = frame_shape[:2]
+        margin = self.roi_border_margin
+        xyxy = detections.boxes.xyxy.cpu().numpy()
+        touches = np.zeros(len(xyxy), dtype=bool)
+        if rx1 > 0:
+            touches |= xyxy[:, 0] <= rx1 + margin
+        if ry1 > 0:
+            touches |= xyxy[:, 1] <= ry1 + margin
+        if rx2 < w:
+            touches |= xyxy[:, 2] >= rx2 - margin
+        if ry2 < h:
+            touches |= xyxy[:, 3] >= ry2 - margin
+        return bool(touches.any())
+
+    def detect(self, frame, conf=0.5, key=None):
+        return self.detect_batch([frame], conf=conf, keys=[key])[0]
+
+    def detect_batch(self, frames, conf=0.5, keys=None):
+        """
+        Nhận diện trên nhiều frame (ví dụ các phát bắn của nhiều làn tới cùng lúc) với ít lần gọi mô hình nhất:
+        các frame có ROI chạy chung một batch ở roi_imgsz, frame nào không thấy bia trong ROI
+        được gom với các frame chưa có ROI để chạy một batch toàn khung hình.
+        """
+        keys = list(keys) if keys is not None else [None] * len(frames)
+        self._batch_histogram.observe(len(frames))
+        results = [None] * len(frames)
+        roi_items = []
+        for i, (frame, key) in enumerate(zip(frames, keys)):
+            window = self._roi_window(frame, key)
+            if window is not None:
+                roi_items.append((i, window))
+
+        if roi_items:
+            crops = [frames[i][ry1:ry2, rx1:rx2] for i, (rx1, ry1, rx2, ry2) in roi_items]
+            roi_results = self.backend.detect_batch(crops, conf=conf, imgsz=self.roi_imgsz)
+            for (i, window), roi_result in zip(roi_items, roi_results):
+                detections = to_detections(roi_result, offset=window[:2])
+                if len(detections.boxes) > 0 and self._touches_roi_border(detections, window, frames[i].shape):
+                    self._roi_border_counter.inc()
+                    log.info("🔍 Bia chạm mép ROI, chạy lại trên toàn khung hình.")
+                    self.last_boxes.pop(keys[i], None)
+                elif len(detections.boxes) > 0:
+                    results[i] = [detections]
+                else:
+                    self._roi_miss_counter.inc()
+                    log.info("🔍 Không thấy bia trong ROI, chạy lại trên toàn khung hình.")
+                    self.last_boxes.pop(keys[i], None)
+
+        full_indices = [i for i, r in enumerate(results) if r is None]
+        if full_indices:
+            full_results = self.backend.detect_batch([frames[i] for i in full_indices], conf=conf)
+            for i, full_result in zip(full_indices, full_results):
+                results[i] = full_result
+        return results
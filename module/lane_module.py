@@ -0,0 +1,372 @@
+import logging
+import math
+import queue
+import time
+import requests
+from threading import Thread
+
+from module.camera_module import ReplayCamera, create_camera
+from module.trigger_module import FakeGPIO, TriggerInput
+from module.buffer_module import FrameRingBuffer
+from module.stream_module import SenderWorker, PreviewEncoder
+from module.publish_module import ResultPublisher, IMAGE_MODE_THUMBNAIL, IMAGE_MODE_FULL
+from module.command_module import CommandPoller, COMMAND_APPLIED, COMMAND_REJECTED, COMMAND_FAILED
+from utils import metrics
+from utils.audio import play_event_sound
+from utils.image import sharpness_scores
+from utils.logger import get_logger
+from utils.matching import MATCHER_EXACT, MATCHER_APPROX
+
+log = get_logger("lane")
+
+DEFAULT_TARGET_PATH = "targets/bia_so_4.json"
+# Chụp loạt quanh lúc bóp cò: 'before' frame tới lúc bóp cò (tính cả frame gần nhất), 'after' frame sau đó;
+# chọn 'top_k' frame nét nhất (độ nét đo trên vùng 'radius' px quanh tâm ngắm). before + after = 1 là tắt.
+DEFAULT_BURST = {'before': 2, 'after': 2, 'top_k': 1, 'radius': 64, 'timeout': 0.5}
+# Frame lệch khỏi lúc bóp cò quá số chu kỳ frame này coi như frame cũ (vòng đệm bị ghim hết, camera khựng)
+MAX_FRAME_OFFSET = 1.5
+
+
+class Lane(Thread):
+    """
+    Một làn bắn: camera, chân trigger, hiệu chỉnh zoom/tâm ngắm, loại bia và kênh server riêng.
+    Mỗi làn chạy vòng lặp chụp trên luồng của mình; detector và pipeline xử lý dùng chung giữa các làn.
+    """
+    def __init__(self, section, server_url, processing_queue, processing_worker, ring_depth=12, on_config_changed=None):
+        super().__init__()
+        self.lane_id = section.get('id', 'lane1')
+        self.zoom = float(section.get('zoom', 1.0))
+        self.center = section.get('center')
+        self.target_path = section.get('target', DEFAULT_TARGET_PATH)
+        self.trigger_pin = int(section.get('trigger_pin', 17))
+        self.camera_config = { 'source': 'picamera2', 'num': 0, 'width': 480, 'height': 640, **section.get('camera', {}) }
+        self.burst = { **DEFAULT_BURST, **(section.get('burst') or {}) }
+        # server_url trong cấu hình làn (nếu có) ghi đè kênh mặc định do main.py cấp
+        self.configured_server_url = section.get('server_url')
+        self.server_url = self.configured_server_url or server_url
+        self.processing_queue = processing_queue
+        self.processing_worker = processing_worker
+        self.on_config_changed = on_config_changed
+
+        self.camera = create_camera(self.camera_config)
+        if isinstance(self.camera, ReplayCamera):
+            # Footage phát lại tự bóp cò theo log trigger đã ghi qua GPIO giả lập
+            gpio = FakeGPIO()
+            self.camera.attach_trigger(gpio, self.trigger_pin)
+            self.trigger = TriggerInput(pin=self.trigger_pin, gpio=gpio)
+        else:
+            self.trigger = TriggerInput(pin=self.trigger_pin)
+        # Vòng đệm frame sạch (chưa vẽ overlay) kèm thời điểm chụp, dùng để chọn frame gần lúc bóp cò
+        self.ring_buffer = FrameRingBuffer(depth=ring_depth)
+        # Các lần bóp cò đang chờ đủ frame sau trigger: [event, số frame đã chụp sau trigger]
+        self._pending_bursts = []
+        # Chu kỳ frame ước lượng (trung bình trượt), dùng để loại frame cũ khi chọn frame cho phát bắn
+        self._frame_interval = None
+        self._last_frame_timestamp = None
+        # Mỗi phát bắn đang xử lý ghim top_k slot; phần còn lại phải đủ cho một loạt chụp mới.
+        # Phát bắn vượt quá số này vẫn được xử lý nhưng trên bản sao frame (xem _submit_shot)
+        burst_frames = max(1, self.burst['before'] + self.burst['after'])
+        self.max_in_flight = (self.ring_buffer.depth - burst_frames) // max(1, int(self.burst['top_k']))
+        if self.max_in_flight < 2:
+            log.warning("⚠️ [%s] ring_depth=%d chỉ đủ cho %d phát bắn đang xử lý (loạt %d frame, top_k=%s); "
+                        "nên tăng ring_depth.", self.lane_id, self.ring_buffer.depth, self.max_in_flight,
+                        burst_frames, self.burst['top_k'])
+        # Hàng đợi stream ngắn: frame mới đẩy frame cũ ra để không tích lũy độ trễ
+        self.sender_worker = SenderWorker(queue.Queue(maxsize=2), self.server_url, lane=self.lane_id)
+        self.preview_encoder = PreviewEncoder(self.sender_worker)
+        self.command_queue = queue.Queue()
+        self.command_poller = CommandPoller(self.command_queue, self.server_url, lane=self.lane_id)
+        self.spool_path = section.get('spool', f"spool/{self.lane_id}.db")
+        self.result_publisher = ResultPublisher(self.server_url, spool_path=self.spool_path, lane=self.lane_id)
+        self.workers = [self.result_publisher, self.sender_worker, self.preview_encoder, self.command_poller]
+        processing_worker.add_lane(self.lane_id, self.target_path, self.result_publisher)
+
+        self._capture_histogram = metrics.histogram("capture_ms", "Thời gian lấy một frame từ camera", lane=self.lane_id)
+        self._fps_meter = metrics.FpsMeter(metrics.gauge("capture_fps", "FPS vòng lặp chụp", lane=self.lane_id))
+        self._trigger_counter = metrics.counter("triggers_total", "Số lần bóp cò", lane=self.lane_id)
+        self._shot_drop_counter = metrics.counter("shots_dropped_total", "Số phát bắn bị bỏ", lane=self.lane_id)
+        self.shots_dropped = 0
+        self._detached_counter = metrics.counter("shots_detached_total",
+                                                 "Số phát bắn được chép frame ra ngoài vòng đệm do quá nhiều slot bị ghim",
+                                                 lane=self.lane_id)
+        self._unbuffered_counter = metrics.counter("frames_unbuffered_total",
+                                                   "Số frame không ghi được vào vòng đệm (mọi slot bị ghim)",
+                                                   lane=self.lane_id)
+        self._burst_histogram = metrics.histogram("burst_select_ms", "Thời gian chấm độ nét loạt frame", lane=self.lane_id)
+
+        self.daemon = True
+        self.running = True
+
+    def section(self):
+        """Cấu hình hiện tại của làn (để lưu lại vào config.json)."""
+        return {
+            'id': self.lane_id,
+            'zoom': self.zoom,
+            'center': self.center,
+            'target': self.target_path,
+            'trigger_pin': self.trigger_pin,
+            'camera': self.camera_config,
+            'burst': self.burst,
+            'server_url': self.configured_server_url,
+        }
+
+    def report_config(self):
+        """Gửi cấu hình đã tải từ file lên server của làn. Trả về True nếu gửi được."""
+        config_data = { 'lane': self.lane_id, 'zoom': self.zoom, 'center': self.center }
+        try:
+            requests.post(f"{self.server_url}/report_config", json=config_data, timeout=10)
+            log.info("📢 [%s] Đã báo cáo cấu hình ban đầu lên server: %s", self.lane_id, config_data)
+            return True
+        except requests.exceptions.RequestException as e:
+            log.warning("⚠️ [%s] Không thể báo cáo cấu hình ban đầu: %s", self.lane_id, e)
+            return False
+
+    def scoring_center(self):
+        """
+        Tâm ngắm được hiệu chỉnh trên ảnh preview (server nhận luồng preview); quy đổi sang
+        tọa độ luồng chính để chấm điểm. Hai luồng cùng ScalerCrop nên chỉ khác tỉ lệ.
+        """
+        if not self.center:
+            return self.center
+        preview_width, preview_height = self.camera.preview_size
+        stream_width, stream_height = self.camera.stream_size
+        return {
+            'x': int(round(self.center['x'] * stream_width / preview_width)),
+            'y': int(round(self.center['y'] * stream_height / preview_height)),
+        }
+
+    def _config_changed(self):
+        if self.on_config_changed is not None:
+            self.on_config_changed(self.lane_id, self.section())
+
+    def _parse_center(self, value):
+        """
+        Tâm ngắm {'x', 'y'[, 'scale']} bấm trên ảnh livestream, quy về tọa độ ảnh preview gốc.
+        'scale' là X-Preview-Scale của frame server hiển thị; server không gửi thì dùng tỉ lệ của frame
+        gần nhất đã gửi. Ném ValueError nếu thiếu, sai kiểu hoặc nằm ngoài khung.
+        """
+        if not isinstance(value, dict):
+            raise ValueError(f"tâm ngắm phải là {{'x', 'y'}}, nhận được {value!r}")
+        try:
+            scale = float(value.get('scale', self.preview_encoder.sent_scale))
+            x, y = float(value['x']) / scale, float(value['y']) / scale
+        except (KeyError, TypeError, ValueError, ZeroDivisionError):
+            raise ValueError(f"tâm ngắm không hợp lệ: {value!r}")
+        if not (0.0 < scale <= 1.0):
+            raise ValueError(f"tỉ lệ preview không hợp lệ: {value!r}")
+        preview_width, preview_height = self.camera.preview_size
+        if not (0 <= x < preview_width and 0 <= y < preview_height):
+            raise ValueError(f"tâm ngắm {value!r} nằm ngoài khung preview {preview_width}x{preview_height}")
+        return {'x': int(x), 'y': int(y)}
+
+    @staticmethod
+    def _parse_zoom(value):
+        try:
+            zoom = float(value)
+        except (TypeError, ValueError):
+            raise ValueError(f"zoom không hợp lệ: {value!r}")
+        if not math.isfinite(zoom) or zoom < 1.0:
+            raise ValueError(f"zoom phải >= 1.0, nhận được {value!r}")
+        return zoom
+
+    def _apply_command(self, command_type, value):
+        """Áp dụng một lệnh đã kiểm tra; ném ValueError nếu loại lệnh lạ hoặc giá trị không hợp lệ."""
+        if command_type == 'center':
+            self.center = self._parse_center(value)
+            log.info("🎯 [%s] Tâm ngắm đã được cập nhật thành: %s", self.lane_id, self.center)
+            self._config_changed()
+        elif command_type == 'zoom':
+            self.zoom = self._parse_zoom(value)
+            self.camera.set_zoom(self.zoom)
+            self.processing_worker.reset_tracking(self.lane_id)
+            self._config_changed()
+        elif command_type == 'matcher':
+            if value not in (MATCHER_EXACT, MATCHER_APPROX):
+                raise ValueError(f"matcher không hợp lệ: {value!r}")
+            self.processing_worker.set_matcher(value)
+            self._config_changed()
+        elif command_type == 'result_image':
+            if value not in (IMAGE_MODE_THUMBNAIL, IMAGE_MODE_FULL):
+                raise ValueError(f"chế độ ảnh kết quả không hợp lệ: {value!r}")
+            self.result_publisher.set_image_mode(value)
+        elif command_type == 'full_image':
+            if not value or not isinstance(value, str):
+                raise ValueError(f"shot_id không hợp lệ: {value!r}")
+            self.result_publisher.request_full_image(value)
+        else:
+            raise ValueError(f"loại lệnh không hỗ trợ: {command_type!r}")
+
+    def apply_command(self, command):
+        """Áp dụng lệnh từ server và báo lại (theo seq) là đã áp dụng, bị từ chối hay lỗi. Không bao giờ ném lỗi."""
+        if not isinstance(command, dict):
+            log.warning("⚠️ [%s] Bỏ qua lệnh không đúng định dạng: %r", self.lane_id, command)
+            return
+        try:
+            self._apply_command(command.get('type'), command.get('value'))
+            status = COMMAND_APPLIED
+        except ValueError as e:
+            status = COMMAND_REJECTED
+            log.warning("⚠️ [%s] Từ chối lệnh %s: %s", self.lane_id, command, e)
+        except Exception as e:
+            status = COMMAND_FAILED
+            log.error("❌ [%s] Lỗi khi áp dụng lệnh %s: %s", self.lane_id, command, e)
+        self.command_poller.ack(command, status=status)
+
+    def _handle_trigger(self, event):
+        capture_time = event.capture_time_str()
+        log.info("📸 [%s] Chụp ảnh lúc %s...", self.lane_id, capture_time)
+        self._trigger_counter.inc()
+        play_event_sound(-3)
+        if self.burst['before'] + self.burst['after'] > 1:
+            # Chờ vòng lặp chụp có thêm 'after' frame rồi mới chọn (xem _collect_bursts)
+            self._pending_bursts.append([event, 0])
+            return
+        frame_ref = self.ring_buffer.nearest(event.timestamp, max_offset=self._max_frame_offset(1))
+        self._submit_shot([frame_ref] if frame_ref is not None else [], capture_time)
+
+    def _max_frame_offset(self, frames):
+        """Độ lệch tối đa (giây) giữa lúc bóp cò và frame thứ 'frames' tính từ đó."""
+        if self._frame_interval is None:
+            return None
+        return (frames - 1 + MAX_FRAME_OFFSET) * self._frame_interval
+
+    def _track_frame_interval(self, frame_timestamp):
+        if self._last_frame_timestamp is not None:
+            interval = frame_timestamp - self._last_frame_timestamp
+            self._frame_interval = interval if self._frame_interval is None else 0.9 * self._frame_interval + 0.1 * interval
+        self._last_frame_timestamp = frame_timestamp
+
+    def _collect_bursts(self, frame_timestamp, flush=False):
+        """Gọi sau mỗi frame ghi vào vòng đệm: loạt nào đã đủ frame sau trigger (hoặc quá hạn) thì chọn frame."""
+        for pending in list(self._pending_bursts):
+            event = pending[0]
+            if frame_timestamp > event.timestamp:
+                pending[1] += 1
+            if not flush and pending[1] < self.burst['after'] and frame_timestamp - event.timestamp < self.burst['timeout']:
+                continue
+            self._pending_bursts.remove(pending)
+            max_offset = self._max_frame_offset(max(self.burst['before'], self.burst['after']))
+            frame_refs = self.ring_buffer.window(event.timestamp, self.burst['before'], self.burst['after'],
+                                                 max_offset=max_offset)
+            self._submit_shot(self._select_sharpest(frame_refs), event.capture_time_str())
+
+    def _select_sharpest(self, frame_refs):
+        """Giữ lại top_k frame nét nhất của loạt (theo thứ tự nét giảm dần), nhả các slot còn lại."""
+        if len(frame_refs) <= 1:
+            return frame_refs
+        with self._burst_histogram.time():
+            center = self.scoring_center()
+            if center:
+                center = (center['x'], center['y'])
+            else:
+                h, w = frame_refs[0].array.shape[:2]
+                center = (w // 2, h // 2)
+            scores = sharpness_scores([ref.array for ref in frame_refs], center, radius=self.burst['radius'])
+        order = sorted(range(len(frame_refs)), key=lambda i: scores[i], reverse=True)
+        keep = max(1, int(self.burst['top_k']))
+        for i in order[keep:]:
+            frame_refs[i].release()
+        log.debug("[%s] Độ nét loạt: %s -> chọn %s", self.lane_id,
+                  [round(float(s), 1) for s in scores], order[:keep])
+        return [frame_refs[i] for i in order[:keep]]
+
+    def _drop_shot(self, frame_refs):
+        for frame_ref in frame_refs:
+            frame_ref.release()
+        self.shots_dropped += 1
+        self._shot_drop_counter.inc()
+
+    def _submit_shot(self, frame_refs, capture_time):
+        if not frame_refs:
+            self._drop_shot(frame_refs)
+            log.warning("⚠️ [%s] Không có frame nào gần lúc bóp cò %s, bỏ qua phát bắn.", self.lane_id, capture_time)
+            return
+        # Giới hạn số slot vòng đệm bị ghim để luôn còn đủ slot trống cho loạt chụp kế tiếp: phát bắn vượt quá
+        # được chép frame ra ngoài vòng đệm và nhả slot ngay, không bị bỏ
+        in_flight_limit = self.max_in_flight * max(1, int(self.burst['top_k']))
+        if self.ring_buffer.pinned_slots() > in_flight_limit:
+            frame_refs = [frame_ref.detach() for frame_ref in frame_refs]
+            self._detached_counter.inc()
+            log.info("📋 [%s] Đã có %d phát bắn đang xử lý, phát bắn lúc %s dùng bản sao frame.",
+                     self.lane_id, self.max_in_flight, capture_time)
+        if self.processing_queue.full():
+            self._drop_shot(frame_refs)
+            log.warning("⚠️ [%s] Hàng đợi xử lý đầy (%d), bỏ phát bắn lúc %s!",
+                        self.lane_id, self.processing_queue.qsize(), capture_time)
+            return
+        # Chuyển tham chiếu các slot đã ghim (nét nhất trước), ProcessingWorker sẽ release() khi xử lý xong
+        self.processing_queue.put((frame_refs, capture_time, self.scoring_center(), self.lane_id))
+
+    def run(self):
+        for worker in self.workers:
+            worker.start()
+        self.trigger.start()
+        self.camera.start()
+        self.camera.set_zoom(self.zoom)
+        log.info("🎥 [%s] Bắt đầu livestream...", self.lane_id)
+
+        last_status_print_time = 0
+        try:
+            while self.running:
+                try:
+                    self.apply_command(self.command_queue.get_nowait())
+                except queue.Empty:
+                    pass
+
+                with self._capture_histogram.time():
+                    frame, preview_frame = self.camera.capture_frames()
+                # Camera thật: lúc vừa lấy frame; phát lại: thời điểm ghi của frame trên cùng đồng hồ với trigger
+                frame_timestamp = self.camera.frame_timestamp()
+                received_at = time.monotonic()
+                if frame is None:
+                    if self.camera.finished:
+                        log.info("📼 [%s] Nguồn camera đã hết frame.", self.lane_id)
+                        self._collect_bursts(frame_timestamp, flush=True)
+                        break
+                    continue
+
+                # Vòng đệm chỉ giữ frame độ phân giải đầy đủ để chấm điểm
+                if not self.ring_buffer.write(frame, frame_timestamp, received_at):
+                    # Mọi slot đang bị ghim: vòng đệm giữ tạm một bản sao để phát bắn kế tiếp vẫn có frame mới
+                    self._unbuffered_counter.inc()
+                    log.warning("⚠️ [%s] Vòng đệm đầy (%d slot bị ghim), dùng bản sao frame.",
+                                self.lane_id, self.ring_buffer.pinned_slots())
+                self._track_frame_interval(frame_timestamp)
+                self._fps_meter.tick()
+
+                # Preview nén từ luồng nhỏ; overlay và nén JPEG do PreviewEncoder làm trên luồng riêng.
+                # Không có luồng lores thì preview_frame chính là frame đã được chép vào vòng đệm.
+                center_to_draw = (self.center['x'], self.center['y']) if self.center else None
+                self.preview_encoder.submit(preview_frame, center_to_draw)
+
+                # Trạng thái chi tiết nằm ở endpoint metrics; dòng này chỉ in khi LOG_LEVEL=DEBUG
+                current_time = time.monotonic()
+                if current_time - last_status_print_time > 3:
+                    if log.isEnabledFor(logging.DEBUG):
+                        log.debug("[%s] Hệ thống đang hoạt động, chờ trigger... Stream: %s | Preview: %s",
+                                  self.lane_id, self.sender_worker.metrics(), self.preview_encoder.metrics())
+                    last_status_print_time = current_time
+
+                for event in self.trigger.get_events():
+                    self._handle_trigger(event)
+                if self._pending_bursts:
+                    self._collect_bursts(frame_timestamp)
+        finally:
+            self.camera.stop()
+            self.trigger.stop()
+
+    def stop_capture(self, timeout=2.0):
+        """Ngừng vòng lặp chụp/trigger; các worker mạng (và spool kết quả) vẫn chạy để nhận nốt kết quả."""
+        self.running = False
+        if self.is_alive():
+            self.join(timeout)
+
+    def stop_workers(self):
+        for worker in self.workers:
+            worker.stop()
+        for worker in self.workers:
+            worker.join(timeout=2.0)
+
+    def stop(self):
+        self.stop_capture()
+        self.stop_workers()
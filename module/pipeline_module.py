@@ -0,0 +1,123 @@
+import queue
+import time
+from threading import Thread, Lock, Condition
+
+
+class Stage:
+    """
+    Một công đoạn của pipeline: hàm xử lý, số luồng worker và kích thước hàng đợi đầu vào.
+    Với batch_size > 1, hàm nhận một danh sách gồm các item đang chờ sẵn (tối đa batch_size).
+    """
+    def __init__(self, name, func, workers=1, queue_size=8, batch_size=1):
+        self.name = name
+        self.func = func
+        self.workers = max(1, int(workers))
+        self.batch_size = max(1, int(batch_size))
+        self.queue = queue.Queue(maxsize=queue_size)
+
+    @property
+    def batched(self):
+        return self.batch_size > 1
+
+    def take_batch(self, first):
+        """Gom thêm các item đang có sẵn trong hàng đợi, không chờ."""
+        items = [first]
+        while len(items) < self.batch_size:
+            try:
+                items.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return items
+
+
+class StagedPipeline:
+    """
+    Pipeline nhiều công đoạn, mỗi công đoạn có hàng đợi giới hạn và số worker riêng.
+    Hàng đợi đầy thì công đoạn trước phải chờ (backpressure) thay vì bỏ phát bắn.
+    Các công đoạn nhiều worker có thể làm xong lệch thứ tự; 'sink' luôn nhận item theo đúng thứ tự submit.
+
+    Mỗi item cần có thuộc tính 'seq' (do pipeline gán), 'timings' (dict) và 'error'.
+    """
+    def __init__(self, stages, sink, on_error=None):
+        self.stages = stages
+        self.sink = sink
+        self.on_error = on_error
+        self.running = True
+        self.threads = []
+        self._next_seq = 0
+        self._seq_lock = Lock()
+        self._pending = {}
+        self._next_to_emit = 0
+        self._emit_lock = Condition()
+        for index, stage in enumerate(stages):
+            for n in range(stage.workers):
+                thread = Thread(target=self._stage_loop, args=(index,), name=f"{stage.name}-{n}", daemon=True)
+                self.threads.append(thread)
+
+    def start(self):
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, item, timeout=None):
+        """Đưa item vào công đoạn đầu tiên (chặn nếu đầy). Trả về số thứ tự của item."""
+        with self._seq_lock:
+            item.seq = self._next_seq
+            self._next_seq += 1
+        self.stages[0].queue.put(item, timeout=timeout)
+        return item.seq
+
+    def _stage_loop(self, index):
+        stage = self.stages[index]
+        while self.running:
+            try:
+                first = stage.queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            items = stage.take_batch(first) if stage.batched else [first]
+            todo = [item for item in items if item.error is None]
+            if todo:
+                start = time.perf_counter()
+                try:
+                    stage.func(todo) if stage.batched else stage.func(todo[0])
+                except Exception as e:
+                    for item in todo:
+                        item.error = e
+                        if self.on_error is not None:
+                            self.on_error(stage.name, item, e)
+                elapsed_ms = (time.perf_counter() - start) * 1000.0
+                for item in todo:
+                    item.timings[stage.name] = elapsed_ms
+            # Item lỗi vẫn đi tiếp tới cuối để giữ thứ tự và để sink dọn dẹp tài nguyên
+            for item in items:
+                if index + 1 < len(self.stages):
+                    self.stages[index + 1].queue.put(item)
+                else:
+                    self._emit(item)
+                stage.queue.task_done()
+
+    def _emit(self, item):
+        """Bộ đệm sắp xếp lại: chỉ gọi sink khi mọi item có seq nhỏ hơn đã được gọi."""
+        with self._emit_lock:
+            self._pending[item.seq] = item
+            while self._next_to_emit in self._pending:
+                ready = self._pending.pop(self._next_to_emit)
+                self._next_to_emit += 1
+                try:
+                    self.sink(ready)
+                except Exception as e:
+                    if self.on_error is not None:
+                        self.on_error("sink", ready, e)
+            self._emit_lock.notify_all()
+
+    def drain(self, timeout=None):
+        """Chờ mọi item đã submit đi hết tới sink. Trả về False nếu hết 'timeout' mà vẫn còn item."""
+        with self._emit_lock:
+            return self._emit_lock.wait_for(lambda: self._next_to_emit >= self._next_seq, timeout)
+
+    def queue_depths(self):
+        return {stage.name: stage.queue.qsize() for stage in self.stages}
+
+    def stop(self):
+        self.running = False
+        for thread in self.threads:
+            thread.join(timeout=1.0)
@@ -0,0 +1,213 @@
+import hashlib
+import json
+import queue
+import random
+import time
+import cv2
+import requests
+from collections import OrderedDict, deque
+from threading import Thread, Lock, Event
+
+from utils import metrics
+from utils.logger import get_logger
+from utils.network import create_session, put_drop_oldest
+from utils.spool import ResultSpool, DEFAULT_SPOOL_PATH
+
+log = get_logger("publish")
+
+# Ảnh kết quả gửi kèm điểm: ảnh thu nhỏ (mặc định) hoặc ảnh đầy đủ
+IMAGE_MODE_THUMBNAIL = "thumbnail"
+IMAGE_MODE_FULL = "full"
+
+
+def encode_jpeg(image, quality, max_side=None):
+    if max_side is not None:
+        h, w = image.shape[:2]
+        scale = max_side / max(h, w)
+        if scale < 1.0:
+            image = cv2.resize(image, (int(w * scale), int(h * scale)), interpolation=cv2.INTER_AREA)
+    _, buffer = cv2.imencode('.jpg', image, [int(cv2.IMWRITE_JPEG_QUALITY), int(quality)])
+    return buffer.tobytes()
+
+
+class ResultPublisher(Thread):
+    """
+    Gửi kết quả chấm điểm lên server trên một luồng riêng: metadata JSON + ảnh JPEG dạng multipart
+    (không base64) qua Session keep-alive.
+
+    publish() nén ảnh và ghi kết quả vào spool SQLite ngay trên luồng xử lý rồi đi tiếp, không kết quả
+    nào bị bỏ. Luồng mạng chỉ đọc spool và gửi theo lô; mất mạng thì kết quả nằm lại trong spool và
+    được gửi bù với backoff (theo số lần gửi lỗi lưu trong spool) khi server hoạt động trở lại.
+    Ảnh đầy đủ của các phát bắn gần nhất được giữ lại để server yêu cầu khi cần (request_full_image).
+    """
+    def __init__(self, server_url, image_mode=IMAGE_MODE_THUMBNAIL, thumbnail_size=320, thumbnail_quality=70,
+                 full_quality=90, cache_size=20, queue_size=10, timeout=(1.0, 5.0),
+                 spool_path=DEFAULT_SPOOL_PATH, batch_size=20, min_backoff=1.0, max_backoff=30.0, lane="default"):
+        super().__init__()
+        self.lane = lane
+        self.upload_url = f"{server_url}/processed_data_upload"
+        self.image_url = f"{server_url}/processed_image_upload"
+        self.image_mode = image_mode
+        self.thumbnail_size = thumbnail_size
+        self.thumbnail_quality = thumbnail_quality
+        self.full_quality = full_quality
+        self.cache_size = cache_size
+        self.timeout = timeout
+        self.session = create_session(pool_size=2)
+        self.spool = ResultSpool(spool_path)
+        self.batch_size = batch_size
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self._next_attempt = 0.0
+        self._wake = Event()
+        # Chỉ chứa yêu cầu ảnh đầy đủ từ server; kết quả đi thẳng vào spool
+        self.jobs = queue.Queue(maxsize=queue_size)
+        self.full_images = OrderedDict()
+        self._lock = Lock()
+        self.daemon = True
+        self.running = True
+        self.results_sent = 0
+        self.last_upload_ms = 0.0
+        # Mẫu thời gian gần nhất (ms) của việc nén ảnh và gửi lô, để benchmark tính phân vị
+        self.timing_samples = {'encode': deque(maxlen=1000), 'publish': deque(maxlen=1000)}
+        self._encode_histogram = metrics.histogram("result_encode_ms", "Thời gian nén ảnh kết quả", lane=lane)
+        self._publish_histogram = metrics.histogram("result_publish_ms", "Thời gian gửi một lô kết quả", lane=lane)
+        self._sent_counter = metrics.counter("results_sent_total", "Số kết quả đã gửi lên server", lane=lane)
+        self._error_counter = metrics.counter("result_publish_errors_total", "Số lần gửi lô kết quả lỗi", lane=lane)
+        metrics.gauge("queue_depth", "Số phần tử đang chờ trong hàng đợi", func=self.jobs.qsize,
+                      queue="publish", lane=lane)
+        metrics.gauge("spool_pending", "Số kết quả trong spool chưa gửi được", func=lambda: len(self.spool), lane=lane)
+
+    def publish(self, result_data, image):
+        """Gọi từ luồng xử lý: nén ảnh và ghi vào spool (không chờ mạng), rồi đánh thức luồng gửi."""
+        self._spool_result(result_data, image)
+        self._wake.set()
+
+    def request_full_image(self, shot_id):
+        """Server yêu cầu ảnh đầy đủ của một phát bắn đã gửi ảnh thu nhỏ."""
+        put_drop_oldest(self.jobs, shot_id)
+        self._wake.set()
+
+    def set_image_mode(self, mode):
+        if mode in (IMAGE_MODE_THUMBNAIL, IMAGE_MODE_FULL):
+            self.image_mode = mode
+            log.info("🖼️ Ảnh kết quả gửi lên server: %s", mode)
+
+    def _remember(self, shot_id, image):
+        with self._lock:
+            self.full_images[shot_id] = image
+            while len(self.full_images) > self.cache_size:
+                self.full_images.popitem(last=False)
+
+    def _post(self, url, metadata, image_bytes, filename):
+        files = {
+            'metadata': (None, json.dumps(metadata, ensure_ascii=False), 'application/json'),
+            'image': (filename, image_bytes, 'image/jpeg'),
+        }
+        start = time.perf_counter()
+        response = self.session.post(url, files=files, timeout=self.timeout)
+        response.raise_for_status()
+        self.last_upload_ms = (time.perf_counter() - start) * 1000.0
+
+    def _spool_result(self, result_data, image):
+        """Nén ảnh và ghi kết quả vào spool; việc gửi đi do _replay() trên luồng mạng làm."""
+        shot_id = result_data['shot_id']
+        self._remember(shot_id, image)
+        start = time.perf_counter()
+        if self.image_mode == IMAGE_MODE_FULL:
+            image_bytes = encode_jpeg(image, self.full_quality)
+        else:
+            image_bytes = encode_jpeg(image, self.thumbnail_quality, self.thumbnail_size)
+        encode_ms = (time.perf_counter() - start) * 1000.0
+        self.timing_samples['encode'].append(encode_ms)
+        self._encode_histogram.observe(encode_ms)
+        self.spool.append(shot_id, dict(result_data, image_kind=self.image_mode), image_bytes)
+
+    def _send_full_image(self, shot_id):
+        with self._lock:
+            image = self.full_images.get(shot_id)
+        if image is None:
+            log.warning("⚠️ Không còn ảnh đầy đủ của phát bắn %s.", shot_id)
+            return
+        metadata = {'shot_id': shot_id, 'image_kind': IMAGE_MODE_FULL}
+        self._post(self.image_url, metadata, encode_jpeg(image, self.full_quality), f"{shot_id}_full.jpg")
+
+    def _replay(self):
+        """
+        Gửi kết quả trong spool theo lô. Mỗi kết quả mang shot_id và mỗi lô mang Idempotency-Key
+        để server bỏ qua bản trùng khi một lô được gửi lại. Lỗi mạng thì lùi thời điểm thử lại (backoff).
+        """
+        while self.running:
+            batch = self.spool.fetch_batch(self.batch_size)
+            if not batch:
+                return
+            ids = [row_id for row_id, _, _, _ in batch]
+            shot_ids = [shot_id for _, shot_id, _, _ in batch]
+            files = [('metadata', (None, json.dumps([metadata for _, _, metadata, _ in batch], ensure_ascii=False),
+                                   'application/json'))]
+            files += [(f"image_{shot_id}", (f"{shot_id}.jpg", image, 'image/jpeg')) for _, shot_id, _, image in batch]
+            idempotency_key = hashlib.sha1(",".join(shot_ids).encode('utf-8')).hexdigest()
+            start = time.perf_counter()
+            try:
+                response = self.session.post(self.upload_url, files=files, headers={'Idempotency-Key': idempotency_key},
+                                             timeout=self.timeout)
+                response.raise_for_status()
+            except requests.exceptions.RequestException as e:
+                # Số lần lỗi nằm trong spool nên backoff vẫn giữ đúng sau khi khởi động lại
+                attempts = self.spool.mark_attempt(ids)
+                self._error_counter.inc()
+                backoff = min(self.max_backoff, self.min_backoff * 2 ** max(0, attempts - 1))
+                # Jitter để nhiều làn không cùng lúc dồn request khi mạng trở lại
+                self._next_attempt = time.monotonic() + backoff * random.uniform(0.5, 1.5)
+                log.warning("❌ Lỗi khi gửi dữ liệu xử lý (%d kết quả chờ gửi, thử lại sau %.0fs): %s",
+                            len(self.spool), backoff, e)
+                return
+            self.last_upload_ms = (time.perf_counter() - start) * 1000.0
+            self.timing_samples['publish'].append(self.last_upload_ms)
+            self._publish_histogram.observe(self.last_upload_ms)
+            self.spool.delete(ids)
+            self.results_sent += len(batch)
+            self._sent_counter.inc(len(batch))
+            log.info("🚀 Đã gửi %d kết quả lên server thành công (%.0f ms).", len(batch), self.last_upload_ms)
+
+    def _send_full_images(self):
+        while True:
+            try:
+                shot_id = self.jobs.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                self._send_full_image(shot_id)
+            except requests.exceptions.RequestException as e:
+                log.warning("❌ Lỗi khi gửi ảnh đầy đủ: %s", e)
+            except Exception as e:
+                log.error("❌ Lỗi trong luồng gửi kết quả: %s", e)
+            finally:
+                self.jobs.task_done()
+
+    def run(self):
+        while self.running:
+            # Chờ kết quả mới hoặc tới lượt thử lại; các kết quả đến dồn dập trong lúc chờ đi chung một lô
+            backoff_left = self._next_attempt - time.monotonic()
+            self._wake.wait(backoff_left if backoff_left > 0 else 1.0)
+            self._wake.clear()
+            if not self.running:
+                break
+            self._send_full_images()
+            if time.monotonic() >= self._next_attempt:
+                try:
+                    self._replay()
+                except Exception as e:
+                    log.error("❌ Lỗi trong luồng gửi kết quả: %s", e)
+
+    def stop(self, timeout=10.0):
+        self.running = False
+        self._wake.set()
+        # Chờ luồng gửi xong lô đang gửi dở rồi mới đóng spool/session nó đang dùng
+        if self.is_alive():
+            self.join(timeout)
+        if self.is_alive():
+            log.warning("⚠️ Luồng gửi kết quả chưa dừng sau %.0fs, giữ nguyên spool.", timeout)
+            return
+        self.session.close()
+        self.spool.close()
@@ -0,0 +1,245 @@
+import os
+import queue
+import time
+import cv2
+import requests
+from threading import Thread, Lock, Event
+
+from utils import metrics
+from utils.logger import get_logger
+from utils.network import create_session, put_drop_oldest
+
+log = get_logger("stream")
+
+
+class SenderWorker(Thread):
+    """
+    Gửi frame JPEG của livestream lên server qua một Session keep-alive, kèm header mô tả frame
+    (tỉ lệ thu nhỏ và kích thước preview gốc). Hàng đợi dùng chính sách bỏ frame cũ nhất để đường truyền
+    chậm không làm tích lũy độ trễ.
+    """
+    def __init__(self, frame_queue, server_url, timeout=(0.5, 1.0), lane="default"):
+        super().__init__()
+        self.lane = lane
+        self.frame_queue = frame_queue
+        self.upload_url = f"{server_url}/video_upload"
+        self.timeout = timeout
+        self.session = create_session(pool_size=1)
+        self.daemon = True
+        self.running = True
+        self._lock = Lock()
+        self.frames_sent = 0
+        self.frames_dropped = 0
+        self.upload_errors = 0
+        self.last_rtt_ms = 0.0
+        self.avg_rtt_ms = 0.0
+        self._sent_counter = metrics.counter("stream_frames_sent_total", "Số frame livestream đã gửi", lane=lane)
+        self._dropped_counter = metrics.counter("stream_frames_dropped_total", "Số frame livestream bị bỏ", lane=lane)
+        self._error_counter = metrics.counter("stream_upload_errors_total", "Số lần gửi frame livestream lỗi", lane=lane)
+        self._rtt_histogram = metrics.histogram("stream_upload_ms", "Thời gian gửi một frame livestream", lane=lane)
+        metrics.gauge("queue_depth", "Số phần tử đang chờ trong hàng đợi", func=frame_queue.qsize,
+                      queue="stream", lane=lane)
+
+    def submit(self, jpg_buffer, headers=None):
+        """Gọi từ vòng lặp chụp: không bao giờ chặn, frame cũ nhất bị bỏ khi hàng đợi đầy."""
+        dropped = put_drop_oldest(self.frame_queue, (jpg_buffer, headers or {}))
+        if dropped:
+            with self._lock:
+                self.frames_dropped += dropped
+            self._dropped_counter.inc(dropped)
+
+    def run(self):
+        while self.running:
+            try:
+                jpg_buffer, frame_headers = self.frame_queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            start = time.perf_counter()
+            try:
+                self.session.post(self.upload_url, data=jpg_buffer,
+                                  headers={'Content-Type': 'image/jpeg', **frame_headers}, timeout=self.timeout)
+                rtt_ms = (time.perf_counter() - start) * 1000.0
+                with self._lock:
+                    self.frames_sent += 1
+                    self.last_rtt_ms = rtt_ms
+                    self.avg_rtt_ms = rtt_ms if self.frames_sent == 1 else 0.9 * self.avg_rtt_ms + 0.1 * rtt_ms
+                self._sent_counter.inc()
+                self._rtt_histogram.observe(rtt_ms)
+            except requests.exceptions.RequestException as e:
+                with self._lock:
+                    self.upload_errors += 1
+                    self.frames_dropped += 1
+                self._error_counter.inc()
+                self._dropped_counter.inc()
+                log.warning("LỖI SENDER [%s]: %s", self.lane, e)
+            finally:
+                self.frame_queue.task_done()
+
+    def metrics(self):
+        with self._lock:
+            return {
+                'frames_sent': self.frames_sent,
+                'frames_dropped': self.frames_dropped,
+                'upload_errors': self.upload_errors,
+                'last_rtt_ms': round(self.last_rtt_ms, 1),
+                'avg_rtt_ms': round(self.avg_rtt_ms, 1),
+                'queue_depth': self.frame_queue.qsize(),
+            }
+
+    def stop(self):
+        self.running = False
+        self.session.close()
+
+
+class PreviewEncoder(Thread):
+    """
+    Luồng nén JPEG cho livestream, tách khỏi vòng lặp chụp/trigger.
+    Chỉ giữ frame mới nhất, chỉ nén khi SenderWorker còn chỗ, và tự điều chỉnh
+    độ phân giải, chất lượng JPEG và FPS theo độ trễ mạng và tải CPU.
+    Mỗi frame gửi kèm X-Preview-Scale / X-Preview-Size để server (và Lane._parse_center) quy đổi
+    tọa độ trên ảnh đã thu nhỏ về tọa độ preview gốc.
+    """
+    def __init__(self, sender, quality=75, min_quality=40, max_quality=85,
+                 min_scale=0.5, max_fps=30.0, min_fps=5.0, target_rtt_ms=100.0, max_load=0.9):
+        super().__init__()
+        self.sender = sender
+        self._encode_histogram = metrics.histogram("preview_encode_ms", "Thời gian nén một frame preview",
+                                                   lane=sender.lane)
+        self._fps_meter = metrics.FpsMeter(metrics.gauge("preview_fps", "FPS preview thực tế", lane=sender.lane))
+        self.quality = quality
+        self.min_quality = min_quality
+        self.max_quality = max_quality
+        self.scale = 1.0
+        self.min_scale = min_scale
+        # Tỉ lệ của frame gần nhất đã gửi: tâm ngắm server gửi về được bấm trên frame này
+        self.sent_scale = 1.0
+        self.fps = max_fps
+        self.max_fps = max_fps
+        self.min_fps = min_fps
+        self.target_rtt_ms = target_rtt_ms
+        self.max_load = max_load
+        self.daemon = True
+        self.running = True
+        self._lock = Lock()
+        self._new_frame = Event()
+        self._stopped = Event()
+        self._latest = None
+        self._last_encode_time = 0.0
+        self._last_dropped = 0
+        self._healthy_frames = 0
+        self.frames_encoded = 0
+        self.frames_skipped = 0
+        self.last_encode_ms = 0.0
+
+    def submit(self, frame, center=None):
+        """Gọi từ vòng lặp chụp: chỉ lưu tham chiếu frame mới nhất, không nén, không chặn."""
+        with self._lock:
+            if self._latest is not None:
+                self.frames_skipped += 1
+            self._latest = (frame, center)
+        self._new_frame.set()
+
+    def _take_latest(self):
+        with self._lock:
+            item, self._latest = self._latest, None
+            self._new_frame.clear()
+            return item
+
+    def run(self):
+        while self.running:
+            if not self._new_frame.wait(timeout=0.1):
+                continue
+            # Chưa tới lượt theo FPS mục tiêu: ngủ đúng phần còn lại của chu kỳ, frame tới trong lúc đó
+            # chỉ thay frame đang giữ (không xếp hàng)
+            remaining = self._last_encode_time + 1.0 / self.fps - time.monotonic()
+            if remaining > 0:
+                self._stopped.wait(remaining)
+                continue
+            # Sender còn đang bận gửi: thử lại sau một chu kỳ ở FPS tối đa
+            if self.sender.frame_queue.full():
+                self._stopped.wait(1.0 / self.max_fps)
+                continue
+            now = time.monotonic()
+            item = self._take_latest()
+            if item is None:
+                continue
+            frame, center = item
+            self._last_encode_time = now
+            start = time.perf_counter()
+            jpg_buffer, frame_headers = self._encode(frame, center)
+            self.last_encode_ms = (time.perf_counter() - start) * 1000.0
+            self.frames_encoded += 1
+            self._encode_histogram.observe(self.last_encode_ms)
+            self._fps_meter.tick()
+            self.sender.submit(jpg_buffer, frame_headers)
+            self._adapt()
+
+    def _encode(self, frame, center):
+        """Nén một frame preview; trả (JPEG, header mô tả frame). Không sửa frame đầu vào."""
+        h, w = frame.shape[:2]
+        scale = self.scale
+        # frame có thể đang được vòng lặp chụp/camera dùng: overlay vẽ lên bản thu nhỏ hoặc bản sao
+        if scale < 1.0:
+            image = cv2.resize(frame, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        else:
+            image = frame.copy()
+        if center is None:
+            marker = (image.shape[1] // 2, image.shape[0] // 2)
+        else:
+            marker = (int(round(center[0] * scale)), int(round(center[1] * scale)))
+        cv2.drawMarker(image, marker, (0, 0, 255), markerType=cv2.MARKER_CROSS, markerSize=30, thickness=2)
+        _, jpg_buffer = cv2.imencode('.jpg', image, [int(cv2.IMWRITE_JPEG_QUALITY), int(self.quality)])
+        self.sent_scale = scale
+        return jpg_buffer.tobytes(), {'X-Preview-Scale': f"{scale:.2f}", 'X-Preview-Size': f"{w}x{h}"}
+
+    def _cpu_overloaded(self):
+        try:
+            return os.getloadavg()[0] / (os.cpu_count() or 1) > self.max_load
+        except OSError:
+            return False
+
+    def _adapt(self):
+        """Giảm chất lượng -> độ phân giải -> FPS khi nghẽn, và tăng dần lại khi ổn định."""
+        metrics = self.sender.metrics()
+        dropped = metrics['frames_dropped'] - self._last_dropped
+        self._last_dropped = metrics['frames_dropped']
+        frame_budget_ms = 1000.0 / self.fps
+        congested = (
+            dropped > 0
+            or metrics['avg_rtt_ms'] > self.target_rtt_ms
+            or self.last_encode_ms > 0.5 * frame_budget_ms
+            or self._cpu_overloaded()
+        )
+        if congested:
+            self._healthy_frames = 0
+            if self.quality > self.min_quality:
+                self.quality = max(self.min_quality, self.quality - 5)
+            elif self.scale > self.min_scale:
+                self.scale = max(self.min_scale, round(self.scale - 0.1, 2))
+            elif self.fps > self.min_fps:
+                self.fps = max(self.min_fps, self.fps - 2)
+            return
+        self._healthy_frames += 1
+        if self._healthy_frames < 30:
+            return
+        self._healthy_frames = 0
+        if self.fps < self.max_fps:
+            self.fps = min(self.max_fps, self.fps + 2)
+        elif self.scale < 1.0:
+            self.scale = min(1.0, round(self.scale + 0.1, 2))
+        elif self.quality < self.max_quality:
+            self.quality = min(self.max_quality, self.quality + 5)
+
+    def metrics(self):
+        return {
+            'frames_encoded': self.frames_encoded,
+            'frames_skipped': self.frames_skipped,
+            'quality': self.quality,
+            'scale': self.scale,
+            'fps': self.fps,
+            'encode_ms': round(self.last_encode_ms, 1),
+        }
+
+    def stop(self):
+        self.running = False
+        self._stopped.set()
@@ -0,0 +1,151 @@
+import os
+import queue
+import time
+from datetime import datetime
+from threading import Lock
+
+from utils.logger import get_logger
+
+log = get_logger("trigger")
+
+TRIGGER_BACKEND_ENV = "TRIGGER_BACKEND"
+
+
+class FakeGPIO:
+    """
+    Giả lập phần API RPi.GPIO mà hệ thống dùng, để chạy và kiểm thử ngoài Raspberry Pi.
+    Gọi fire(pin) để phát một cạnh lên trên chân trigger.
+    fire(pin, debounce=False) bỏ qua chống dội (cả của FakeGPIO lẫn TriggerInput), dùng cho trigger
+    phát lại từ log: chúng đã được lọc lúc ghi, và khi phát nhanh hơn thời gian thực thì khoảng cách
+    giữa hai cạnh theo đồng hồ thật có thể ngắn hơn bouncetime.
+    fire(pin, timestamp=t) đóng dấu cạnh bằng t thay vì lúc gọi (thời điểm bóp cò trong log phát lại).
+    """
+    BCM = "BCM"
+    IN = "IN"
+    PUD_DOWN = "PUD_DOWN"
+    RISING = "RISING"
+    HIGH = 1
+    LOW = 0
+
+    def __init__(self):
+        self._levels = {}
+        self._callbacks = {}
+        self._last_edge = {}
+        self._lock = Lock()
+
+    def setmode(self, mode):
+        pass
+
+    def setup(self, pin, direction, pull_up_down=None):
+        self._levels[pin] = self.LOW
+
+    def input(self, pin):
+        return self._levels.get(pin, self.LOW)
+
+    def add_event_detect(self, pin, edge, callback=None, bouncetime=0):
+        self._callbacks[pin] = (callback, bouncetime / 1000.0)
+
+    def remove_event_detect(self, pin):
+        self._callbacks.pop(pin, None)
+
+    def cleanup(self, pin=None):
+        if pin is None:
+            self._levels.clear()
+            self._callbacks.clear()
+        else:
+            self._levels.pop(pin, None)
+            self._callbacks.pop(pin, None)
+
+    def fire(self, pin, debounce=True, timestamp=None):
+        """Phát một cạnh lên. Trả về True nếu callback nhận cạnh này (không bị chống dội bỏ đi)."""
+        with self._lock:
+            self._levels[pin] = self.HIGH
+            callback, bounce = self._callbacks.get(pin, (None, 0))
+            now = time.monotonic()
+            bounced = debounce and now - self._last_edge.get(pin, float('-inf')) < bounce
+            if not bounced:
+                self._last_edge[pin] = now
+        delivered = False
+        if callback is not None and not bounced:
+            # Callback trả về False nghĩa là nó tự bỏ cạnh này (chống dội phần mềm)
+            kwargs = {}
+            if not debounce:
+                kwargs['debounce'] = False
+            if timestamp is not None:
+                kwargs['timestamp'] = timestamp
+            delivered = callback(pin, **kwargs) is not False
+        with self._lock:
+            self._levels[pin] = self.LOW
+        return delivered
+
+
+def load_gpio_backend():
+    """
+    Trả về module RPi.GPIO khi chạy trên Pi, hoặc FakeGPIO nếu không có (hoặc đặt TRIGGER_BACKEND=fake).
+    """
+    if os.environ.get(TRIGGER_BACKEND_ENV, "").lower() == "fake":
+        return FakeGPIO()
+    try:
+        import RPi.GPIO as GPIO
+        return GPIO
+    except (ImportError, RuntimeError) as e:
+        log.warning("⚠️ Không dùng được RPi.GPIO (%s), chuyển sang GPIO giả lập.", e)
+        return FakeGPIO()
+
+
+class TriggerEvent:
+    """
+    Một lần bóp cò: thời điểm monotonic (để chọn frame, cùng đồng hồ với camera.frame_timestamp())
+    và thời điểm thực (để hiển thị).
+    """
+    __slots__ = ("timestamp", "wall_time")
+
+    def __init__(self, timestamp, wall_time):
+        self.timestamp = timestamp
+        self.wall_time = wall_time
+
+    def capture_time_str(self):
+        return self.wall_time.strftime("%Y-%m-%d %H:%M:%S")
+
+
+class TriggerInput:
+    """
+    Bắt cạnh lên của chân trigger bằng ngắt GPIO (add_event_detect) thay vì polling.
+    Callback chỉ đóng dấu thời gian và đẩy sự kiện vào hàng đợi, vòng lặp chính lấy ra xử lý.
+    """
+    def __init__(self, pin=17, bouncetime_ms=50, gpio=None):
+        self.pin = pin
+        self.bouncetime_ms = bouncetime_ms
+        self.gpio = gpio if gpio is not None else load_gpio_backend()
+        self.events = queue.Queue()
+        self._last_timestamp = float('-inf')
+
+    def start(self):
+        self.gpio.setmode(self.gpio.BCM)
+        self.gpio.setup(self.pin, self.gpio.IN, pull_up_down=self.gpio.PUD_DOWN)
+        self.gpio.add_event_detect(self.pin, self.gpio.RISING, callback=self._on_edge, bouncetime=self.bouncetime_ms)
+
+    def _on_edge(self, channel, debounce=True, timestamp=None):
+        if timestamp is None:
+            timestamp = time.monotonic()
+        # Chống dội bằng phần mềm, bouncetime của RPi.GPIO không phải lúc nào cũng đủ tin cậy
+        if debounce and (timestamp - self._last_timestamp) * 1000.0 < self.bouncetime_ms:
+            return False
+        self._last_timestamp = timestamp
+        self.events.put(TriggerEvent(timestamp, datetime.now()))
+        return True
+
+    def get_events(self):
+        """Lấy tất cả sự kiện trigger đang chờ (không chặn)."""
+        events = []
+        while True:
+            try:
+                events.append(self.events.get_nowait())
+            except queue.Empty:
+                return events
+
+    def stop(self):
+        try:
+            self.gpio.remove_event_detect(self.pin)
+        finally:
+            self.gpio.cleanup(self.pin)
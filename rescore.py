@@ -0,0 +1,274 @@
+"""
+Chấm điểm lại các phát bắn đã ghi, để thử mô hình mới, bán kính vòng mới hoặc tham số đăng ký mới
+mà không phải chạy qua pipeline trực tiếp.
+
+Thư mục đầu vào chứa ảnh frame (ảnh luồng chính, cùng hệ tọa độ với tâm ngắm) và một trong các file:
+  - 'shots.csv': mỗi dòng một phát bắn, cột file, center_x, center_y, zoom, lane (center/zoom/lane có thể trống)
+  - 'frames.csv' + 'triggers.txt' (định dạng của ReplayCamera): mỗi trigger lấy frame ghi gần nhất
+  - không có gì: mỗi ảnh là một phát bắn, tâm ngắm lấy theo --center (mặc định giữa khung hình)
+
+Tâm ngắm ghi trong shots.csv cùng hệ tọa độ với frame của chính phát bắn đó nên dùng nguyên. Tâm --center
+là tâm hiệu chỉnh ở mức zoom --center-zoom (mặc định 1.0): với phát bắn ghi ở zoom khác, tâm được quy đổi
+theo ScalerCrop (cắt đối xứng quanh giữa khung hình, cùng tỉ lệ khung) sang khung hình của phát bắn đó.
+
+Detector chạy theo lô trên tiến trình chính; đăng ký ORB + RANSAC và chấm điểm chạy song song trên
+process pool, lô sau được nhận diện trong lúc lô trước đang đăng ký.
+
+Ví dụ:
+    python rescore.py --frames recordings/2024-05-01 --output rescore.csv
+    python rescore.py --frames recordings/week --model new.onnx --backend onnx --target targets --output week.parquet
+"""
+import argparse
+import bisect
+import csv
+import glob
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import cv2
+
+from app import TARGET_DEFINITION_PATH
+from module.camera_module import IMAGE_EXTENSIONS, load_timestamp_log
+from module.detection_module import ObjectDetector
+from utils.matching import MATCHER_EXACT, MATCHER_APPROX, create_matcher
+from utils.processing import (check_object_center, extract_crop_features, find_crop_homography, transform_point,
+                              calculate_score)
+from utils.target_library import TargetEntry, get_target_library
+
+COLUMNS = (
+    'file', 'lane', 'zoom', 'center_x', 'center_y', 'status', 'score', 'target', 'similarity',
+    'box_x1', 'box_y1', 'box_x2', 'box_y2', 'point_x', 'point_y', 'matches', 'inliers',
+    'detect_ms', 'register_ms', 'score_ms', 'error',
+)
+
+
+def _optional_float(value):
+    return float(value) if value not in (None, '') else None
+
+
+def map_center(center, frame_size, from_zoom, to_zoom):
+    """
+    Quy đổi tâm ngắm hiệu chỉnh ở zoom 'from_zoom' sang frame chụp ở zoom 'to_zoom'. Zoom kỹ thuật số cắt
+    vùng giữa cảm biến với cùng tỉ lệ khung, nên độ lệch so với giữa khung hình nhân theo to_zoom / from_zoom.
+    """
+    if center is None or not from_zoom or not to_zoom or from_zoom == to_zoom:
+        return center
+    width, height = frame_size
+    # Camera.set_zoom coi zoom < 1 là 1
+    factor = max(1.0, to_zoom) / max(1.0, from_zoom)
+    return {
+        'x': int(round(width / 2 + (center['x'] - width / 2) * factor)),
+        'y': int(round(height / 2 + (center['y'] - height / 2) * factor)),
+    }
+
+
+def load_shots(directory, default_center=None):
+    """Danh sách phát bắn: dict gồm file, center ({'x', 'y'} hoặc None), zoom, lane."""
+    shots_path = os.path.join(directory, "shots.csv")
+    if os.path.exists(shots_path):
+        with open(shots_path, 'r', newline='') as f:
+            rows = list(csv.DictReader(f))
+        shots = []
+        for row in rows:
+            x, y = _optional_float(row.get('center_x')), _optional_float(row.get('center_y'))
+            recorded = x is not None and y is not None
+            shots.append({
+                'file': os.path.join(directory, row['file']),
+                'center': {'x': int(x), 'y': int(y)} if recorded else default_center,
+                # Tâm ghi kèm phát bắn đã ở đúng zoom của frame; chỉ tâm mặc định cần quy đổi theo zoom
+                'center_recorded': recorded,
+                'zoom': _optional_float(row.get('zoom')),
+                'lane': row.get('lane') or None,
+            })
+        return shots
+
+    frames_path = os.path.join(directory, "frames.csv")
+    triggers = load_timestamp_log(os.path.join(directory, "triggers.txt"))
+    if os.path.exists(frames_path) and triggers:
+        with open(frames_path, 'r', newline='') as f:
+            frames = sorted((float(r['timestamp']), os.path.join(directory, r['file'])) for r in csv.DictReader(f))
+        timestamps = [ts for ts, _ in frames]
+        shots = []
+        for trigger in triggers:
+            # Frame ghi gần lúc bóp cò nhất (giống FrameRingBuffer.nearest)
+            i = bisect.bisect_left(timestamps, trigger)
+            nearest = min((j for j in (i - 1, i) if 0 <= j < len(frames)), key=lambda j: abs(timestamps[j] - trigger))
+            shots.append({'file': frames[nearest][1], 'center': default_center, 'center_recorded': False,
+                          'zoom': None, 'lane': None})
+        return shots
+
+    files = sorted(p for p in glob.glob(os.path.join(directory, "*")) if p.lower().endswith(IMAGE_EXTENSIONS))
+    return [{'file': p, 'center': default_center, 'center_recorded': False, 'zoom': None, 'lane': None}
+            for p in files]
+
+
+# --- Đăng ký + chấm điểm trên process pool ---
+# Mỗi tiến trình con chỉ tải bia/thư viện và tạo matcher một lần
+_WORKER = {}
+
+
+def _init_worker(target_path, matcher_type, registration):
+    cv2.setNumThreads(1)
+    if os.path.isdir(target_path):
+        library = get_target_library(target_path)
+        _WORKER['library'] = library if len(library) > 1 else None
+        _WORKER['entry'] = library.entries[0]
+    else:
+        _WORKER['library'] = None
+        _WORKER['entry'] = TargetEntry(target_path)
+    _WORKER['matcher'] = create_matcher(matcher_type)
+    _WORKER['registration'] = registration
+
+
+def _register_and_score(obj_crop, shot_point):
+    """Giống công đoạn register + score của ProcessingWorker, trả về các cột kết quả."""
+    start = time.perf_counter()
+    # ORB của ảnh crop trích xuất một lần cho cả nhận dạng lẫn các lần thử đăng ký
+    crop_features = extract_crop_features(obj_crop)
+    candidates = [(_WORKER['entry'], None)]
+    if _WORKER['library'] is not None:
+        candidates = _WORKER['library'].recognize(crop_features[1]) or candidates
+    H, stats = None, {}
+    for entry, similarity in candidates:
+        stats = {}
+        H = find_crop_homography(entry.original_img, obj_crop, reference=entry.reference, matcher=_WORKER['matcher'],
+                                 stats=stats, crop_features=crop_features, **_WORKER['registration'])
+        if H is not None:
+            break
+    if H is None:
+        entry, similarity = candidates[0]
+    register_ms = (time.perf_counter() - start) * 1000.0
+
+    start = time.perf_counter()
+    point = transform_point(H, shot_point) if H is not None else None
+    if point is None:
+        # Đăng ký thất bại: chấm trên ảnh crop phóng về kích thước bia gốc (như pipeline trực tiếp)
+        h_orig, w_orig = entry.original_img.shape[:2]
+        h_crop, w_crop = obj_crop.shape[:2]
+        point = (shot_point[0] * w_orig / w_crop, shot_point[1] * h_orig / h_crop)
+    score = calculate_score(point, entry.score_map)
+    return {
+        'score': score,
+        'target': entry.name,
+        'similarity': round(similarity, 3) if similarity is not None else None,
+        'point_x': round(point[0], 1),
+        'point_y': round(point[1], 1),
+        'matches': stats.get('matches'),
+        'inliers': stats.get('inliers'),
+        'register_ms': round(register_ms, 2),
+        'score_ms': round((time.perf_counter() - start) * 1000.0, 3),
+    }
+
+
+def _write(rows, output):
+    if output.endswith(".parquet"):
+        try:
+            import pandas as pd
+        except ImportError:
+            raise SystemExit("❌ Cần pandas + pyarrow để ghi Parquet, hoặc dùng --output *.csv")
+        pd.DataFrame(rows, columns=COLUMNS).to_parquet(output, index=False)
+        return
+    with open(output, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=COLUMNS)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def run(args):
+    default_center = None
+    if args.center:
+        x, y = (int(v) for v in args.center.split(','))
+        default_center = {'x': x, 'y': y}
+    shots = load_shots(args.frames, default_center)
+    if not shots:
+        raise SystemExit(f"❌ Không tìm thấy frame nào trong {args.frames}")
+    print(f"🎯 {len(shots)} phát bắn trong {args.frames}")
+
+    detector = ObjectDetector(model_path=args.model, backend=args.backend, imgsz=args.imgsz, threads=args.threads)
+    registration = {'min_inliers': args.min_inliers, 'ratio_thresh': args.ratio, 'ransac_thresh': args.ransac}
+    rows = [None] * len(shots)
+    futures = {}
+    start = time.monotonic()
+    # spawn: tiến trình con không thừa kế luồng của detector/reader (fork giữa lúc có luồng dễ treo)
+    with ProcessPoolExecutor(max_workers=args.workers, mp_context=multiprocessing.get_context("spawn"),
+                             initializer=_init_worker, initargs=(args.target, args.matcher, registration)) as pool, \
+            ThreadPoolExecutor(max_workers=4) as reader:
+        for offset in range(0, len(shots), args.batch_size):
+            batch = shots[offset:offset + args.batch_size]
+            frames = list(reader.map(lambda shot: cv2.imread(shot['file']), batch))
+            loaded = [i for i, frame in enumerate(frames) if frame is not None]
+            detect_start = time.perf_counter()
+            batch_results = detector.detect_batch([frames[i] for i in loaded], conf=args.conf) if loaded else []
+            detect_ms = (time.perf_counter() - detect_start) * 1000.0 / max(1, len(loaded))
+            results_by_index = dict(zip(loaded, batch_results))
+
+            for i, shot in enumerate(batch):
+                index = offset + i
+                row = dict.fromkeys(COLUMNS)
+                row.update({'file': os.path.relpath(shot['file'], args.frames), 'lane': shot['lane'],
+                            'zoom': shot['zoom']})
+                rows[index] = row
+                if i not in results_by_index:
+                    row.update({'status': "LỖI", 'score': 0, 'error': "không đọc được ảnh"})
+                    continue
+                frame = frames[i]
+                center = shot['center']
+                if not shot['center_recorded']:
+                    center = map_center(center, (frame.shape[1], frame.shape[0]), args.center_zoom, shot['zoom'])
+                    if center and not (0 <= center['x'] < frame.shape[1] and 0 <= center['y'] < frame.shape[0]):
+                        row.update({'status': "LỖI", 'score': 0,
+                                    'error': f"tâm ngắm ngoài khung hình ở zoom {shot['zoom']}"})
+                        continue
+                status, obj_crop, shot_point = check_object_center(results_by_index[i], frame, center,
+                                                                    conf_threshold=args.conf)
+                center_x, center_y = ((center['x'], center['y']) if center
+                                      else (frame.shape[1] // 2, frame.shape[0] // 2))
+                row.update({'status': status, 'center_x': center_x, 'center_y': center_y,
+                            'detect_ms': round(detect_ms, 2), 'score': 0})
+                if status == "TRÚNG" and obj_crop is not None:
+                    x1, y1 = center_x - shot_point[0], center_y - shot_point[1]
+                    row.update({'box_x1': x1, 'box_y1': y1,
+                                'box_x2': x1 + obj_crop.shape[1], 'box_y2': y1 + obj_crop.shape[0]})
+                    futures[pool.submit(_register_and_score, obj_crop, shot_point)] = index
+            print(f"🔍 Đã nhận diện {min(offset + args.batch_size, len(shots))}/{len(shots)} frame...")
+
+        for future, index in futures.items():
+            try:
+                rows[index].update(future.result())
+            except Exception as e:
+                rows[index].update({'error': str(e)})
+
+    elapsed = time.monotonic() - start
+    _write(rows, args.output)
+    hits = sum(1 for row in rows if row['status'] == "TRÚNG")
+    registered = sum(1 for row in rows if row['inliers'])
+    print(f"✅ {len(rows)} phát bắn ({hits} trúng, {registered} đăng ký được) trong {elapsed:.1f}s "
+          f"({len(rows) / elapsed:.1f} phát/s). Kết quả: {args.output}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Chấm điểm lại offline các phát bắn đã ghi.")
+    parser.add_argument("--frames", required=True, help="Thư mục frame (xem đầu file về shots.csv/frames.csv)")
+    parser.add_argument("--output", default="rescore.csv", help="File kết quả .csv hoặc .parquet")
+    parser.add_argument("--target", default=TARGET_DEFINITION_PATH, help="File định nghĩa bia hoặc thư mục thư viện bia")
+    parser.add_argument("--center", default=None, help="Tâm ngắm mặc định 'x,y' khi metadata không có")
+    parser.add_argument("--center-zoom", type=float, default=1.0,
+                        help="Mức zoom lúc hiệu chỉnh --center; quy đổi sang zoom ghi trong shots.csv của từng phát")
+    parser.add_argument("--model", default="my_model.pt")
+    parser.add_argument("--backend", choices=("torch", "onnx"), default="torch")
+    parser.add_argument("--imgsz", type=int, default=640)
+    parser.add_argument("--threads", type=int, default=os.cpu_count() or 4, help="Số luồng suy luận của detector")
+    parser.add_argument("--conf", type=float, default=0.5)
+    parser.add_argument("--batch-size", type=int, default=16, help="Số frame mỗi lần gọi detector")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Số tiến trình đăng ký + chấm điểm")
+    parser.add_argument("--matcher", choices=(MATCHER_EXACT, MATCHER_APPROX), default=MATCHER_EXACT)
+    parser.add_argument("--min-inliers", type=int, default=10)
+    parser.add_argument("--ratio", type=float, default=0.75, help="Ngưỡng Lowe's ratio test")
+    parser.add_argument("--ransac", type=float, default=4.0, help="Ngưỡng reprojection của RANSAC (px)")
+    run(parser.parse_args())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from module.buffer_module import DetachedFrame, FrameRef, FrameRingBuffer
+
+
+def _frame(value):
+    return np.full((4, 6, 3), value, dtype=np.uint8)
+
+
+def _filled_ring(depth, count, interval=0.1):
+    ring = FrameRingBuffer(depth)
+    for i in range(count):
+        assert ring.write(_frame(i), i * interval)
+    return ring
+
+
+def test_nearest_pins_closest_frame():
+    ring = _filled_ring(4, 4)
+    frame_ref = ring.nearest(0.21)
+    assert isinstance(frame_ref, FrameRef)
+    assert frame_ref.timestamp == pytest.approx(0.2)
+    assert frame_ref.array[0, 0, 0] == 2
+    assert ring.pinned_slots() == 1
+    frame_ref.release()
+    frame_ref.release()  # release() hai lần không được nhả slot hai lần
+    assert ring.pinned_slots() == 0
+
+
+def test_pinned_slot_is_not_overwritten():
+    ring = _filled_ring(4, 4)
+    frame_ref = ring.nearest(0.0)
+    for i in range(4, 10):
+        assert ring.write(_frame(i), i * 0.1)
+    assert frame_ref.array[0, 0, 0] == 0
+    frame_ref.release()
+    assert ring.write(_frame(10), 1.0)
+    assert ring.nearest(0.0, max_offset=0.05) is None
+
+
+def test_full_pinned_ring_returns_detached_copy():
+    ring = _filled_ring(3, 3)
+    refs = [ring.nearest(t) for t in (0.0, 0.1, 0.2)]
+    assert ring.pinned_slots() == 3
+    assert not ring.write(_frame(7), 0.3)
+    latest = ring.nearest(0.3)
+    assert isinstance(latest, DetachedFrame)
+    assert latest.array[0, 0, 0] == 7
+    # Vòng đệm có lại slot trống: bản sao ngoài vòng đệm bị bỏ
+    for frame_ref in refs:
+        frame_ref.release()
+    assert ring.write(_frame(8), 0.4)
+    assert ring.overflow is None
+
+
+def test_stale_frames_are_rejected():
+    ring = _filled_ring(4, 4)
+    assert ring.nearest(5.0, max_offset=0.15) is None
+    frame_ref = ring.nearest(0.35, max_offset=0.1)
+    assert frame_ref.timestamp == pytest.approx(0.3)
+    frame_ref.release()
+    assert ring.window(5.0, 2, 2, max_offset=0.15) == []
+    assert ring.pinned_slots() == 0
+
+
+def test_window_returns_frames_around_timestamp_in_order():
+    ring = _filled_ring(6, 6)
+    refs = ring.window(0.25, 2, 2)
+    assert [round(ref.timestamp, 2) for ref in refs] == [0.1, 0.2, 0.3, 0.4]
+    assert ring.pinned_slots() == 4
+    for frame_ref in refs:
+        frame_ref.release()
+    assert ring.pinned_slots() == 0
+
+
+def test_window_includes_overflow_frame():
+    ring = _filled_ring(3, 3)
+    refs = [ring.nearest(t) for t in (0.0, 0.1, 0.2)]
+    assert not ring.write(_frame(9), 0.3)
+    window = ring.window(0.25, 1, 1, max_offset=0.1)
+    assert [round(ref.timestamp, 2) for ref in window] == [0.2, 0.3]
+    assert isinstance(window[1], DetachedFrame)
+    for frame_ref in refs + window:
+        frame_ref.release()
+
+
+def test_detach_copies_frame_and_frees_slot():
+    ring = _filled_ring(3, 3)
+    frame_ref = ring.nearest(0.1)
+    detached = frame_ref.detach()
+    assert isinstance(detached, DetachedFrame)
+    assert ring.pinned_slots() == 0
+    # Slot đã nhả có thể bị ghi đè, bản sao vẫn giữ nguyên nội dung
+    for i in range(3, 6):
+        assert ring.write(_frame(i), i * 0.1)
+    assert detached.array[0, 0, 0] == 1
+    assert detached.timestamp == pytest.approx(0.1)
+    assert detached.detach() is detached
+
+
+def test_received_time_travels_with_the_frame():
+    ring = FrameRingBuffer(2)
+    assert ring.write(_frame(1), 10.0, received_at=3.0)
+    frame_ref = ring.nearest(10.0)
+    assert (frame_ref.timestamp, frame_ref.received_at) == (10.0, 3.0)
+    detached = frame_ref.detach()
+    assert (detached.timestamp, detached.received_at) == (10.0, 3.0)
+    # Không truyền received_at: mặc định là thời điểm chụp
+    assert ring.write(_frame(2), 11.0)
+    assert ring.nearest(11.0).received_at == 11.0
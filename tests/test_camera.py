@@ -0,0 +1,61 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+cv2 = pytest.importorskip("cv2")
+
+from module.camera_module import REPLAY_MAX, ReplayCamera
+from module.trigger_module import FakeGPIO, TriggerInput
+
+
+def _footage(directory, timestamps, triggers):
+    rows = ["file,timestamp"]
+    for i, timestamp in enumerate(timestamps):
+        name = f"frame_{i:03d}.png"
+        cv2.imwrite(str(directory / name), np.full((8, 8, 3), i, dtype=np.uint8))
+        rows.append(f"{name},{timestamp}")
+    (directory / "frames.csv").write_text("\n".join(rows) + "\n")
+    (directory / "triggers.txt").write_text("\n".join(str(t) for t in triggers) + "\n")
+
+
+def _play(camera):
+    stamps = []
+    while not camera.finished:
+        frame, _ = camera.capture_frames()
+        if frame is not None:
+            stamps.append(camera.frame_timestamp())
+    return stamps
+
+
+def test_max_speed_replay_keeps_recorded_frame_and_trigger_spacing(tmp_path):
+    recorded = [0.0, 0.5, 1.0, 1.5]
+    _footage(tmp_path, recorded, [0.7])
+    gpio = FakeGPIO()
+    trigger = TriggerInput(pin=17, gpio=gpio)
+    trigger.start()
+    camera = ReplayCamera(str(tmp_path), width=8, height=8, speed=REPLAY_MAX)
+    camera.attach_trigger(gpio, 17)
+    camera.start()
+    try:
+        stamps = _play(camera)
+    finally:
+        camera.stop()
+    # "max" phát nhanh hơn thời gian thực nhưng timestamp vẫn cách nhau đúng như lúc ghi
+    assert np.diff(stamps) == pytest.approx(np.diff(recorded))
+    events = trigger.get_events()
+    assert len(events) == 1
+    assert events[0].timestamp - stamps[0] == pytest.approx(0.7)
+
+
+def test_looping_replay_never_moves_timestamps_backwards(tmp_path):
+    _footage(tmp_path, [0.0, 1.0, 2.0], [])
+    camera = ReplayCamera(str(tmp_path), width=8, height=8, speed=REPLAY_MAX, loop=True)
+    camera.start()
+    try:
+        stamps = []
+        while len(stamps) < 7:
+            frame, _ = camera.capture_frames()
+            if frame is not None:
+                stamps.append(camera.frame_timestamp())
+    finally:
+        camera.stop()
+    assert all(b > a for a, b in zip(stamps, stamps[1:]))
@@ -0,0 +1,142 @@
+import queue
+import time
+from threading import Event
+
+import pytest
+
+pytest.importorskip("requests")
+
+from module.command_module import COMMAND_APPLIED, COMMAND_REJECTED, CommandPoller
+from tools.fake_server import FakeServer, FakeServerHandler
+
+
+class LegacyHandler(FakeServerHandler):
+    """
+    Server cũ: chưa có /command_stream, /get_command trả về từng lệnh một.
+    Khi 'upgraded' được set thì hoạt động như server mới (giả lập server vừa cập nhật xong).
+    """
+    pending = None
+    upgraded = None
+
+    def do_GET(self):
+        if self.upgraded is not None and self.upgraded.is_set():
+            super().do_GET()
+        elif self.path.startswith('/command_stream'):
+            self._send_json(404, {'error': 'not found'})
+        elif self.path.startswith('/get_command'):
+            try:
+                self._send_json(200, self.pending.get_nowait())
+            except queue.Empty:
+                self._send_json(200, {})
+        else:
+            super().do_GET()
+
+
+@pytest.fixture
+def server():
+    server = FakeServer().start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def poller_factory(server):
+    pollers = []
+
+    def make(**kwargs):
+        poller = CommandPoller(queue.Queue(), server.url, wait_timeout=1.0, max_backoff=0.5, **kwargs)
+        pollers.append(poller)
+        poller.start()
+        return poller
+
+    yield make
+    for poller in pollers:
+        poller.stop()
+        poller.join(timeout=3.0)
+
+
+def _wait_for(predicate, timeout=3.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+def test_long_poll_delivers_commands_in_order(server, poller_factory):
+    poller = poller_factory()
+    server.send_command('zoom', 2.0)
+    server.send_command('center', {'x': 10, 'y': 20})
+    first = poller.command_queue.get(timeout=3.0)
+    second = poller.command_queue.get(timeout=3.0)
+    assert (first['type'], first['value'], first['seq']) == ('zoom', 2.0, 1)
+    assert (second['type'], second['seq']) == ('center', 2)
+    assert poller.last_seq == 2
+    assert not poller.legacy_mode
+    # Lệnh đã nhận không được giao lại ở lượt long-poll sau
+    with pytest.raises(queue.Empty):
+        poller.command_queue.get(timeout=1.5)
+
+
+def test_ack_reports_status_to_server(server, poller_factory):
+    poller = poller_factory()
+    server.send_command('zoom', 2.0)
+    server.send_command('zoom', 'abc')
+    applied = poller.command_queue.get(timeout=3.0)
+    rejected = poller.command_queue.get(timeout=3.0)
+    poller.ack(applied)
+    poller.ack(rejected, status=COMMAND_REJECTED)
+    assert _wait_for(lambda: len(server.state.acks) == 2)
+    assert server.state.acks == [
+        {'seq': 1, 'type': 'zoom', 'status': COMMAND_APPLIED},
+        {'seq': 2, 'type': 'zoom', 'status': COMMAND_REJECTED},
+    ]
+
+
+def test_ack_without_seq_is_not_sent(server, poller_factory):
+    poller = poller_factory()
+    poller.ack({'type': 'zoom', 'value': 2.0})
+    time.sleep(0.7)
+    assert server.state.acks == []
+
+
+def test_falls_back_to_legacy_polling_on_404(server, poller_factory):
+    pending = queue.Queue()
+    pending.put({'type': 'matcher', 'value': 'approx'})
+    server.httpd.RequestHandlerClass = type("BoundLegacyHandler", (LegacyHandler,),
+                                            {'state': server.state, 'pending': pending})
+    poller = poller_factory()
+    command = poller.command_queue.get(timeout=5.0)
+    assert poller.legacy_mode
+    assert command == {'type': 'matcher', 'value': 'approx'}
+
+
+def test_server_restart_resets_sequence(server, poller_factory):
+    poller = poller_factory()
+    for zoom in (1.5, 2.0, 2.5):
+        server.send_command('zoom', zoom)
+    for _ in range(3):
+        poller.command_queue.get(timeout=3.0)
+    assert poller.last_seq == 3
+    # Server khởi động lại: seq đếm lại từ 1, lệnh mới không được bị coi là đã nhận
+    server.state.restart()
+    server.send_command('center', {'x': 5, 'y': 6})
+    command = poller.command_queue.get(timeout=3.0)
+    assert (command['type'], command['seq']) == ('center', 1)
+    assert poller.last_seq == 1
+    assert poller.epoch == server.state.epoch
+
+
+def test_legacy_mode_reprobes_command_stream(server, poller_factory):
+    upgraded = Event()
+    server.httpd.RequestHandlerClass = type("BoundLegacyHandler", (LegacyHandler,),
+                                            {'state': server.state, 'pending': queue.Queue(),
+                                             'upgraded': upgraded})
+    poller = poller_factory(probe_interval=0.3)
+    assert _wait_for(lambda: poller.legacy_mode)
+    upgraded.set()
+    server.send_command('zoom', 2.0)
+    command = poller.command_queue.get(timeout=5.0)
+    assert command['seq'] == 1
+    assert not poller.legacy_mode
@@ -0,0 +1,128 @@
+import json
+import os
+import time
+
+import pytest
+
+from utils import config_store
+from utils.config_store import SCHEMA_VERSION, ConfigStore, migrate, write_atomic
+
+
+def _write_json(path, data):
+    with open(path, 'w') as f:
+        json.dump(data, f)
+
+
+def test_migrate_v0_moves_single_camera_fields_into_lanes():
+    config = migrate({'zoom': 2.0, 'center': {'x': 10, 'y': 20}, 'matcher': 'exact'})
+    assert config['version'] == SCHEMA_VERSION
+    assert config['lanes'] == [{'zoom': 2.0, 'center': {'x': 10, 'y': 20}}]
+    assert 'zoom' not in config and 'center' not in config
+    assert config['matcher'] == 'exact'
+
+
+def test_migrate_keeps_existing_lanes():
+    lanes = [{'id': 'lane1', 'zoom': 1.5}]
+    config = migrate({'zoom': 3.0, 'lanes': lanes})
+    assert config['lanes'] == lanes
+    assert 'zoom' not in config
+
+
+def test_migrate_leaves_newer_versions_untouched():
+    config = {'version': SCHEMA_VERSION + 1, 'zoom': 2.0}
+    assert migrate(dict(config)) == config
+
+
+def test_load_migrates_file_on_disk(tmp_path):
+    path = tmp_path / "config.json"
+    _write_json(path, {'zoom': 2.5, 'center': None})
+    store = ConfigStore(str(path))
+    config = store.load()
+    assert config['version'] == SCHEMA_VERSION
+    assert config['lanes'][0]['zoom'] == 2.5
+
+
+def test_load_falls_back_to_defaults_on_corrupt_file(tmp_path):
+    path = tmp_path / "config.json"
+    path.write_text("{ not json")
+    config = ConfigStore(str(path)).load()
+    assert config == {'version': SCHEMA_VERSION, 'lanes': []}
+
+
+def test_write_atomic_leaves_no_temp_file(tmp_path):
+    path = tmp_path / "config.json"
+    write_atomic(str(path), {'version': SCHEMA_VERSION, 'lanes': []})
+    assert json.loads(path.read_text())['version'] == SCHEMA_VERSION
+    assert os.listdir(tmp_path) == ["config.json"]
+
+
+def test_write_atomic_keeps_old_file_when_replace_fails(tmp_path, monkeypatch):
+    path = tmp_path / "config.json"
+    _write_json(path, {'version': SCHEMA_VERSION, 'lanes': [{'id': 'old'}]})
+
+    def failing_replace(src, dst):
+        raise OSError("mất điện")
+
+    monkeypatch.setattr(config_store.os, "replace", failing_replace)
+    with pytest.raises(OSError):
+        write_atomic(str(path), {'version': SCHEMA_VERSION, 'lanes': [{'id': 'new'}]})
+    assert json.loads(path.read_text())['lanes'] == [{'id': 'old'}]
+
+
+def test_updates_are_debounced_into_one_write(tmp_path, monkeypatch):
+    path = tmp_path / "config.json"
+    writes = []
+    real_write_atomic = config_store.write_atomic
+
+    def counting_write_atomic(target, data):
+        writes.append(data)
+        real_write_atomic(target, data)
+
+    monkeypatch.setattr(config_store, "write_atomic", counting_write_atomic)
+    store = ConfigStore(str(path), debounce=0.1, max_delay=2.0, poll_interval=0.05)
+    store.load()
+    store.start()
+    try:
+        for zoom in (1.5, 2.0, 2.5):
+            store.update_lane("lane1", {'zoom': zoom})
+        # Ghi trong bộ nhớ, chưa chạm đĩa
+        assert store.lane("lane1")['zoom'] == 2.5
+        deadline = time.monotonic() + 2.0
+        while not writes and time.monotonic() < deadline:
+            time.sleep(0.02)
+    finally:
+        store.stop()
+    assert len(writes) == 1
+    assert json.loads(path.read_text())['lanes'] == [{'id': 'lane1', 'zoom': 2.5}]
+
+
+def test_unchanged_values_do_not_mark_dirty(tmp_path):
+    store = ConfigStore(str(tmp_path / "config.json"))
+    store.update(matcher='exact')
+    store.flush()
+    store.update(matcher='exact')
+    assert store._dirty_since is None
+
+
+def test_external_edit_is_reloaded_and_notified(tmp_path):
+    path = tmp_path / "config.json"
+    write_atomic(str(path), {'version': SCHEMA_VERSION, 'lanes': [{'id': 'lane1', 'zoom': 1.0}]})
+    store = ConfigStore(str(path), poll_interval=0.05)
+    store.load()
+    changes = []
+    store.subscribe(lambda old, new: changes.append((old, new)))
+    store.start()
+    try:
+        # mtime_ns phải khác lần đọc trước
+        time.sleep(0.01)
+        _write_json(path, {'version': SCHEMA_VERSION, 'lanes': [{'id': 'lane1', 'zoom': 3.0}]})
+        deadline = time.monotonic() + 2.0
+        while not changes and time.monotonic() < deadline:
+            time.sleep(0.02)
+    finally:
+        store.stop()
+    assert len(changes) == 1
+    old, new = changes[0]
+    assert old['lanes'][0]['zoom'] == 1.0
+    assert new['lanes'][0]['zoom'] == 3.0
+    assert store.lane("lane1")['zoom'] == 3.0
@@ -0,0 +1,61 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("cv2")
+
+from module import detection_module
+from module.detection_module import Boxes, Detections, ObjectDetector
+
+
+class FakeBackend:
+    """Backend trả box cố định theo kích thước ảnh đầu vào: ROI (ảnh nhỏ) và toàn khung hình khác nhau."""
+    name = "fake"
+    device = "cpu"
+    imgsz = 640
+
+    def __init__(self, roi_box, full_box):
+        self.roi_box = roi_box
+        self.full_box = full_box
+        self.calls = []
+
+    def detect_batch(self, frames, conf=0.5, imgsz=None):
+        self.calls.append(imgsz)
+        box = self.roi_box if imgsz is not None else self.full_box
+        return [[Detections(Boxes([box], [0.9], [0]))] for _ in frames]
+
+
+def _detector(monkeypatch, backend):
+    monkeypatch.setattr(detection_module, "create_backend", lambda *args, **kwargs: backend)
+    detector = ObjectDetector(warmup=False, roi_imgsz=320, roi_padding=0.25)
+    # Bia ở giữa khung 400x400: ROI = (50, 50, 350, 350)
+    detector.confirm_box((100, 100, 300, 300), key="lane1")
+    return detector
+
+
+def test_box_inside_roi_is_accepted(monkeypatch):
+    backend = FakeBackend(roi_box=(30, 30, 220, 220), full_box=(0, 0, 10, 10))
+    detector = _detector(monkeypatch, backend)
+    result = detector.detect(np.zeros((400, 400, 3), dtype=np.uint8), key="lane1")
+    assert backend.calls == [320]
+    assert result[0].boxes.xyxy.numpy().tolist() == [[80, 80, 270, 270]]
+
+
+def test_box_touching_roi_border_falls_back_to_full_frame(monkeypatch):
+    # Box chạm mép phải của ROI: bia có thể đã dịch ra ngoài cửa sổ
+    backend = FakeBackend(roi_box=(30, 30, 299, 220), full_box=(110, 105, 360, 295))
+    detector = _detector(monkeypatch, backend)
+    result = detector.detect(np.zeros((400, 400, 3), dtype=np.uint8), key="lane1")
+    assert backend.calls == [320, None]
+    assert result[0].boxes.xyxy.numpy().tolist() == [[110, 105, 360, 295]]
+    assert "lane1" not in detector.last_boxes
+
+
+def test_roi_edge_on_frame_border_is_not_a_cut(monkeypatch):
+    backend = FakeBackend(roi_box=(0, 30, 150, 220), full_box=(0, 0, 10, 10))
+    monkeypatch.setattr(detection_module, "create_backend", lambda *args, **kwargs: backend)
+    detector = ObjectDetector(warmup=False)
+    # Bia sát mép trái khung hình: ROI bắt đầu từ x = 0, box chạm mép đó vẫn hợp lệ
+    detector.confirm_box((10, 100, 150, 300), key="lane1")
+    result = detector.detect(np.zeros((400, 400, 3), dtype=np.uint8), key="lane1")
+    assert backend.calls == [320]
+    assert result[0].boxes.xyxy.numpy()[0, 0] == 0
@@ -0,0 +1,98 @@
+import random
+import time
+from threading import Event, Lock
+
+from module.pipeline_module import Stage, StagedPipeline
+
+
+class Item:
+    def __init__(self, value):
+        self.value = value
+        self.seq = None
+        self.timings = {}
+        self.error = None
+
+
+class Sink:
+    def __init__(self, expected):
+        self.items = []
+        self.expected = expected
+        self.done = Event()
+        self._lock = Lock()
+
+    def __call__(self, item):
+        with self._lock:
+            self.items.append(item)
+            if len(self.items) == self.expected:
+                self.done.set()
+
+
+def _run(stages, items, on_error=None):
+    sink = Sink(len(items))
+    pipeline = StagedPipeline(stages, sink=sink, on_error=on_error)
+    pipeline.start()
+    try:
+        for item in items:
+            pipeline.submit(item)
+        assert sink.done.wait(5.0)
+    finally:
+        pipeline.stop()
+    return sink.items
+
+
+def test_sink_receives_items_in_submit_order_despite_parallel_stage():
+    def slow_random(item):
+        # Nhiều worker với thời gian xử lý ngẫu nhiên: các item làm xong lệch thứ tự
+        time.sleep(random.uniform(0.0, 0.02))
+        item.value *= 2
+
+    stages = [Stage("work", slow_random, workers=4, queue_size=4), Stage("tail", lambda item: None)]
+    items = _run(stages, [Item(i) for i in range(30)])
+    assert [item.seq for item in items] == list(range(30))
+    assert [item.value for item in items] == [2 * i for i in range(30)]
+    assert all(set(item.timings) == {"work", "tail"} for item in items)
+
+
+def test_failed_items_still_reach_sink_in_order():
+    errors = []
+
+    def fail_odd(item):
+        if item.value % 2:
+            raise ValueError(f"lỗi {item.value}")
+
+    calls = []
+    stages = [Stage("check", fail_odd, workers=2), Stage("after", lambda item: calls.append(item.value))]
+    items = _run(stages, [Item(i) for i in range(10)],
+                 on_error=lambda stage, item, error: errors.append((stage, item.value)))
+    assert [item.value for item in items] == list(range(10))
+    assert [item.value for item in items if item.error is not None] == [1, 3, 5, 7, 9]
+    # Công đoạn sau bỏ qua item đã lỗi
+    assert sorted(calls) == [0, 2, 4, 6, 8]
+    assert sorted(value for _, value in errors) == [1, 3, 5, 7, 9]
+
+
+def test_batched_stage_groups_waiting_items():
+    gate = Event()
+    batch_sizes = []
+
+    def first(item):
+        gate.wait(1.0)
+
+    def batched(items):
+        batch_sizes.append(len(items))
+
+    stages = [Stage("gate", first, workers=4, queue_size=8), Stage("batch", batched, batch_size=4, queue_size=8)]
+    sink = Sink(8)
+    pipeline = StagedPipeline(stages, sink=sink)
+    pipeline.start()
+    try:
+        for i in range(8):
+            pipeline.submit(Item(i))
+        time.sleep(0.05)
+        gate.set()
+        assert sink.done.wait(5.0)
+    finally:
+        pipeline.stop()
+    assert [item.seq for item in sink.items] == list(range(8))
+    assert sum(batch_sizes) == 8
+    assert max(batch_sizes) <= 4
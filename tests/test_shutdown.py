@@ -0,0 +1,92 @@
+import time
+
+import pytest
+
+from module.pipeline_module import Stage, StagedPipeline
+
+
+class Item:
+    def __init__(self, value):
+        self.value = value
+        self.seq = None
+        self.timings = {}
+        self.error = None
+
+
+def test_pipeline_drain_waits_for_sink():
+    emitted = []
+    pipeline = StagedPipeline([Stage("slow", lambda item: time.sleep(0.05), workers=2)], sink=emitted.append)
+    pipeline.start()
+    try:
+        for i in range(6):
+            pipeline.submit(Item(i))
+        assert pipeline.drain(timeout=5.0)
+        assert [item.value for item in emitted] == list(range(6))
+    finally:
+        pipeline.stop()
+
+
+def test_pipeline_drain_times_out_on_stuck_stage():
+    pipeline = StagedPipeline([Stage("stuck", lambda item: time.sleep(1.0))], sink=lambda item: None)
+    pipeline.start()
+    try:
+        pipeline.submit(Item(0))
+        assert not pipeline.drain(timeout=0.1)
+    finally:
+        pipeline.stop()
+
+
+class LaneDouble:
+    """Làn chỉ gồm ResultPublisher thật, ghi lại thứ tự các bước tắt."""
+    def __init__(self, publisher, calls):
+        self.result_publisher = publisher
+        self.calls = calls
+
+    def stop_capture(self):
+        self.calls.append("stop_capture")
+
+    def stop_workers(self):
+        self.calls.append("stop_workers")
+        self.result_publisher.stop()
+
+
+class WorkerDouble:
+    """ProcessingWorker còn một phát bắn đang dở: nó chỉ tới publish() trong lúc drain()."""
+    def __init__(self, publisher, calls, image):
+        self.publisher = publisher
+        self.calls = calls
+        self.image = image
+
+    def drain(self, timeout):
+        self.calls.append("drain")
+        self.publisher.publish({'shot_id': "late-shot", 'score': 9}, self.image)
+        return True
+
+    def stop(self):
+        self.calls.append("stop")
+
+    def join(self, timeout=None):
+        pass
+
+
+def test_result_published_after_lane_stops_is_spooled(tmp_path):
+    np = pytest.importorskip("numpy")
+    pytest.importorskip("cv2")
+    pytest.importorskip("requests")
+    import main as app_main
+    from module.publish_module import ResultPublisher
+    from utils.spool import ResultSpool
+
+    spool_path = str(tmp_path / "results.db")
+    # Không có server: kết quả phải nằm lại trong spool
+    publisher = ResultPublisher("http://127.0.0.1:9", spool_path=spool_path, lane="shutdown-test")
+    calls = []
+    worker = WorkerDouble(publisher, calls, np.zeros((32, 32, 3), dtype=np.uint8))
+    app_main.shutdown([LaneDouble(publisher, calls)], worker, drain_timeout=1.0)
+
+    assert calls == ["stop_capture", "drain", "stop", "stop_workers"]
+    spool = ResultSpool(spool_path)
+    try:
+        assert [shot_id for _, shot_id, _, _ in spool.fetch_batch(10)] == ["late-shot"]
+    finally:
+        spool.close()
@@ -0,0 +1,36 @@
+from threading import Event
+
+import pytest
+
+# utils.metrics (dùng trong utils.startup) cần requests
+pytest.importorskip("requests")
+
+from utils.startup import StartupOrchestrator
+
+
+def test_wait_all_times_out_while_a_step_is_running():
+    gate = Event()
+    startup = StartupOrchestrator().add("slow", lambda: gate.wait(5.0)).start()
+    try:
+        assert not startup.wait_all(timeout=0.05)
+        assert not startup.is_ready("slow")
+    finally:
+        gate.set()
+    assert startup.wait_all(timeout=5.0)
+    assert startup.is_ready("slow")
+
+
+def test_failed_steps_are_reported_once_all_are_done():
+    def broken():
+        raise RuntimeError("không có loa")
+
+    errors = []
+    startup = StartupOrchestrator()
+    startup.add("ok", lambda: True)
+    startup.add("audio", broken, on_failed=errors.append)
+    startup.add("report", lambda: False)
+    assert startup.start().wait_all(timeout=5.0)
+    assert sorted(startup.failed()) == ["audio", "report"]
+    assert startup.is_ready("ok")
+    assert [str(e) for e in errors] == ["không có loa"]
+    assert startup.status()["audio"]['error'] == "không có loa"
@@ -0,0 +1,55 @@
+import queue
+from types import SimpleNamespace
+
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("cv2")
+pytest.importorskip("requests")
+
+import cv2
+
+from module.lane_module import Lane
+from module.stream_module import PreviewEncoder, SenderWorker
+
+
+def _encoder():
+    return PreviewEncoder(SenderWorker(queue.Queue(maxsize=2), "http://127.0.0.1:9", lane="stream-test"))
+
+
+def test_encode_does_not_draw_on_shared_frame():
+    frame = np.zeros((120, 160, 3), dtype=np.uint8)
+    jpg_buffer, headers = _encoder()._encode(frame, (80, 60))
+    assert not frame.any()
+    assert headers == {'X-Preview-Scale': "1.00", 'X-Preview-Size': "160x120"}
+    image = cv2.imdecode(np.frombuffer(jpg_buffer, dtype=np.uint8), cv2.IMREAD_COLOR)
+    assert image[60, 80, 2] > 128
+
+
+def test_downscaled_preview_moves_marker_with_scale():
+    encoder = _encoder()
+    encoder.scale = 0.5
+    frame = np.zeros((120, 160, 3), dtype=np.uint8)
+    jpg_buffer, headers = encoder._encode(frame, (100, 40))
+    assert headers['X-Preview-Scale'] == "0.50"
+    assert encoder.sent_scale == 0.5
+    image = cv2.imdecode(np.frombuffer(jpg_buffer, dtype=np.uint8), cv2.IMREAD_COLOR)
+    assert image.shape[:2] == (60, 80)
+    assert image[20, 50, 2] > 128
+
+
+def _lane_double(sent_scale):
+    return SimpleNamespace(camera=SimpleNamespace(preview_size=(640, 480)),
+                           preview_encoder=SimpleNamespace(sent_scale=sent_scale))
+
+
+def test_center_clicked_on_scaled_preview_is_mapped_back():
+    lane = _lane_double(0.5)
+    # Server không gửi tỉ lệ: tâm được bấm trên frame gần nhất (đã thu nhỏ một nửa)
+    assert Lane._parse_center(lane, {'x': 100, 'y': 50}) == {'x': 200, 'y': 100}
+    # Tỉ lệ gửi kèm lệnh được ưu tiên
+    assert Lane._parse_center(lane, {'x': 100, 'y': 50, 'scale': 1.0}) == {'x': 100, 'y': 50}
+    with pytest.raises(ValueError):
+        Lane._parse_center(lane, {'x': 100, 'y': 50, 'scale': 0})
+    with pytest.raises(ValueError):
+        Lane._parse_center(lane, {'x': 400, 'y': 50})
@@ -0,0 +1,44 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("cv2")
+
+from utils.target_library import BinaryVocabulary
+
+
+def _descriptors(count, seed):
+    return np.random.default_rng(seed).integers(0, 256, size=(count, 32), dtype=np.uint8)
+
+
+def _quantize_unpacked(vocabulary, descriptors):
+    """Cách tính cũ trên ma trận bit (N, branching, 256), dùng để đối chiếu."""
+    bits = np.unpackbits(descriptors, axis=1)
+    node = np.zeros(len(bits), dtype=np.int64)
+    for level_centers in vocabulary.centers:
+        children = np.unpackbits(level_centers[node], axis=-1)
+        distances = (bits[:, None, :] != children).sum(axis=2)
+        node = node * vocabulary.branching + np.argmin(distances, axis=1)
+    return node
+
+
+def test_centers_are_stored_packed():
+    vocabulary = BinaryVocabulary.build(_descriptors(400, 0), branching=4, depth=2, iterations=2)
+    assert [c.shape for c in vocabulary.centers] == [(1, 4, 32), (4, 4, 32)]
+    assert all(c.dtype == np.uint8 for c in vocabulary.centers)
+
+
+def test_popcount_quantize_matches_unpacked_hamming():
+    vocabulary = BinaryVocabulary.build(_descriptors(400, 0), branching=4, depth=2, iterations=2)
+    query = _descriptors(200, 1)
+    words = vocabulary.quantize(query)
+    assert words.tolist() == _quantize_unpacked(vocabulary, query).tolist()
+    assert words.min() >= 0 and words.max() < vocabulary.size
+
+
+def test_saved_vocabulary_quantizes_the_same(tmp_path):
+    vocabulary = BinaryVocabulary.build(_descriptors(300, 2), branching=4, depth=2, iterations=2)
+    path = str(tmp_path / "vocabulary.npz")
+    vocabulary.save(path)
+    loaded = BinaryVocabulary.load(path)
+    query = _descriptors(100, 3)
+    assert loaded.quantize(query).tolist() == vocabulary.quantize(query).tolist()
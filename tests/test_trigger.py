@@ -0,0 +1,60 @@
+import time
+
+from module.trigger_module import FakeGPIO, TriggerInput
+
+
+def _start_trigger(bouncetime_ms=50):
+    gpio = FakeGPIO()
+    trigger = TriggerInput(pin=17, bouncetime_ms=bouncetime_ms, gpio=gpio)
+    trigger.start()
+    return gpio, trigger
+
+
+def test_edges_within_bouncetime_are_debounced():
+    gpio, trigger = _start_trigger(bouncetime_ms=50)
+    assert gpio.fire(17)
+    assert not gpio.fire(17)
+    assert not gpio.fire(17)
+    assert len(trigger.get_events()) == 1
+
+
+def test_edges_after_bouncetime_are_delivered():
+    gpio, trigger = _start_trigger(bouncetime_ms=20)
+    assert gpio.fire(17)
+    time.sleep(0.05)
+    assert gpio.fire(17)
+    events = trigger.get_events()
+    assert len(events) == 2
+    assert events[0].timestamp < events[1].timestamp
+
+
+def test_software_debounce_rejects_edges_missed_by_gpio_bouncetime():
+    # RPi.GPIO không phải lúc nào cũng lọc được dội, TriggerInput tự lọc thêm
+    gpio, trigger = _start_trigger(bouncetime_ms=50)
+    gpio.add_event_detect(17, gpio.RISING, callback=trigger._on_edge, bouncetime=0)
+    assert gpio.fire(17)
+    assert not gpio.fire(17)
+    assert len(trigger.get_events()) == 1
+
+
+def test_replayed_edges_bypass_debounce():
+    gpio, trigger = _start_trigger(bouncetime_ms=50)
+    assert all(gpio.fire(17, debounce=False) for _ in range(5))
+    assert len(trigger.get_events()) == 5
+
+
+def test_get_events_drains_queue_and_stop_detaches_callback():
+    gpio, trigger = _start_trigger()
+    gpio.fire(17)
+    assert len(trigger.get_events()) == 1
+    assert trigger.get_events() == []
+    trigger.stop()
+    assert not gpio.fire(17)
+    assert trigger.get_events() == []
+
+
+def test_replayed_edges_keep_their_recorded_timestamp():
+    gpio, trigger = _start_trigger()
+    assert gpio.fire(17, debounce=False, timestamp=12.5)
+    assert gpio.fire(17, debounce=False, timestamp=12.51)
+    assert [event.timestamp for event in trigger.get_events()] == [12.5, 12.51]
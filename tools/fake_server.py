@@ -0,0 +1,184 @@
+"""
+Server giả lập thay cho server trên máy Mac, dùng để chạy thử/kiểm thử Pi mà không cần server thật.
+
+    python -m tools.fake_server --port 5000
+
+Gửi lệnh như người điều khiển:
+    curl -X POST localhost:5000/send_command -H 'Content-Type: application/json' -d '{"type": "zoom", "value": 2.0}'
+"""
+import argparse
+import json
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Condition, Lock, Thread
+from urllib.parse import urlparse, parse_qs
+
+
+class FakeServerState:
+    """
+    Trạng thái dùng chung giữa các request: hàng lệnh có số thứ tự, ack và thống kê upload.
+    'epoch' đổi mỗi lần server (giả lập) khởi động lại, khi đó số thứ tự lệnh đếm lại từ 1.
+    """
+    def __init__(self):
+        self.commands = []
+        self.next_seq = 1
+        self.epoch = uuid.uuid4().hex[:12]
+        self.condition = Condition()
+        self.lock = Lock()
+        self.acks = []
+        self.counts = {}
+        self.bytes_received = {}
+        self.idempotency_keys = set()
+        self.reported_config = None
+
+    def push_command(self, command):
+        with self.condition:
+            command = dict(command, seq=self.next_seq)
+            self.next_seq += 1
+            self.commands.append(command)
+            self.condition.notify_all()
+            return command
+
+    def restart(self):
+        """Giả lập server khởi động lại: mất hàng lệnh, epoch mới, seq đếm lại từ 1."""
+        with self.condition:
+            self.commands = []
+            self.next_seq = 1
+            self.epoch = uuid.uuid4().hex[:12]
+            self.condition.notify_all()
+
+    def wait_commands(self, after, timeout, epoch=None):
+        """
+        Chờ lệnh có seq > after. Client của epoch cũ (hoặc 'after' vượt quá seq hiện tại) nhận lại mọi lệnh
+        của epoch này. Trả về (epoch, seq mới nhất, danh sách lệnh).
+        """
+        deadline = time.monotonic() + timeout
+        with self.condition:
+            while True:
+                since = after
+                if (epoch is not None and epoch != self.epoch) or after >= self.next_seq:
+                    since = 0
+                pending = [c for c in self.commands if c['seq'] > since]
+                remaining = deadline - time.monotonic()
+                if pending or remaining <= 0:
+                    return self.epoch, self.next_seq - 1, pending
+                self.condition.wait(remaining)
+
+    def record(self, path, size):
+        with self.lock:
+            self.counts[path] = self.counts.get(path, 0) + 1
+            self.bytes_received[path] = self.bytes_received.get(path, 0) + size
+
+
+class FakeServerHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    state = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload=None, headers=None):
+        body = b"" if payload is None else json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, str(value))
+        self.end_headers()
+        if body:
+            self.wfile.write(body)
+
+    def _read_body(self):
+        length = int(self.headers.get('Content-Length', 0))
+        return self.rfile.read(length) if length else b""
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == '/command_stream':
+            query = parse_qs(url.query)
+            after = int(query.get('after', ['0'])[0])
+            timeout = float(query.get('timeout', ['25'])[0])
+            epoch, latest, commands = self.state.wait_commands(after, timeout, query.get('epoch', [None])[0])
+            headers = {'X-Command-Epoch': epoch, 'X-Command-Seq': latest}
+            if commands:
+                self._send_json(200, {'commands': commands}, headers)
+            else:
+                self._send_json(204, headers=headers)
+        elif url.path == '/get_command':
+            self._send_json(200, {})
+        elif url.path == '/stats':
+            with self.state.lock:
+                self._send_json(200, {'counts': self.state.counts, 'bytes': self.state.bytes_received,
+                                      'acks': self.state.acks, 'config': self.state.reported_config})
+        else:
+            self._send_json(404, {'error': 'not found'})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        body = self._read_body()
+        self.state.record(url.path, len(body))
+        if url.path == '/send_command':
+            self._send_json(200, self.state.push_command(json.loads(body or b"{}")))
+        elif url.path == '/command_ack':
+            with self.state.lock:
+                self.state.acks.append(json.loads(body or b"{}"))
+            self._send_json(200, {'ok': True})
+        elif url.path == '/report_config':
+            with self.state.lock:
+                self.state.reported_config = json.loads(body or b"{}")
+            self._send_json(200, {'ok': True})
+        elif url.path == '/processed_data_upload':
+            key = self.headers.get('Idempotency-Key')
+            with self.state.lock:
+                duplicate = key is not None and key in self.state.idempotency_keys
+                if key is not None:
+                    self.state.idempotency_keys.add(key)
+            self._send_json(200, {'ok': True, 'duplicate': duplicate})
+        elif url.path in ('/video_upload', '/processed_image_upload', '/metrics_upload'):
+            self._send_json(200, {'ok': True})
+        else:
+            self._send_json(404, {'error': 'not found'})
+
+
+class FakeServer:
+    """Chạy server giả lập trong cùng tiến trình (luồng nền), tiện cho kiểm thử và benchmark."""
+    def __init__(self, host="127.0.0.1", port=0):
+        self.state = FakeServerState()
+        handler = type("BoundFakeServerHandler", (FakeServerHandler,), {'state': self.state})
+        self.httpd = ThreadingHTTPServer((host, port), handler)
+        self.httpd.daemon_threads = True
+        self.thread = Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def send_command(self, command_type, value):
+        return self.state.push_command({'type': command_type, 'value': value})
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Server giả lập cho hệ thống chấm điểm.")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=5000)
+    args = parser.parse_args()
+    server = FakeServer(args.host, args.port).start()
+    print(f"🧪 Server giả lập đang chạy tại {server.url}")
+    try:
+        server.thread.join()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
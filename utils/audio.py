@@ -1,24 +1,51 @@
 # utils/audio.py - Phiên bản tối ưu dùng Pygame và Pre-loading
 
-import pygame
 import os
 import time
+from collections import deque
+from threading import Condition, Thread
+
+from utils import metrics
+from utils.logger import get_logger
+
+log = get_logger("audio")
+
+# Đặt AUDIO_BACKEND=null để chạy không cần loa/pygame (benchmark, máy dev); các hàm phát chỉ bỏ qua
+AUDIO_BACKEND_ENV = "AUDIO_BACKEND"
+NULL_AUDIO = os.environ.get(AUDIO_BACKEND_ENV, "").lower() == "null"
+
+# pygame chỉ được import khi khởi tạo âm thanh (init_audio), import module này không chặn và không cần loa
+pygame = None
+_service = None
+
+# Lớp sự kiện âm thanh, mỗi lớp một kênh mixer dành riêng để không cắt tiếng của nhau
+CHANNEL_SHOT = "shot"
+CHANNEL_SCORE = "score"
+CHANNEL_SYSTEM = "system"
+CHANNELS = (CHANNEL_SHOT, CHANNEL_SCORE, CHANNEL_SYSTEM)
+SHOT_SOUND_CODE = -3
+# Bộ đệm mixer nhỏ để tiếng súng phát ra với độ trễ thấp (mặc định của pygame là 512 mẫu)
+MIXER_BUFFER = 256
 
 # --- Khởi tạo mixer với cơ chế chờ đợi ---
-def initialize_mixer():
+def initialize_mixer(timeout=10.0, retry_interval=2.0):
     """
-    Cố gắng khởi tạo pygame mixer. Nếu thất bại, chờ và thử lại.
+    Cố gắng khởi tạo pygame mixer. Nếu thất bại, chờ và thử lại cho tới khi hết 'timeout' giây.
+    Trả về True nếu mixer đã sẵn sàng.
     """
+    deadline = time.monotonic() + timeout
     while not pygame.mixer.get_init():
-        print("⏳ Đang chờ thiết bị âm thanh sẵn sàng...")
+        log.info("⏳ Đang chờ thiết bị âm thanh sẵn sàng...")
         try:
-            pygame.mixer.init()
+            pygame.mixer.init(buffer=MIXER_BUFFER)
         except pygame.error as e:
-            print(f"Lỗi tạm thời, sẽ thử lại: {e}")
-            time.sleep(2)
-    print("✅ Pygame mixer đã khởi tạo thành công!")
-
-initialize_mixer()
+            if time.monotonic() + retry_interval > deadline:
+                log.warning("❌ Không khởi tạo được thiết bị âm thanh sau %.0fs: %s", timeout, e)
+                return False
+            log.info("Lỗi tạm thời, sẽ thử lại: %s", e)
+            time.sleep(retry_interval)
+    log.info("✅ Pygame mixer đã khởi tạo thành công!")
+    return True
 
 # --- Tải trước tất cả âm thanh vào bộ nhớ ---
 
@@ -39,51 +66,181 @@ SCORE_SOUNDS_PATHS = {
 # Dictionary để lưu các đối tượng âm thanh đã được tải vào RAM
 LOADED_SOUNDS = {}
 
+def _load_sound(code, filename):
+    file_path = os.path.join('sounds', filename)
+    if not os.path.exists(file_path):
+        log.warning("⚠️ Cảnh báo: Không tìm thấy file âm thanh để tải trước: %s", file_path)
+        return
+    try:
+        LOADED_SOUNDS[code] = pygame.mixer.Sound(file_path)
+    except pygame.error as e:
+        log.warning("Lỗi khi tải file %s: %s", file_path, e)
+
 def load_all_sounds():
     """
     Tải tất cả các file âm thanh từ đĩa vào một dictionary trong RAM.
+    Chạy trên luồng khởi động nên không chặn camera; tải tuần tự vì mixer của SDL không an toàn đa luồng.
     """
-    print("⏳ Đang tải trước các file âm thanh vào bộ nhớ...")
+    log.info("⏳ Đang tải trước các file âm thanh vào bộ nhớ...")
     for code, filename in SCORE_SOUNDS_PATHS.items():
-        file_path = os.path.join('sounds', filename)
-        if os.path.exists(file_path):
-            try:
-                LOADED_SOUNDS[code] = pygame.mixer.Sound(file_path)
-            except pygame.error as e:
-                print(f"Lỗi khi tải file {file_path}: {e}")
-        else:
-            print(f"⚠️ Cảnh báo: Không tìm thấy file âm thanh để tải trước: {file_path}")
-    print("✅ Đã tải xong âm thanh!")
+        _load_sound(code, filename)
+    log.info("✅ Đã tải xong âm thanh!")
 
-load_all_sounds()
+class PygameBackend:
+    """Phát qua pygame mixer với một kênh dành riêng (set_reserved) cho mỗi lớp sự kiện."""
+    def __init__(self):
+        pygame.mixer.set_reserved(len(CHANNELS))
+        self.channels = {name: pygame.mixer.Channel(i) for i, name in enumerate(CHANNELS)}
 
-# --- Các hàm phát âm thanh (giữ nguyên logic của bạn) ---
+    def play(self, channel, code):
+        sound_object = LOADED_SOUNDS.get(code)
+        if sound_object is None:
+            log.warning("⚠️ Không tìm thấy âm thanh đã được tải cho mã: %s", code)
+            return False
+        self.channels[channel].play(sound_object)
+        return True
 
-def play_sound_from_code(sound_code):
+    def busy(self, channel):
+        return self.channels[channel].get_busy()
+
+
+class NullBackend:
+    """Backend không phát gì (chạy headless/kiểm thử); ghi lại các lần phát để kiểm tra."""
+    def __init__(self, history=100):
+        self.played = deque(maxlen=history)
+
+    def play(self, channel, code):
+        self.played.append((channel, code))
+        return True
+
+    def busy(self, channel):
+        return False
+
+
+class AudioFeedbackService(Thread):
     """
-    Phát một âm thanh đã được tải trước từ RAM.
+    Phát âm thanh phản hồi trên luồng riêng; hàm gọi từ vòng lặp chụp/pipeline chỉ đưa yêu cầu vào hàng đợi.
+
+    Ưu tiên: tiếng súng (shot) > điểm (score) > hệ thống (system).
+      - shot: phát ngay trên kênh riêng; bắn dồn dập thì chỉ giữ lần mới nhất.
+      - score: đọc điểm lần lượt, chờ điểm trước đọc xong; điểm quá cũ (max_score_age) hoặc
+        hàng chờ quá dài (max_pending_scores) thì bỏ điểm cũ nhất.
+      - system: chỉ giữ thông báo mới nhất, phát khi kênh rảnh.
+    Lỗi của mixer được ghi log trong luồng này, không bao giờ lan ra luồng gọi.
     """
-    sound_object = LOADED_SOUNDS.get(sound_code)
-    if sound_object:
+    def __init__(self, backend, max_score_age=3.0, max_pending_scores=3):
+        super().__init__()
+        self.backend = backend
+        self.max_score_age = max_score_age
+        self.max_pending_scores = max_pending_scores
+        self.pending = {name: deque() for name in CHANNELS}
+        self._condition = Condition()
+        self.daemon = True
+        self.running = True
+        self._played = {name: metrics.counter("audio_played_total", "Số âm thanh đã phát", channel=name)
+                        for name in CHANNELS}
+        self._dropped = {name: metrics.counter("audio_dropped_total", "Số âm thanh bị bỏ (gộp/quá cũ)", channel=name)
+                         for name in CHANNELS}
+
+    def submit(self, channel, code):
+        """Không chặn: chỉ thêm yêu cầu và đánh thức luồng phát."""
+        with self._condition:
+            pending = self.pending[channel]
+            if channel != CHANNEL_SCORE and pending:
+                # Gộp: chỉ tiếng súng/thông báo mới nhất còn ý nghĩa
+                self._dropped[channel].inc(len(pending))
+                pending.clear()
+            pending.append((code, time.monotonic()))
+            while len(pending) > self.max_pending_scores:
+                pending.popleft()
+                self._dropped[channel].inc()
+            self._condition.notify()
+
+    def _next(self):
+        """Chọn yêu cầu kế tiếp theo thứ tự ưu tiên. Gọi khi đang giữ _condition."""
+        if self.pending[CHANNEL_SHOT]:
+            return CHANNEL_SHOT, self.pending[CHANNEL_SHOT].popleft()[0]
+        scores = self.pending[CHANNEL_SCORE]
+        now = time.monotonic()
+        while scores and now - scores[0][1] > self.max_score_age:
+            scores.popleft()
+            self._dropped[CHANNEL_SCORE].inc()
+        for channel in (CHANNEL_SCORE, CHANNEL_SYSTEM):
+            if self.pending[channel] and not self._safe_busy(channel):
+                return channel, self.pending[channel].popleft()[0]
+        return None
+
+    def _safe_busy(self, channel):
         try:
-            sound_object.play()
-        except Exception as e:
-            print(f"Lỗi khi phát âm thanh cho mã {sound_code}: {e}")
+            return self.backend.busy(channel)
+        except Exception:
+            return False
+
+    def run(self):
+        while self.running:
+            with self._condition:
+                request = self._next()
+                if request is None:
+                    # Còn điểm chờ kênh rảnh thì kiểm tra lại sau 20 ms, không thì ngủ tới khi có yêu cầu
+                    waiting = any(self.pending[c] for c in CHANNELS)
+                    self._condition.wait(0.02 if waiting else 0.5)
+                    continue
+            channel, code = request
+            try:
+                if self.backend.play(channel, code):
+                    self._played[channel].inc()
+            except Exception as e:
+                log.warning("Lỗi khi phát âm thanh cho mã %s: %s", code, e)
+
+    def stop(self):
+        self.running = False
+        with self._condition:
+            self._condition.notify()
+
+
+def init_audio(timeout=10.0):
+    """
+    Import pygame, khởi tạo mixer (có giới hạn thời gian), tải trước âm thanh và khởi động luồng phát.
+    Gọi trên luồng khởi động; thiếu card âm thanh thì trả về False thay vì treo cả hệ thống.
+    """
+    global pygame, _service
+    if NULL_AUDIO:
+        backend = NullBackend()
     else:
-        print(f"⚠️ Không tìm thấy âm thanh đã được tải cho mã: {sound_code}")
+        if pygame is None:
+            import pygame as _pygame
+            pygame = _pygame
+        if not initialize_mixer(timeout=timeout):
+            return False
+        load_all_sounds()
+        backend = PygameBackend()
+    _service = AudioFeedbackService(backend)
+    _service.start()
+    return True
+
+def stop_audio():
+    if _service is not None:
+        _service.stop()
+
+# --- Các hàm phát âm thanh (giữ nguyên giao diện cũ, nay chỉ xếp yêu cầu cho AudioFeedbackService) ---
+
+def play_sound_from_code(sound_code, channel=CHANNEL_SYSTEM):
+    """
+    Yêu cầu phát một âm thanh đã được tải trước. Âm thanh chưa khởi tạo xong thì bỏ qua. Không chặn.
+    """
+    if _service is not None:
+        _service.submit(channel, sound_code)
 
 def play_event_sound(event_type):
     """
-    Phát âm thanh cho các sự kiện cụ thể.
+    Phát âm thanh cho các sự kiện cụ thể (tiếng súng trên kênh shot, còn lại trên kênh system).
     """
-    play_sound_from_code(event_type)
+    play_sound_from_code(event_type, CHANNEL_SHOT if event_type == SHOT_SOUND_CODE else CHANNEL_SYSTEM)
 
 def play_score_sound(score):
     """
     Phát âm thanh tương ứng với điểm số.
     """
-    if score in LOADED_SOUNDS:
-        play_sound_from_code(score)
-    else:
-        # Nếu điểm không có trong từ điển, mặc định phát âm thanh "bắn trượt"
-        play_sound_from_code(0)
\ No newline at end of file
+    # Nếu điểm không có trong từ điển, mặc định phát âm thanh "bắn trượt"
+    code = score if score in SCORE_SOUNDS_PATHS and score >= 0 else 0
+    play_sound_from_code(code, CHANNEL_SCORE)
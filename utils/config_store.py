@@ -0,0 +1,241 @@
+"""
+Kho cấu hình giữ trong bộ nhớ, ghi xuống đĩa trên luồng nền.
+
+    store = ConfigStore("config.json")
+    config = store.load()
+    store.start()
+    store.update_lane("lane1", {'zoom': 2.5})   # không chạm đĩa, chỉ đánh dấu cần lưu
+    store.subscribe(lambda old, new: ...)       # được gọi khi file bị sửa từ bên ngoài
+
+Nhiều thay đổi liên tiếp (kéo thanh zoom) được gộp thành một lần ghi sau 'debounce' giây yên lặng
+(nhưng không trễ quá 'max_delay'). Mỗi lần ghi là ghi file tạm + fsync + os.replace nên mất điện
+giữa chừng vẫn còn nguyên file cũ. File có trường "version"; file cũ hơn được nâng cấp khi tải.
+"""
+import copy
+import json
+import os
+import time
+from threading import Condition, Lock, Thread
+
+from utils.logger import get_logger
+
+log = get_logger("config")
+
+SCHEMA_VERSION = 1
+
+
+def _migrate_v0(config):
+    """Bản một camera: zoom/center ở cấp trên cùng -> một làn trong 'lanes' (các trường khác lấy mặc định)."""
+    if not config.get('lanes'):
+        config['lanes'] = [{'zoom': config.get('zoom', 1.0), 'center': config.get('center')}]
+    config.pop('zoom', None)
+    config.pop('center', None)
+    return config
+
+
+# Phiên bản nguồn -> hàm nâng cấp lên phiên bản kế tiếp
+MIGRATIONS = {0: _migrate_v0}
+
+
+def migrate(config):
+    """Nâng cấp cấu hình đã đọc lên SCHEMA_VERSION. File không có "version" là phiên bản 0."""
+    version = int(config.get('version', 0))
+    if version > SCHEMA_VERSION:
+        log.warning("⚠️ File cấu hình phiên bản %s mới hơn phần mềm (%s), giữ nguyên các trường.",
+                    version, SCHEMA_VERSION)
+        return config
+    while version < SCHEMA_VERSION:
+        config = MIGRATIONS[version](config)
+        version += 1
+        log.info("🔧 Đã nâng cấp cấu hình lên phiên bản %d.", version)
+    config['version'] = version
+    return config
+
+
+def write_atomic(path, data):
+    """Ghi JSON vào file tạm cùng thư mục, fsync rồi đổi tên đè lên file đích."""
+    directory = os.path.dirname(os.path.abspath(path))
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f, indent=4)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    # fsync thư mục để chính thao tác đổi tên cũng được ghi xuống thẻ nhớ
+    try:
+        dir_fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(dir_fd)
+    except OSError:
+        pass
+    finally:
+        os.close(dir_fd)
+
+
+class ConfigStore(Thread):
+    """Cấu hình dùng chung cho cả tiến trình; mọi thao tác đọc/ghi trên bộ nhớ, chỉ luồng của store chạm đĩa."""
+    def __init__(self, path, debounce=0.5, max_delay=5.0, poll_interval=1.0):
+        super().__init__()
+        self.path = path
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.poll_interval = poll_interval
+        self._data = {'version': SCHEMA_VERSION, 'lanes': []}
+        self._condition = Condition()
+        self._dirty_since = None
+        self._last_change = None
+        self._mtime = None
+        self._subscribers = []
+        self._write_lock = Lock()
+        self.daemon = True
+        self.running = True
+
+    # --- Đọc ---
+
+    def _stat_mtime(self):
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except OSError:
+            return None
+
+    def _read(self):
+        with open(self.path, 'r') as f:
+            return migrate(json.load(f))
+
+    def load(self):
+        """Đọc file (nếu có) vào bộ nhớ. Trả về bản sao cấu hình."""
+        mtime = self._stat_mtime()
+        data = None
+        if mtime is not None:
+            try:
+                data = self._read()
+            except (OSError, ValueError) as e:
+                log.error("❌ Lỗi khi tải file cấu hình, sử dụng giá trị mặc định: %s", e)
+        with self._condition:
+            if data is not None:
+                self._data = data
+            self._mtime = mtime
+            return copy.deepcopy(self._data)
+
+    def get(self, key, default=None):
+        with self._condition:
+            return copy.deepcopy(self._data.get(key, default))
+
+    def snapshot(self):
+        with self._condition:
+            return copy.deepcopy(self._data)
+
+    def lane(self, lane_id):
+        with self._condition:
+            for section in self._data.get('lanes', []):
+                if section.get('id') == lane_id:
+                    return copy.deepcopy(section)
+        return None
+
+    # --- Ghi (không chặn, chỉ đổi dữ liệu trong bộ nhớ) ---
+
+    def _mark_dirty(self):
+        now = time.monotonic()
+        if self._dirty_since is None:
+            self._dirty_since = now
+        self._last_change = now
+        self._condition.notify()
+
+    def update(self, **values):
+        """Cập nhật các khóa cấp trên cùng (matcher, detector, ...). Giá trị không đổi thì không ghi lại."""
+        with self._condition:
+            changed = {k: v for k, v in values.items() if self._data.get(k) != v}
+            if changed:
+                self._data.update(copy.deepcopy(changed))
+                self._mark_dirty()
+
+    def update_lane(self, lane_id, fields):
+        """Cập nhật (hoặc thêm) phần cấu hình của một làn."""
+        with self._condition:
+            lanes = self._data.setdefault('lanes', [])
+            section = next((s for s in lanes if s.get('id') == lane_id), None)
+            if section is None:
+                section = {'id': lane_id}
+                lanes.append(section)
+            changed = {k: v for k, v in fields.items() if section.get(k) != v}
+            if changed:
+                section.update(copy.deepcopy(changed))
+                self._mark_dirty()
+
+    def subscribe(self, callback):
+        """callback(old, new) được gọi trên luồng của store khi file bị sửa từ bên ngoài."""
+        self._subscribers.append(callback)
+
+    # --- Luồng nền ---
+
+    def _due(self, now):
+        if self._dirty_since is None:
+            return None
+        return min(self._last_change + self.debounce, self._dirty_since + self.max_delay) - now
+
+    def flush(self):
+        """Ghi ngay nếu còn thay đổi chưa lưu."""
+        with self._write_lock:
+            with self._condition:
+                if self._dirty_since is None:
+                    return
+                data = copy.deepcopy(self._data)
+                self._dirty_since = self._last_change = None
+            try:
+                write_atomic(self.path, data)
+            except OSError as e:
+                log.error("❌ Lỗi khi lưu file cấu hình: %s", e)
+                with self._condition:
+                    # Để lần sau thử lại
+                    self._mark_dirty()
+                return
+            with self._condition:
+                self._mtime = self._stat_mtime()
+        log.info("💾 Đã lưu cấu hình vào %s", self.path)
+
+    def _check_external_edit(self):
+        mtime = self._stat_mtime()
+        if mtime is None or mtime == self._mtime:
+            return
+        try:
+            data = self._read()
+        except (OSError, ValueError) as e:
+            # Có thể trình soạn thảo đang ghi dở; lần kiểm tra sau đọc lại
+            log.warning("⚠️ File cấu hình vừa bị sửa nhưng chưa đọc được: %s", e)
+            return
+        with self._condition:
+            if self._dirty_since is not None:
+                log.warning("⚠️ File cấu hình bị sửa từ bên ngoài, bỏ các thay đổi chưa lưu trong bộ nhớ.")
+                self._dirty_since = self._last_change = None
+            old, self._data, self._mtime = self._data, data, mtime
+        log.info("🔄 Đã tải lại cấu hình do file bị sửa từ bên ngoài.")
+        for callback in self._subscribers:
+            try:
+                callback(copy.deepcopy(old), copy.deepcopy(data))
+            except Exception as e:
+                log.error("Lỗi khi áp dụng cấu hình mới: %s", e)
+
+    def run(self):
+        next_poll = time.monotonic() + self.poll_interval
+        while self.running:
+            with self._condition:
+                now = time.monotonic()
+                due = self._due(now)
+                wait = next_poll - now if due is None else min(due, next_poll - now)
+                if wait > 0:
+                    self._condition.wait(wait)
+                due = self._due(time.monotonic())
+            if due is not None and due <= 0:
+                self.flush()
+            if time.monotonic() >= next_poll:
+                with self._write_lock:
+                    self._check_external_edit()
+                next_poll = time.monotonic() + self.poll_interval
+
+    def stop(self):
+        self.running = False
+        with self._condition:
+            self._condition.notify()
+        self.flush()
@@ -4,6 +4,10 @@ import time
 import numpy as np
 from typing import List, Tuple
 
+from utils.logger import get_logger
+
+log = get_logger("image")
+
 def save_image(image, prefix="capture", folder="capture"):
     """Lưu ảnh vào thư mục 'capture' nằm cùng cấp với file utils.py/main."""
     base_dir = os.path.dirname(os.path.abspath(__file__))
@@ -12,7 +16,7 @@ def save_image(image, prefix="capture", folder="capture"):
     filename = f"{prefix}_{int(time.time())}.jpg"
     filepath = os.path.join(folder_path, filename)
     cv2.imwrite(filepath, image)
-    print(f"💾 Saved image: {filepath}")
+    log.info("💾 Saved image: %s", filepath)
     return filepath
 
 def draw_center_cross(image, color=(0, 0, 255), size=10, thickness=2, center=None):
@@ -84,4 +88,25 @@ def show_simple_message(message: str, window_title: str = "Ket qua"):
     cv2.putText(img, message, (20, 80), cv2.FONT_HERSHEY_SIMPLEX, 1.2, (0, 0, 255), 3, cv2.LINE_AA)
     cv2.imshow(window_title, img)
     cv2.waitKey(0)
-    cv2.destroyWindow(window_title)
\ No newline at end of file
+    cv2.destroyWindow(window_title)
+
+def sharpness_scores(frames: List[np.ndarray], center: Tuple[int, int], radius: int = 64) -> np.ndarray:
+    """
+    Độ nét của một loạt frame quanh tâm ngắm, tính trong một lượt NumPy cho cả loạt:
+    phương sai Laplacian (4 lân cận) trên vùng vuông cạnh 2*radius quanh 'center', nhân với
+    độ tương phản (độ lệch chuẩn cường độ) để frame bị che/cháy sáng xếp cuối.
+    Trả về mảng điểm (N,), càng lớn càng nét.
+    """
+    h, w = frames[0].shape[:2]
+    cx = max(radius, min(int(center[0]), w - radius))
+    cy = max(radius, min(int(center[1]), h - radius))
+    x1, y1 = max(0, cx - radius), max(0, cy - radius)
+    x2, y2 = min(w, cx + radius), min(h, cy + radius)
+    # Xếp các vùng trung tâm thành khối (N, h, w) rồi tính Laplacian bằng phép dịch mảng
+    stack = np.stack([
+        cv2.cvtColor(frame[y1:y2, x1:x2], cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame[y1:y2, x1:x2]
+        for frame in frames
+    ]).astype(np.float32)
+    laplacian = (stack[:, :-2, 1:-1] + stack[:, 2:, 1:-1] + stack[:, 1:-1, :-2] + stack[:, 1:-1, 2:]
+                 - 4.0 * stack[:, 1:-1, 1:-1])
+    return laplacian.var(axis=(1, 2)) * stack.std(axis=(1, 2))
@@ -0,0 +1,70 @@
+"""
+Logger có cấp độ và giới hạn tần suất cho đường nóng (thay cho print trong vòng lặp chụp/xử lý).
+
+    from utils.logger import get_logger
+    log = get_logger("lane")
+    log.info("📸 [%s] Chụp ảnh lúc %s", lane_id, capture_time)
+
+Cấp độ lấy từ biến môi trường LOG_LEVEL (mặc định INFO). Cùng một mẫu thông điệp chỉ được in tối đa
+'burst' lần mỗi 'interval' giây; số lần bị bỏ được ghi kèm ở lần in kế tiếp.
+Dùng tham số kiểu %s (không dùng f-string) để các lần log cùng mẫu được gom chung.
+"""
+import logging
+import os
+import sys
+import time
+from threading import Lock
+
+LOG_LEVEL_ENV = "LOG_LEVEL"
+ROOT_LOGGER = "shooting"
+
+
+class RateLimitFilter(logging.Filter):
+    def __init__(self, burst=5, interval=10.0):
+        super().__init__()
+        self.burst = burst
+        self.interval = interval
+        self._windows = {}
+        self._lock = Lock()
+
+    def filter(self, record):
+        # Cảnh báo lỗi nghiêm trọng luôn được in
+        if record.levelno >= logging.ERROR:
+            return True
+        key = (record.name, record.msg)
+        now = time.monotonic()
+        with self._lock:
+            window_start, count, suppressed = self._windows.get(key, (now, 0, 0))
+            if now - window_start >= self.interval:
+                window_start, count = now, 0
+            if count >= self.burst:
+                self._windows[key] = (window_start, count, suppressed + 1)
+                return False
+            self._windows[key] = (window_start, count + 1, 0)
+        if suppressed:
+            record.msg = f"{record.msg} (đã bỏ {suppressed} lần lặp lại)"
+        return True
+
+
+_configured = False
+_configure_lock = Lock()
+
+
+def _configure():
+    global _configured
+    with _configure_lock:
+        if _configured:
+            return
+        root = logging.getLogger(ROOT_LOGGER)
+        root.setLevel(os.environ.get(LOG_LEVEL_ENV, "INFO").upper())
+        handler = logging.StreamHandler(sys.stdout)
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname).1s [%(name)s] %(message)s", "%H:%M:%S"))
+        handler.addFilter(RateLimitFilter())
+        root.addHandler(handler)
+        root.propagate = False
+        _configured = True
+
+
+def get_logger(name):
+    _configure()
+    return logging.getLogger(f"{ROOT_LOGGER}.{name}")
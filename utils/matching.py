@@ -0,0 +1,111 @@
+import cv2
+import time
+import numpy as np
+from typing import Tuple
+
+from utils.logger import get_logger
+
+log = get_logger("matching")
+
+# Các kiểu matcher có thể chọn trong config.json ("matcher")
+MATCHER_EXACT = "exact"
+MATCHER_APPROX = "approx"
+
+
+def _knn_to_arrays(knn_matches, n_query: int, ratio_thresh: float) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Chuyển kết quả knnMatch (k=2) thành mảng chỉ số tốt nhất + mặt nạ đạt Lowe's ratio test.
+    """
+    best = np.full(n_query, -1, dtype=np.int32)
+    ok = np.zeros(n_query, dtype=bool)
+    pairs = [(p[0].queryIdx, p[0].trainIdx, p[0].distance, p[1].distance) for p in knn_matches if len(p) == 2]
+    if not pairs:
+        return best, ok
+    arr = np.array(pairs, dtype=np.float32)
+    query_idx = arr[:, 0].astype(np.int32)
+    best[query_idx] = arr[:, 1].astype(np.int32)
+    ok[query_idx] = arr[:, 2] < ratio_thresh * arr[:, 3]
+    return best, ok
+
+
+def mutual_matches(best12: np.ndarray, ok12: np.ndarray, best21: np.ndarray, ok21: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Lọc match tương hỗ bằng NumPy: i -> j (ảnh 1 sang 2) và j -> i (ảnh 2 sang 1) đều đạt ratio test.
+    Trả về (chỉ số trên ảnh 1, chỉ số trên ảnh 2).
+    """
+    idx1 = np.nonzero(ok12)[0]
+    idx2 = best12[idx1]
+    keep = ok21[idx2] & (best21[idx2] == idx1)
+    return idx1[keep], idx2[keep]
+
+
+class BruteForceMatcher:
+    """Match chính xác bằng BFMatcher (Hamming), giống cách làm ban đầu."""
+    name = MATCHER_EXACT
+
+    def __init__(self):
+        self.matcher = cv2.BFMatcher(cv2.NORM_HAMMING)
+
+    def match(self, des_ref: np.ndarray, des_crop: np.ndarray, ratio_thresh: float = 0.75):
+        matches12 = self.matcher.knnMatch(des_ref, des_crop, k=2)
+        matches21 = self.matcher.knnMatch(des_crop, des_ref, k=2)
+        best12, ok12 = _knn_to_arrays(matches12, len(des_ref), ratio_thresh)
+        best21, ok21 = _knn_to_arrays(matches21, len(des_crop), ratio_thresh)
+        return mutual_matches(best12, ok12, best21, ok21)
+
+
+class FlannLshMatcher:
+    """
+    Match xấp xỉ bằng FLANN-LSH cho descriptor nhị phân (ORB).
+    Chỉ mục LSH của ảnh gốc được dựng một lần và dùng lại cho mọi lần bắn.
+    """
+    name = MATCHER_APPROX
+
+    FLANN_INDEX_LSH = 6
+
+    def __init__(self, table_number: int = 6, key_size: int = 12, multi_probe_level: int = 1, checks: int = 32):
+        self.index_params = dict(
+            algorithm=self.FLANN_INDEX_LSH,
+            table_number=table_number,
+            key_size=key_size,
+            multi_probe_level=multi_probe_level,
+        )
+        self.search_params = dict(checks=checks)
+        self._ref_matcher = None
+        self._ref_descriptors = None
+
+    def _new_matcher(self):
+        return cv2.FlannBasedMatcher(self.index_params, self.search_params)
+
+    def _reference_matcher(self, des_ref: np.ndarray):
+        if self._ref_descriptors is not des_ref:
+            matcher = self._new_matcher()
+            matcher.add([des_ref])
+            matcher.train()
+            self._ref_matcher = matcher
+            self._ref_descriptors = des_ref
+        return self._ref_matcher
+
+    def match(self, des_ref: np.ndarray, des_crop: np.ndarray, ratio_thresh: float = 0.75):
+        # crop -> gốc: dùng chỉ mục đã dựng sẵn của ảnh gốc
+        matches21 = self._reference_matcher(des_ref).knnMatch(des_crop, k=2)
+        # gốc -> crop: chỉ mục của ảnh crop phải dựng lại mỗi lần
+        matches12 = self._new_matcher().knnMatch(des_ref, des_crop, k=2)
+        best12, ok12 = _knn_to_arrays(matches12, len(des_ref), ratio_thresh)
+        best21, ok21 = _knn_to_arrays(matches21, len(des_crop), ratio_thresh)
+        return mutual_matches(best12, ok12, best21, ok21)
+
+
+def create_matcher(matcher_type: str = MATCHER_EXACT):
+    if matcher_type == MATCHER_APPROX:
+        return FlannLshMatcher()
+    if matcher_type != MATCHER_EXACT:
+        log.warning("⚠️ Kiểu matcher không hợp lệ '%s', dùng '%s'.", matcher_type, MATCHER_EXACT)
+    return BruteForceMatcher()
+
+
+def timed_match(matcher, des_ref: np.ndarray, des_crop: np.ndarray, ratio_thresh: float = 0.75):
+    """Chạy matcher và trả về (idx_ref, idx_crop, thời gian match tính bằng ms)."""
+    start = time.perf_counter()
+    idx_ref, idx_crop = matcher.match(des_ref, des_crop, ratio_thresh)
+    return idx_ref, idx_crop, (time.perf_counter() - start) * 1000.0
@@ -0,0 +1,292 @@
+"""
+Lớp đo đạc nhẹ cho đường nóng: counter, gauge, histogram và timer theo công đoạn.
+
+    from utils import metrics
+    frames = metrics.counter("frames_captured_total", "Số frame đã chụp", lane="lane1")
+    frames.inc()
+    with metrics.timer("capture_ms", "Thời gian chụp một frame", lane="lane1"):
+        ...
+
+Các metric được xuất dạng text Prometheus qua MetricsServer (GET /metrics) và được MetricsPusher
+gửi định kỳ lên server (/metrics_upload) dưới dạng JSON.
+"""
+import bisect
+import json
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Event, Lock, Thread
+
+import requests
+
+from utils.logger import get_logger
+from utils.network import create_session
+
+log = get_logger("metrics")
+
+# Mốc histogram mặc định (ms), đủ phủ từ thao tác vài ms tới suy luận vài giây trên Pi
+DEFAULT_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+
+def _label_key(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
+
+
+class Counter:
+    """Giá trị chỉ tăng (số frame, số lần bỏ, số lỗi...)."""
+    kind = "counter"
+
+    def __init__(self):
+        self.value = 0.0
+        self._lock = Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def snapshot(self):
+        return self.value
+
+
+class Gauge:
+    """Giá trị tức thời; nếu có 'func' thì được đọc lại mỗi lần xuất (ví dụ qsize của hàng đợi)."""
+    kind = "gauge"
+
+    def __init__(self, func=None):
+        self.value = 0.0
+        self.func = func
+
+    def set(self, value):
+        self.value = value
+
+    def snapshot(self):
+        if self.func is not None:
+            try:
+                return float(self.func())
+            except Exception:
+                return float('nan')
+        return self.value
+
+
+class Histogram:
+    """Phân bố độ trễ theo các mốc cố định; observe() chỉ là một lần tìm nhị phân và cộng dồn."""
+    kind = "histogram"
+
+    def __init__(self, buckets=DEFAULT_BUCKETS_MS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def time(self):
+        """Context manager đo thời gian khối lệnh (ms) rồi observe()."""
+        return _Timer(self)
+
+    def quantile(self, q):
+        """Ước lượng phân vị từ các mốc (lấy cận trên của mốc chứa phân vị)."""
+        with self._lock:
+            counts, total = list(self.counts), self.count
+        if total == 0:
+            return None
+        rank, seen = q * total, 0
+        for index, count in enumerate(counts):
+            seen += count
+            if seen >= rank:
+                return self.buckets[index] if index < len(self.buckets) else float('inf')
+        return float('inf')
+
+    def snapshot(self):
+        with self._lock:
+            return {'count': self.count, 'sum': round(self.sum, 3), 'buckets': list(self.counts)}
+
+
+class _Timer:
+    __slots__ = ("histogram", "start")
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.histogram.observe((time.perf_counter() - self.start) * 1000.0)
+        return False
+
+
+class MetricsRegistry:
+    """Tập các metric theo (tên, nhãn). Lấy lại cùng tên + nhãn sẽ trả về đúng đối tượng đã tạo."""
+    def __init__(self):
+        self._metrics = {}
+        self._help = {}
+        self._lock = Lock()
+
+    def _get(self, cls, name, help_text, labels, **kwargs):
+        key = (name, _label_key(labels))
+        metric = self._metrics.get(key)
+        if metric is None:
+            with self._lock:
+                metric = self._metrics.get(key)
+                if metric is None:
+                    metric = self._metrics[key] = cls(**kwargs)
+                    if help_text:
+                        self._help.setdefault(name, help_text)
+        return metric
+
+    def counter(self, name, help_text="", **labels):
+        return self._get(Counter, name, help_text, labels)
+
+    def gauge(self, name, help_text="", func=None, **labels):
+        gauge = self._get(Gauge, name, help_text, labels)
+        if func is not None:
+            gauge.func = func
+        return gauge
+
+    def histogram(self, name, help_text="", buckets=DEFAULT_BUCKETS_MS, **labels):
+        return self._get(Histogram, name, help_text, labels, buckets=buckets)
+
+    def timer(self, name, help_text="", **labels):
+        return self.histogram(name, help_text, **labels).time()
+
+    def _grouped(self):
+        with self._lock:
+            items = list(self._metrics.items())
+        grouped = {}
+        for (name, key), metric in sorted(items, key=lambda item: item[0]):
+            grouped.setdefault(name, []).append((key, metric))
+        return grouped
+
+    def render_prometheus(self):
+        lines = []
+        for name, series in self._grouped().items():
+            if name in self._help:
+                lines.append(f"# HELP {name} {self._help[name]}")
+            lines.append(f"# TYPE {name} {series[0][1].kind}")
+            for key, metric in series:
+                if metric.kind == "histogram":
+                    snapshot, cumulative = metric.snapshot(), 0
+                    for bound, count in zip(list(metric.buckets) + ["+Inf"], snapshot['buckets']):
+                        cumulative += count
+                        lines.append(f"{name}_bucket{_format_labels(key, [('le', bound)])} {cumulative}")
+                    lines.append(f"{name}_sum{_format_labels(key)} {snapshot['sum']}")
+                    lines.append(f"{name}_count{_format_labels(key)} {snapshot['count']}")
+                else:
+                    lines.append(f"{name}{_format_labels(key)} {metric.snapshot()}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self):
+        """Dạng JSON gọn để đẩy lên server: {tên: [{labels, value}]}."""
+        result = {}
+        for name, series in self._grouped().items():
+            result[name] = [{'labels': dict(key), 'value': metric.snapshot()} for key, metric in series]
+        return result
+
+
+# Registry mặc định dùng chung cho cả tiến trình
+REGISTRY = MetricsRegistry()
+counter = REGISTRY.counter
+gauge = REGISTRY.gauge
+histogram = REGISTRY.histogram
+timer = REGISTRY.timer
+
+
+class FpsMeter:
+    """Đếm frame và cập nhật gauge FPS mỗi 'interval' giây (chỉ tốn một phép cộng mỗi frame)."""
+    def __init__(self, gauge_metric, interval=1.0):
+        self.gauge = gauge_metric
+        self.interval = interval
+        self.frames = 0
+        self.window_start = time.monotonic()
+
+    def tick(self):
+        self.frames += 1
+        now = time.monotonic()
+        elapsed = now - self.window_start
+        if elapsed >= self.interval:
+            self.gauge.set(round(self.frames / elapsed, 1))
+            self.frames = 0
+            self.window_start = now
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    registry = REGISTRY
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split('?')[0] == '/metrics':
+            body = self.registry.render_prometheus().encode('utf-8')
+            content_type = 'text/plain; version=0.0.4; charset=utf-8'
+        elif self.path.split('?')[0] == '/metrics.json':
+            body = json.dumps(self.registry.snapshot()).encode('utf-8')
+            content_type = 'application/json'
+        else:
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class MetricsServer:
+    """HTTP cục bộ xuất metric: GET /metrics (Prometheus text) và /metrics.json."""
+    def __init__(self, host="0.0.0.0", port=9108, registry=REGISTRY):
+        handler = type("BoundMetricsHandler", (_MetricsHandler,), {'registry': registry})
+        self.httpd = ThreadingHTTPServer((host, port), handler)
+        self.httpd.daemon_threads = True
+        self.thread = Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        log.info("📈 Metrics tại http://%s:%s/metrics", self.httpd.server_address[0], self.httpd.server_address[1])
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class MetricsPusher(Thread):
+    """Gửi ảnh chụp metric lên server theo chu kỳ, để chẩn đoán làn chậm mà không cần SSH vào Pi."""
+    def __init__(self, server_url, interval=10.0, registry=REGISTRY, source=None):
+        super().__init__()
+        self.url = f"{server_url}/metrics_upload"
+        self.interval = interval
+        self.registry = registry
+        self.source = source
+        self.session = create_session(pool_size=1)
+        self._stop_event = Event()
+        self.daemon = True
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            payload = {'source': self.source, 'time': time.time(), 'metrics': self.registry.snapshot()}
+            try:
+                self.session.post(self.url, json=payload, timeout=(1.0, 3.0))
+            except requests.exceptions.RequestException:
+                # Mất mạng thì bỏ lượt này, lượt sau gửi ảnh chụp mới hơn
+                counter("metrics_push_errors_total", "Số lần gửi metric lên server thất bại").inc()
+
+    def stop(self):
+        self._stop_event.set()
+        self.session.close()
@@ -0,0 +1,34 @@
+import queue
+import requests
+from requests.adapters import HTTPAdapter
+
+
+def create_session(pool_size: int = 4) -> requests.Session:
+    """
+    Session HTTP dùng chung kết nối keep-alive, tránh mở TCP mới cho mỗi request.
+    Không retry tự động: dữ liệu stream đã cũ thì bỏ, không gửi lại.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def put_drop_oldest(q: queue.Queue, item) -> int:
+    """
+    Đưa item vào hàng đợi; nếu đầy thì bỏ phần tử cũ nhất thay vì chặn hoặc bỏ item mới.
+    Trả về số phần tử đã bị bỏ.
+    """
+    dropped = 0
+    while True:
+        try:
+            q.put_nowait(item)
+            return dropped
+        except queue.Full:
+            try:
+                q.get_nowait()
+                q.task_done()
+                dropped += 1
+            except queue.Empty:
+                pass
@@ -1,12 +1,32 @@
 import cv2
 import numpy as np
-from typing import Optional, Tuple, List
-import os
+from typing import Optional, Tuple
 
-def friendly_object_name(filename: str) -> str:
-    base = filename.split('/')[-1]
-    name, _ = base.split('.') if '.' in base else (base, '')
-    return name.replace('_', ' ')
+from utils.matching import MATCHER_EXACT, create_matcher, timed_match
+from utils.logger import get_logger
+
+log = get_logger("processing")
+
+# Tham số ORB dùng chung cho ảnh gốc và ảnh crop (đổi tham số sẽ làm mới cache đặc trưng)
+ORB_PARAMS = {"nfeatures": 1500, "scaleFactor": 1.2, "edgeThreshold": 15, "patchSize": 31}
+
+def create_orb():
+    return cv2.ORB_create(**ORB_PARAMS)
+
+def extract_crop_features(obj_crop: np.ndarray) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """
+    Trích xuất ORB của ảnh crop một lần: (tọa độ keypoints (N, 2) float32, descriptors).
+    Dạng mảng để gửi được sang process pool và dùng chung cho nhận dạng bia lẫn đăng ký.
+    """
+    keypoints, descriptors = create_orb().detectAndCompute(obj_crop, None)
+    return np.float32([kp.pt for kp in keypoints]).reshape(-1, 2), descriptors
+
+def get_aim_point(image, calibrated_center) -> Tuple[int, int]:
+    """Tâm ngắm đã hiệu chỉnh, hoặc tâm khung hình nếu chưa hiệu chỉnh."""
+    if calibrated_center:
+        return calibrated_center['x'], calibrated_center['y']
+    h, w = image.shape[:2]
+    return w // 2, h // 2
 
 # <<< SỬA ĐỔI: Thêm tham số 'calibrated_center' vào hàm >>>
 def check_object_center(results, image, calibrated_center, conf_threshold=0.5):
@@ -18,16 +38,16 @@ def check_object_center(results, image, calibrated_center, conf_threshold=0.5):
         # Nếu đã hiệu chỉnh, dùng tọa độ đó
         center_x = calibrated_center['x']
         center_y = calibrated_center['y']
-        print(f"Sử dụng tâm đã hiệu chỉnh: ({center_x}, {center_y})")
+        log.debug("Sử dụng tâm đã hiệu chỉnh: (%d, %d)", center_x, center_y)
     else:
         # Nếu chưa (giá trị là None), dùng tâm mặc định của khung hình
         h, w = image.shape[:2]
         center_x = w // 2
         center_y = h // 2
-        print(f"Sử dụng tâm mặc định: ({center_x}, {center_y})")
+        log.debug("Sử dụng tâm mặc định: (%d, %d)", center_x, center_y)
 
     if not results or not results[0].boxes:
-        print("⚠ Không tìm thấy object.")
+        log.info("⚠ Không tìm thấy object.")
         return "TRƯỢT", None, (center_x, center_y) # Trả về tâm đã sử dụng
 
     res = results[0]
@@ -41,7 +61,7 @@ def check_object_center(results, image, calibrated_center, conf_threshold=0.5):
         x1, y1, x2, y2 = [int(round(v)) for v in box[:4]]
         # Kiểm tra xem tâm ngắm có nằm trong bounding box không
         if x1 <= center_x <= x2 and y1 <= center_y <= y2:
-            print(f"✅ TRÚNG | Tâm ngắm ({center_x}, {center_y}) nằm trong mục tiêu.")
+            log.info("✅ TRÚNG | Tâm ngắm (%d, %d) nằm trong mục tiêu.", center_x, center_y)
 
             orig_w = x2 - x1
             orig_h = y2 - y1
@@ -55,90 +75,87 @@ def check_object_center(results, image, calibrated_center, conf_threshold=0.5):
             
             return "TRÚNG", obj_crop, shot_point_relative
 
-    print("❌ TRƯỢT | Tâm ngắm không nằm trong bất kỳ mục tiêu nào.")
+    log.info("❌ TRƯỢT | Tâm ngắm không nằm trong bất kỳ mục tiêu nào.")
     return "TRƯỢT", None, (center_x, center_y) # Trả về tâm đã sử dụng
 
-def warp_crop_to_original(
+def find_crop_homography(
     original_img: np.ndarray,
     obj_crop: np.ndarray,
-    shot_point: Optional[Tuple[float, float]] = None,
     min_inliers: int = 10,
     ratio_thresh: float = 0.75,
     ransac_thresh: float = 4.0,
-    max_reproj: float = 5.0,
-) -> Tuple[Optional[np.ndarray], Optional[Tuple[float, float]]]:
+    reference=None,
+    matcher=None,
+    stats: Optional[dict] = None,
+    crop_features: Optional[Tuple[np.ndarray, Optional[np.ndarray]]] = None,
+) -> Optional[np.ndarray]:
+    """
+    Tìm homography crop -> ảnh bia gốc bằng ORB + match + RANSAC. Trả về None nếu thất bại.
+    Nếu truyền 'reference' (ReferenceTarget đã trích xuất sẵn) thì chỉ cần trích xuất đặc trưng của ảnh crop.
+    'matcher' chọn backend match (mặc định BFMatcher chính xác); nếu truyền 'stats' (dict)
+    thì hàm ghi vào đó số match, số inlier, thời gian match và homography tìm được.
+    'crop_features' là kết quả extract_crop_features(obj_crop) đã tính trước (không trích xuất lại).
+    """
+    if reference is not None:
+        original_img = reference.image
     if original_img is None or obj_crop is None:
-        print("[warp_crop_to_original] ERROR: Ảnh đầu vào bị None")
-        return None, None
-
-    orb = cv2.ORB_create(nfeatures=1500, scaleFactor=1.2, edgeThreshold=15, patchSize=31)
-    kp1, des1 = orb.detectAndCompute(original_img, None)
-    kp2, des2 = orb.detectAndCompute(obj_crop, None)
-
-    if des1 is None or des2 is None or len(kp1) < 10 or len(kp2) < 10:
-        print("[warp_crop_to_original] Không đủ đặc trưng để match.")
-        return None, None
-
-    bf = cv2.BFMatcher(cv2.NORM_HAMMING)
-    matches12 = bf.knnMatch(des1, des2, k=2)
-    matches21 = bf.knnMatch(des2, des1, k=2)
-    
-    # Lọc các điểm match tốt bằng Lowe's ratio test
-    good12 = [m for m, n in matches12 if m.distance < ratio_thresh * n.distance]
-    good21 = [m for m, n in matches21 if m.distance < ratio_thresh * n.distance]
-
-    # Lọc các điểm match tương hỗ (mutual matches)
-    mutual = []
-    reverse_map = {(m.trainIdx, m.queryIdx) for m in good21}
-    for m in good12:
-        if (m.queryIdx, m.trainIdx) in reverse_map:
-            mutual.append(m)
-
-    if len(mutual) < min_inliers:
-        print(f"[warp_crop_to_original] Mutual matches quá ít: {len(mutual)}")
-        return None, None
-
-    src_pts = np.float32([kp1[m.queryIdx].pt for m in mutual]).reshape(-1, 1, 2)
-    dst_pts = np.float32([kp2[m.trainIdx].pt for m in mutual]).reshape(-1, 1, 2)
+        log.error("[find_crop_homography] ERROR: Ảnh đầu vào bị None")
+        return None
+
+    if reference is not None:
+        kp1, des1 = reference.keypoints, reference.descriptors
+    else:
+        kp1, des1 = create_orb().detectAndCompute(original_img, None)
+    crop_points, des2 = crop_features if crop_features is not None else extract_crop_features(obj_crop)
+
+    if des1 is None or des2 is None or len(kp1) < 10 or len(crop_points) < 10:
+        log.info("[find_crop_homography] Không đủ đặc trưng để match.")
+        return None
+
+    if matcher is None:
+        matcher = create_matcher(MATCHER_EXACT)
+    idx_ref, idx_crop, match_ms = timed_match(matcher, des1, des2, ratio_thresh)
+    if stats is not None:
+        stats.update({"matcher": matcher.name, "matches": int(len(idx_ref)), "inliers": 0, "match_ms": match_ms})
+
+    if len(idx_ref) < min_inliers:
+        log.info("[find_crop_homography] Mutual matches quá ít: %d", len(idx_ref))
+        return None
+
+    if reference is not None:
+        src_pts = reference.points[idx_ref].reshape(-1, 1, 2)
+    else:
+        src_pts = np.float32([kp1[i].pt for i in idx_ref]).reshape(-1, 1, 2)
+    dst_pts = crop_points[idx_crop].reshape(-1, 1, 2)
 
     H, mask = cv2.findHomography(dst_pts, src_pts, cv2.RANSAC, ransac_thresh)
+    if stats is not None and mask is not None:
+        stats["inliers"] = int(mask.sum())
     if H is None or abs(np.linalg.det(H)) < 1e-6:
-        print("[warp_crop_to_original] Homography không hợp lệ hoặc suy biến.")
-        return None, None
-
-    transformed_point = None
-    if shot_point is not None:
-        try:
-            px, py = float(shot_point[0]), float(shot_point[1])
-            src_pt = np.array([[[px, py]]], dtype=np.float32)
-            warped_pt = cv2.perspectiveTransform(src_pt, H)[0][0]
-            transformed_point = (float(warped_pt[0]), float(warped_pt[1]))
-            print(f"[warp_crop_to_original] Tọa độ vết đạn chuyển sang ảnh gốc: {transformed_point}")
-        except Exception as e:
-            print(f"[warp_crop_to_original] Lỗi chuyển tọa độ điểm: {e}")
-
-    print("[warp_crop_to_original] Warp ảnh thành công")
-    warped = cv2.warpPerspective(obj_crop, H, (original_img.shape[1], original_img.shape[0]), flags=cv2.INTER_LINEAR)
-    return warped, transformed_point
-
-def calculate_score(pt: Tuple[float, float], original_img: np.ndarray, mask: np.ndarray) -> int:
-    if original_img is None or mask is None or pt is None:
+        log.info("[find_crop_homography] Homography không hợp lệ hoặc suy biến.")
+        return None
+
+    if stats is not None:
+        stats["homography"] = H
+    return H
+
+def transform_point(H: np.ndarray, shot_point: Optional[Tuple[float, float]]) -> Optional[Tuple[float, float]]:
+    """Chuyển tọa độ điểm bắn trên ảnh crop sang ảnh gốc."""
+    if shot_point is None:
+        return None
+    try:
+        px, py = float(shot_point[0]), float(shot_point[1])
+        src_pt = np.array([[[px, py]]], dtype=np.float32)
+        warped_pt = cv2.perspectiveTransform(src_pt, H)[0][0]
+        transformed_point = (float(warped_pt[0]), float(warped_pt[1]))
+        log.debug("[transform_point] Tọa độ vết đạn chuyển sang ảnh gốc: %s", transformed_point)
+        return transformed_point
+    except Exception as e:
+        log.warning("[transform_point] Lỗi chuyển tọa độ điểm: %s", e)
+        return None
+
+def calculate_score(pt: Tuple[float, float], score_map) -> int:
+    """Tra điểm của một điểm chạm (tọa độ trên ảnh gốc) trong bản đồ điểm đã tính sẵn."""
+    if score_map is None or pt is None:
         return 0
-    x, y = int(pt[0]), int(pt[1])
-    h, w = original_img.shape[:2]
-    if not (0 <= x < w and 0 <= y < h):
-        return 0
-
-    center_x, center_y = w // 2, h // 2
-    distance = ((x - center_x) ** 2 + (y - center_y) ** 2) ** 0.5
-    
-    # Kiểm tra xem điểm chạm có nằm trong vùng hợp lệ của bia không
-    if mask[y, x] == 255:
-        if distance < 56: return 10
-        elif distance < 116: return 9
-        elif distance < 173: return 8
-        elif distance < 230: return 7
-        elif distance < 285: return 6
-        elif distance < 320: return 5
-    
-    return 0
\ No newline at end of file
+    return score_map.score(pt)
@@ -0,0 +1,132 @@
+import cv2
+import hashlib
+import json
+import os
+import numpy as np
+from threading import Lock
+from typing import Dict, Optional
+
+from utils.logger import get_logger
+from utils.processing import ORB_PARAMS, create_orb
+
+log = get_logger("reference")
+
+# Thư mục lưu đặc trưng đã trích xuất của ảnh bia gốc
+FEATURE_CACHE_DIR = "images/cache"
+
+
+class ReferenceTarget:
+    """
+    Ảnh bia gốc kèm keypoints/descriptors ORB đã trích xuất sẵn.
+    Chỉ cần tính một lần cho mỗi ảnh, các lần bắn sau chỉ trích xuất đặc trưng của ảnh crop.
+    """
+    def __init__(self, image_path: str, image: np.ndarray, keypoints, descriptors, content_hash: str):
+        self.image_path = image_path
+        self.image = image
+        self.keypoints = keypoints
+        self.descriptors = descriptors
+        self.content_hash = content_hash
+        # Tọa độ keypoints dạng mảng (N, 2) để dựng homography nhanh
+        self.points = np.float32([kp.pt for kp in keypoints]).reshape(-1, 2)
+
+    @property
+    def shape(self):
+        return self.image.shape
+
+
+def _content_hash(image_path: str) -> str:
+    """Hash nội dung file ảnh + tham số ORB, ảnh hoặc tham số thay đổi thì cache tự mất hiệu lực."""
+    h = hashlib.sha1()
+    with open(image_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 16), b''):
+            h.update(chunk)
+    h.update(json.dumps(ORB_PARAMS, sort_keys=True).encode('utf-8'))
+    return h.hexdigest()
+
+
+def _cache_path(image_path: str, content_hash: str, cache_dir: str) -> str:
+    name = os.path.splitext(os.path.basename(image_path))[0]
+    return os.path.join(cache_dir, f"{name}_{content_hash[:16]}.npz")
+
+
+def _keypoints_to_array(keypoints) -> np.ndarray:
+    return np.array(
+        [(kp.pt[0], kp.pt[1], kp.size, kp.angle, kp.response, kp.octave, kp.class_id) for kp in keypoints],
+        dtype=np.float32,
+    ).reshape(-1, 7)
+
+
+def _array_to_keypoints(arr: np.ndarray):
+    return [
+        cv2.KeyPoint(float(x), float(y), float(size), float(angle), float(response), int(octave), int(class_id))
+        for x, y, size, angle, response, octave, class_id in arr
+    ]
+
+
+def _load_cached(path: str):
+    try:
+        data = np.load(path)
+        keypoints = _array_to_keypoints(data['keypoints'])
+        descriptors = data['descriptors']
+        if descriptors.size == 0:
+            descriptors = None
+        return keypoints, descriptors
+    except Exception as e:
+        log.warning("⚠️ Không đọc được cache đặc trưng %s: %s", path, e)
+        return None
+
+
+def _save_cached(path: str, keypoints, descriptors):
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + ".tmp.npz"
+        np.savez(
+            tmp_path,
+            keypoints=_keypoints_to_array(keypoints),
+            descriptors=descriptors if descriptors is not None else np.zeros((0, 32), dtype=np.uint8),
+        )
+        os.replace(tmp_path, path)
+        log.info("💾 Đã lưu cache đặc trưng: %s", path)
+    except Exception as e:
+        log.warning("⚠️ Không lưu được cache đặc trưng %s: %s", path, e)
+
+
+def load_reference_target(image_path: str, cache_dir: str = FEATURE_CACHE_DIR) -> Optional[ReferenceTarget]:
+    """
+    Đọc ảnh bia gốc và đặc trưng ORB của nó.
+    Ưu tiên đọc từ cache trên đĩa (theo hash nội dung), nếu chưa có thì trích xuất và lưu lại.
+    """
+    image = cv2.imread(image_path)
+    if image is None:
+        log.warning("❌ Không đọc được ảnh bia gốc: %s", image_path)
+        return None
+
+    content_hash = _content_hash(image_path)
+    path = _cache_path(image_path, content_hash, cache_dir)
+
+    cached = _load_cached(path) if os.path.exists(path) else None
+    if cached is not None:
+        keypoints, descriptors = cached
+        log.info("✅ Đã tải đặc trưng bia gốc từ cache: %d keypoints", len(keypoints))
+    else:
+        keypoints, descriptors = create_orb().detectAndCompute(image, None)
+        log.info("✅ Đã trích xuất đặc trưng bia gốc: %d keypoints", len(keypoints))
+        _save_cached(path, keypoints, descriptors)
+
+    return ReferenceTarget(image_path, image, keypoints, descriptors, content_hash)
+
+
+# Registry trong bộ nhớ: mỗi ảnh bia chỉ trích xuất một lần cho cả tiến trình
+_REGISTRY: Dict[str, ReferenceTarget] = {}
+_REGISTRY_LOCK = Lock()
+
+
+def get_reference_target(image_path: str, cache_dir: str = FEATURE_CACHE_DIR) -> Optional[ReferenceTarget]:
+    key = os.path.abspath(image_path)
+    with _REGISTRY_LOCK:
+        reference = _REGISTRY.get(key)
+        if reference is None:
+            reference = load_reference_target(image_path, cache_dir)
+            if reference is not None:
+                _REGISTRY[key] = reference
+        return reference
@@ -0,0 +1,93 @@
+import cv2
+import json
+import os
+import numpy as np
+from typing import Optional, Sequence, Tuple
+
+from utils.logger import get_logger
+
+log = get_logger("scoring")
+
+# Ngưỡng nhị phân hóa mặt nạ: ảnh mask lưu JPEG nên viền không còn đúng 255
+MASK_THRESHOLD = 128
+
+
+def load_target_definition(path: str) -> dict:
+    """
+    Đọc file định nghĩa bia (JSON): tên hiển thị, ảnh gốc, mask, tâm và bán kính các vòng điểm.
+    Đường dẫn ảnh trong file là tương đối so với thư mục gốc của project.
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        definition = json.load(f)
+    definition.setdefault('name', os.path.splitext(os.path.basename(path))[0])
+    definition.setdefault('center', None)
+    definition['rings'] = sorted(definition.get('rings', []), key=lambda r: r['radius'])
+    return definition
+
+
+class ScoreMap:
+    """
+    Bản đồ điểm uint8 có cùng kích thước ảnh bia gốc: mỗi pixel chứa sẵn điểm của vòng chứa nó.
+    Tính điểm chỉ còn là một phép tra mảng, không phụ thuộc số vòng của bia.
+    """
+    def __init__(self, score_map: np.ndarray, name: str = ""):
+        self.map = score_map
+        self.name = name
+
+    @property
+    def shape(self):
+        return self.map.shape
+
+    @classmethod
+    def build(cls, image_size: Tuple[int, int], rings: Sequence[dict], center: Optional[Sequence[float]] = None,
+              mask: Optional[np.ndarray] = None, name: str = ""):
+        """image_size = (w, h); rings = [{'score': 10, 'radius': 56}, ...] tính bằng pixel trên ảnh gốc."""
+        w, h = image_size
+        cx, cy = (w // 2, h // 2) if center is None else (center[0], center[1])
+        yy, xx = np.ogrid[:h, :w]
+        dist2 = (xx - cx) ** 2 + (yy - cy) ** 2
+
+        score_map = np.zeros((h, w), dtype=np.uint8)
+        # Tô từ vòng ngoài vào trong để vòng trong ghi đè lên vòng ngoài
+        for ring in sorted(rings, key=lambda r: r['radius'], reverse=True):
+            score_map[dist2 < ring['radius'] ** 2] = int(ring['score'])
+
+        if mask is not None:
+            if mask.shape[:2] != (h, w):
+                mask = cv2.resize(mask, (w, h), interpolation=cv2.INTER_NEAREST)
+            score_map[mask < MASK_THRESHOLD] = 0
+        return cls(score_map, name)
+
+    @classmethod
+    def from_definition(cls, definition: dict, image_size: Optional[Tuple[int, int]] = None):
+        if image_size is None:
+            image = cv2.imread(definition['image'])
+            if image is None:
+                raise FileNotFoundError(f"Không đọc được ảnh bia gốc: {definition['image']}")
+            image_size = (image.shape[1], image.shape[0])
+        mask = None
+        if definition.get('mask'):
+            mask = cv2.imread(definition['mask'], cv2.IMREAD_GRAYSCALE)
+            if mask is None:
+                log.warning("⚠️ Không đọc được mask %s, chấm điểm không dùng mask.", definition['mask'])
+        return cls.build(image_size, definition['rings'], definition.get('center'), mask, definition.get('name', ""))
+
+    def score(self, pt: Optional[Tuple[float, float]]) -> int:
+        if pt is None:
+            return 0
+        return int(self.score_points(np.asarray([pt], dtype=np.float64))[0])
+
+    def score_points(self, pts) -> np.ndarray:
+        """Chấm điểm cả loạt phát bắn (mảng N x 2 tọa độ trên ảnh gốc) trong một lần tra mảng."""
+        pts = np.asarray(pts, dtype=np.float64).reshape(-1, 2)
+        h, w = self.map.shape
+        xs = np.floor(pts[:, 0]).astype(np.int64)
+        ys = np.floor(pts[:, 1]).astype(np.int64)
+        inside = (xs >= 0) & (xs < w) & (ys >= 0) & (ys < h)
+        scores = np.zeros(len(pts), dtype=np.uint8)
+        scores[inside] = self.map[ys[inside], xs[inside]]
+        return scores
+
+
+def load_score_map(definition_path: str) -> ScoreMap:
+    return ScoreMap.from_definition(load_target_definition(definition_path))
@@ -0,0 +1,71 @@
+import json
+import os
+import sqlite3
+import time
+from threading import Lock
+from typing import List, Tuple
+
+DEFAULT_SPOOL_PATH = "spool/results.db"
+
+
+class ResultSpool:
+    """
+    Hàng đợi bền vững (SQLite WAL) cho kết quả bắn chưa gửi được lên server.
+    Mỗi kết quả được ghi vào đây trước, sau đó mới được gửi theo lô và xóa khi server đã nhận.
+    """
+    def __init__(self, path: str = DEFAULT_SPOOL_PATH):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " shot_id TEXT UNIQUE NOT NULL,"
+            " created REAL NOT NULL,"
+            " metadata TEXT NOT NULL,"
+            " image BLOB,"
+            " attempts INTEGER NOT NULL DEFAULT 0)"
+        )
+
+    def append(self, shot_id: str, metadata: dict, image_bytes: bytes):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO results (shot_id, created, metadata, image) VALUES (?, ?, ?, ?)",
+                (shot_id, time.time(), json.dumps(metadata, ensure_ascii=False), image_bytes),
+            )
+
+    def fetch_batch(self, limit: int) -> List[Tuple[int, str, dict, bytes]]:
+        """Lấy tối đa 'limit' kết quả cũ nhất: [(id, shot_id, metadata, image_bytes), ...]."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, shot_id, metadata, image FROM results ORDER BY id LIMIT ?", (limit,)
+            ).fetchall()
+        return [(row_id, shot_id, json.loads(metadata), image) for row_id, shot_id, metadata, image in rows]
+
+    def mark_attempt(self, ids) -> int:
+        """Tăng số lần gửi lỗi của các kết quả, trả về số lần lớn nhất (dùng để tính backoff)."""
+        ids = list(ids)
+        placeholders = ",".join("?" * len(ids))
+        with self._lock:
+            self._conn.execute(f"UPDATE results SET attempts = attempts + 1 WHERE id IN ({placeholders})", ids)
+            return self._conn.execute(f"SELECT MAX(attempts) FROM results WHERE id IN ({placeholders})",
+                                      ids).fetchone()[0] or 0
+
+    def delete(self, ids):
+        ids = list(ids)
+        placeholders = ",".join("?" * len(ids))
+        with self._lock:
+            self._conn.execute(f"DELETE FROM results WHERE id IN ({placeholders})", ids)
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,109 @@
+"""
+Khởi động song song các hệ thống con (detector, âm thanh, báo cáo cấu hình...) để camera và
+preview lên ngay, không phải chờ phần chậm nhất. Mỗi hệ thống con có trạng thái riêng
+(pending -> ready / failed) được in ra, xuất qua metrics và có thể chờ bằng wait().
+"""
+import time
+from threading import Event, Lock, Thread
+
+from utils import metrics
+from utils.logger import get_logger
+
+log = get_logger("startup")
+
+STATUS_PENDING = "pending"
+STATUS_READY = "ready"
+STATUS_FAILED = "failed"
+
+
+class Subsystem:
+    def __init__(self, name, func, on_ready=None, on_failed=None):
+        self.name = name
+        self.func = func
+        self.on_ready = on_ready
+        self.on_failed = on_failed
+        self.status = STATUS_PENDING
+        self.result = None
+        self.error = None
+        self.elapsed_ms = None
+        self.done = Event()
+        self.ready_gauge = metrics.gauge("subsystem_ready", "1 nếu hệ thống con đã sẵn sàng", subsystem=name)
+
+
+class StartupOrchestrator:
+    """
+    add(name, func, on_ready, on_failed) đăng ký một bước khởi động; start() chạy tất cả trên các luồng riêng.
+    func trả về False hoặc ném exception thì hệ thống con bị đánh dấu failed và on_failed(error) được gọi;
+    on_ready(result) được gọi trên luồng của bước đó khi thành công.
+    """
+    def __init__(self):
+        self.subsystems = {}
+        self._lock = Lock()
+        self._started_at = None
+
+    def add(self, name, func, on_ready=None, on_failed=None):
+        self.subsystems[name] = Subsystem(name, func, on_ready, on_failed)
+        return self
+
+    def _run(self, subsystem):
+        start = time.perf_counter()
+        try:
+            result = subsystem.func()
+            if result is False:
+                raise RuntimeError("khởi tạo không thành công")
+            subsystem.result = result
+            if subsystem.on_ready is not None:
+                subsystem.on_ready(result)
+            subsystem.status = STATUS_READY
+            subsystem.ready_gauge.set(1)
+        except Exception as e:
+            subsystem.error = e
+            subsystem.status = STATUS_FAILED
+            log.error("❌ Khởi động '%s' thất bại: %s", subsystem.name, e)
+            if subsystem.on_failed is not None:
+                try:
+                    subsystem.on_failed(e)
+                except Exception as callback_error:
+                    log.error("Lỗi khi xử lý khởi động '%s' thất bại: %s", subsystem.name, callback_error)
+        finally:
+            subsystem.elapsed_ms = (time.perf_counter() - start) * 1000.0
+            subsystem.done.set()
+        if subsystem.status == STATUS_READY:
+            log.info("✅ '%s' sẵn sàng sau %.0f ms (kể từ lúc khởi động: %.0f ms)", subsystem.name,
+                     subsystem.elapsed_ms, (time.perf_counter() - self._started_at) * 1000.0)
+
+    def start(self):
+        self._started_at = time.perf_counter()
+        for subsystem in self.subsystems.values():
+            Thread(target=self._run, args=(subsystem,), name=f"startup-{subsystem.name}", daemon=True).start()
+        return self
+
+    def wait(self, name, timeout=None):
+        """Chờ một hệ thống con xong (thành công hoặc thất bại). Trả về True nếu nó đã ready."""
+        subsystem = self.subsystems[name]
+        subsystem.done.wait(timeout)
+        return subsystem.status == STATUS_READY
+
+    def wait_all(self, timeout=None):
+        """Chờ mọi hệ thống con xong (thành công hoặc thất bại). Trả về False nếu hết thời gian mà còn bước đang chạy."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for subsystem in self.subsystems.values():
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+            if not subsystem.done.wait(remaining):
+                return False
+        return True
+
+    def is_ready(self, name):
+        return self.subsystems[name].status == STATUS_READY
+
+    def failed(self):
+        """Tên các hệ thống con đã xong nhưng không ready."""
+        return [name for name, s in self.subsystems.items() if s.done.is_set() and not self.is_ready(name)]
+
+    def status(self):
+        return {
+            name: {'status': s.status,
+                   'elapsed_ms': round(s.elapsed_ms, 1) if s.elapsed_ms is not None else None,
+                   'error': str(s.error) if s.error is not None else None}
+            for name, s in self.subsystems.items()
+        }
@@ -0,0 +1,239 @@
+"""
+Thư viện nhiều loại bia và nhận dạng loại bia từ ảnh crop.
+
+Mỗi file *.json trong thư mục thư viện (mặc định targets/) là một loại bia: tên hiển thị, ảnh gốc,
+mask và các vòng điểm (xem utils.scoring.load_target_definition). Khi tải, descriptor ORB của mọi
+ảnh gốc được lượng tử hóa bằng cây từ vựng nhị phân (branching^depth từ) và đánh chỉ mục ngược
+theo TF-IDF. Nhận dạng một ảnh crop chỉ đi qua cây (branching * depth phép so Hamming cho mỗi
+descriptor) và các danh sách của những từ xuất hiện trong crop, không phải match với từng loại bia.
+"""
+import glob
+import hashlib
+import os
+import numpy as np
+from threading import Lock
+from typing import Dict, List, Optional, Tuple
+
+from utils.logger import get_logger
+from utils.reference import FEATURE_CACHE_DIR, get_reference_target
+from utils.scoring import ScoreMap, load_target_definition
+
+log = get_logger("targets")
+
+DEFAULT_LIBRARY_DIR = "targets"
+
+
+class TargetEntry:
+    """Một loại bia đã sẵn sàng chấm điểm: định nghĩa, đặc trưng ORB của ảnh gốc và bản đồ điểm."""
+    def __init__(self, path: str):
+        self.path = path
+        self.definition = load_target_definition(path)
+        # Đặc trưng ORB của bia gốc được trích xuất/tải từ cache một lần khi khởi động
+        self.reference = get_reference_target(self.definition['image'])
+        self.original_img = self.reference.image if self.reference is not None else None
+        # Bản đồ điểm tính sẵn một lần, chấm điểm chỉ còn là tra mảng
+        self.score_map = ScoreMap.from_definition(
+            self.definition,
+            (self.original_img.shape[1], self.original_img.shape[0]) if self.original_img is not None else None,
+        )
+
+    @property
+    def name(self) -> str:
+        return self.definition['name']
+
+    @property
+    def image_path(self) -> str:
+        return self.definition['image']
+
+
+def _unpack(descriptors: np.ndarray) -> np.ndarray:
+    """Descriptor ORB (N, 32) uint8 -> ma trận bit (N, 256) float32 để tính Hamming bằng nhân ma trận."""
+    return np.unpackbits(descriptors, axis=1).astype(np.float32)
+
+
+def _hamming(bits: np.ndarray, centers: np.ndarray) -> np.ndarray:
+    """Khoảng cách Hamming (N, K) giữa các descriptor và các tâm, dạng bit: |a| + |b| - 2 a.b"""
+    return bits.sum(axis=1, keepdims=True) + centers.sum(axis=1)[None, :] - 2.0 * bits @ centers.T
+
+
+# Số bit 1 của mỗi giá trị byte, để tính Hamming trực tiếp trên descriptor đã đóng gói
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def _packed_hamming(descriptors: np.ndarray, centers: np.ndarray) -> np.ndarray:
+    """Khoảng cách Hamming (N, K) giữa descriptor (N, 32) và tâm của từng descriptor (N, K, 32), cùng dạng uint8."""
+    return _POPCOUNT[descriptors[:, None, :] ^ centers].sum(axis=2, dtype=np.int32)
+
+
+class BinaryVocabulary:
+    """
+    Cây từ vựng cho descriptor nhị phân: mỗi nút chia descriptor thành 'branching' cụm bằng k-majority
+    (tâm cụm là bit đa số), sâu 'depth' tầng. Lá của cây là các từ, đánh số 0 .. branching**depth - 1.
+    """
+    def __init__(self, centers: List[np.ndarray], branching: int, depth: int):
+        # centers[level] có dạng (branching**level, branching, 32) uint8 (bit đã đóng gói như descriptor ORB):
+        # tâm các con của từng nút ở tầng đó
+        self.centers = centers
+        self.branching = branching
+        self.depth = depth
+
+    @property
+    def size(self) -> int:
+        return self.branching ** self.depth
+
+    @classmethod
+    def build(cls, descriptors: np.ndarray, branching: int = 16, depth: int = 2, iterations: int = 6, seed: int = 0):
+        rng = np.random.default_rng(seed)
+        bits = _unpack(descriptors)
+        centers = []
+        assignment = np.zeros(len(bits), dtype=np.int64)
+        for level in range(depth):
+            level_centers = np.zeros((branching ** level, branching, bits.shape[1]), dtype=np.float32)
+            next_assignment = np.zeros(len(bits), dtype=np.int64)
+            for node in range(branching ** level):
+                members = np.nonzero(assignment == node)[0]
+                if len(members) == 0:
+                    continue
+                node_bits = bits[members]
+                # Khởi tạo tâm từ các descriptor ngẫu nhiên (lặp lại nếu nút có ít descriptor hơn số nhánh)
+                node_centers = node_bits[rng.choice(len(members), branching, replace=len(members) < branching)]
+                for _ in range(iterations):
+                    labels = np.argmin(_hamming(node_bits, node_centers), axis=1)
+                    for k in range(branching):
+                        cluster = node_bits[labels == k]
+                        if len(cluster):
+                            node_centers[k] = (cluster.mean(axis=0) >= 0.5).astype(np.float32)
+                labels = np.argmin(_hamming(node_bits, node_centers), axis=1)
+                level_centers[node] = node_centers
+                next_assignment[members] = node * branching + labels
+            centers.append(np.packbits(level_centers.astype(np.uint8), axis=-1))
+            assignment = next_assignment
+        return cls(centers, branching, depth)
+
+    def quantize(self, descriptors: np.ndarray) -> np.ndarray:
+        """Descriptor (N, 32) -> chỉ số từ (N,), đi từ gốc xuống lá."""
+        descriptors = np.ascontiguousarray(descriptors, dtype=np.uint8)
+        node = np.zeros(len(descriptors), dtype=np.int64)
+        for level_centers in self.centers:
+            children = level_centers[node]                                  # (N, branching, 32)
+            distances = _packed_hamming(descriptors, children)              # (N, branching)
+            node = node * self.branching + np.argmin(distances, axis=1)
+        return node
+
+    def save(self, path: str):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + ".tmp.npz"
+        np.savez(tmp_path, branching=self.branching, depth=self.depth,
+                 **{f"level{i}": c for i, c in enumerate(self.centers)})
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str):
+        data = np.load(path)
+        depth = int(data['depth'])
+        centers = [data[f"level{i}"].astype(np.uint8) for i in range(depth)]
+        return cls(centers, int(data['branching']), depth)
+
+
+class TargetLibrary:
+    """
+    Các loại bia trong một thư mục cùng chỉ mục ngược TF-IDF trên từ vựng ORB.
+    recognize() trả về các loại bia xếp theo độ tương đồng với ảnh crop (cao nhất trước).
+    """
+    def __init__(self, directory: str = DEFAULT_LIBRARY_DIR, branching: int = 16, depth: int = 2,
+                 cache_dir: str = FEATURE_CACHE_DIR):
+        self.directory = directory
+        self.entries: List[TargetEntry] = []
+        for path in sorted(glob.glob(os.path.join(directory, "*.json"))):
+            try:
+                entry = TargetEntry(path)
+            except (OSError, ValueError, KeyError) as e:
+                log.warning("⚠️ Bỏ qua định nghĩa bia %s: %s", path, e)
+                continue
+            if entry.reference is None or entry.reference.descriptors is None:
+                log.warning("⚠️ Bỏ qua bia '%s': không có đặc trưng ORB.", entry.name)
+                continue
+            self.entries.append(entry)
+        if not self.entries:
+            raise FileNotFoundError(f"Không có định nghĩa bia hợp lệ trong {directory}")
+        self.vocabulary = None
+        if len(self.entries) > 1:
+            self.vocabulary = self._load_vocabulary(branching, depth, cache_dir)
+            self._build_index()
+        log.info("📚 Thư viện bia %s: %s", directory, ", ".join(entry.name for entry in self.entries))
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _load_vocabulary(self, branching, depth, cache_dir):
+        """Từ vựng được cache theo hash đặc trưng của mọi ảnh gốc, thêm/sửa bia thì dựng lại."""
+        h = hashlib.sha1(f"{branching}x{depth}".encode('utf-8'))
+        for entry in self.entries:
+            h.update(entry.reference.content_hash.encode('utf-8'))
+        path = os.path.join(cache_dir, f"vocabulary_{h.hexdigest()[:16]}.npz")
+        if os.path.exists(path):
+            try:
+                vocabulary = BinaryVocabulary.load(path)
+                log.info("✅ Đã tải từ vựng bia từ cache: %d từ", vocabulary.size)
+                return vocabulary
+            except Exception as e:
+                log.warning("⚠️ Không đọc được cache từ vựng %s: %s", path, e)
+        descriptors = np.concatenate([entry.reference.descriptors for entry in self.entries])
+        vocabulary = BinaryVocabulary.build(descriptors, branching, depth)
+        log.info("✅ Đã dựng từ vựng bia: %d từ từ %d descriptor", vocabulary.size, len(descriptors))
+        try:
+            vocabulary.save(path)
+        except OSError as e:
+            log.warning("⚠️ Không lưu được cache từ vựng %s: %s", path, e)
+        return vocabulary
+
+    def _histogram(self, descriptors: np.ndarray) -> np.ndarray:
+        return np.bincount(self.vocabulary.quantize(descriptors), minlength=self.vocabulary.size).astype(np.float32)
+
+    def _build_index(self):
+        histograms = np.stack([self._histogram(entry.reference.descriptors) for entry in self.entries])
+        document_frequency = (histograms > 0).sum(axis=0)
+        self.idf = np.log(len(self.entries) / np.maximum(document_frequency, 1)).astype(np.float32)
+        vectors = self._tfidf(histograms)
+        # Chỉ mục ngược: từ -> (các loại bia chứa từ đó, trọng số TF-IDF tương ứng)
+        self.postings: Dict[int, Tuple[np.ndarray, np.ndarray]] = {}
+        for word in np.nonzero(document_frequency)[0]:
+            targets = np.nonzero(vectors[:, word])[0]
+            if len(targets):
+                self.postings[int(word)] = (targets, vectors[targets, word])
+
+    def _tfidf(self, histograms: np.ndarray) -> np.ndarray:
+        histograms = np.atleast_2d(histograms)
+        tf = histograms / np.maximum(histograms.sum(axis=1, keepdims=True), 1.0)
+        vectors = tf * self.idf[None, :]
+        return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+    def recognize(self, descriptors: Optional[np.ndarray], top_n: int = 2) -> List[Tuple[TargetEntry, float]]:
+        """Các loại bia giống ảnh crop nhất (tối đa top_n) kèm điểm cosine TF-IDF."""
+        if self.vocabulary is None:
+            return [(self.entries[0], 1.0)]
+        if descriptors is None or len(descriptors) == 0:
+            return []
+        query = self._tfidf(self._histogram(descriptors))[0]
+        words = [w for w in np.nonzero(query)[0] if int(w) in self.postings]
+        if not words:
+            return []
+        targets = np.concatenate([self.postings[int(w)][0] for w in words])
+        weights = np.concatenate([self.postings[int(w)][1] * query[w] for w in words])
+        scores = np.bincount(targets, weights=weights, minlength=len(self.entries))
+        order = np.argsort(-scores)[:top_n]
+        return [(self.entries[i], float(scores[i])) for i in order if scores[i] > 0]
+
+
+# Mỗi thư mục thư viện chỉ dựng một lần cho cả tiến trình (nhiều làn dùng chung)
+_LIBRARIES: Dict[str, TargetLibrary] = {}
+_LIBRARIES_LOCK = Lock()
+
+
+def get_target_library(directory: str = DEFAULT_LIBRARY_DIR) -> TargetLibrary:
+    key = os.path.abspath(directory)
+    with _LIBRARIES_LOCK:
+        library = _LIBRARIES.get(key)
+        if library is None:
+            library = _LIBRARIES[key] = TargetLibrary(directory)
+        return library
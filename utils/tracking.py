@@ -0,0 +1,70 @@
+import cv2
+import numpy as np
+from threading import Lock
+from typing import Optional, Tuple
+
+
+class HomographyTracker:
+    """
+    Lưu homography crop -> bia gốc và bounding box của lần bắn trước trên cùng một làn.
+    Lần bắn sau chỉ cần kiểm tra nhanh bằng optical flow trên vùng crop cũ:
+    nếu bia không dịch chuyển thì dùng lại homography, bỏ qua YOLO + ORB + RANSAC.
+    """
+    def __init__(self, max_shift: float = 2.0, min_points: int = 12, max_points: int = 40, min_track_ratio: float = 0.7):
+        self.max_shift = max_shift
+        self.min_points = min_points
+        self.max_points = max_points
+        self.min_track_ratio = min_track_ratio
+        self.lock = Lock()
+        self.invalidate()
+
+    def invalidate(self):
+        self.H = None
+        self.box = None
+        self.template = None
+        self.points = None
+
+    @staticmethod
+    def _gray(image: np.ndarray) -> np.ndarray:
+        return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+
+    def update(self, frame: np.ndarray, box: Tuple[int, int, int, int], H: np.ndarray):
+        """Ghi nhận homography tốt vừa tính được cùng ảnh mẫu của vùng bia."""
+        x1, y1, x2, y2 = box
+        template = self._gray(frame[y1:y2, x1:x2]).copy()
+        points = cv2.goodFeaturesToTrack(template, maxCorners=self.max_points, qualityLevel=0.01, minDistance=8)
+        with self.lock:
+            if points is None or len(points) < self.min_points:
+                self.invalidate()
+                return
+            self.H = H.copy()
+            self.box = box
+            self.template = template
+            self.points = points.astype(np.float32)
+
+    def lookup(self, frame: np.ndarray) -> Optional[Tuple[Tuple[int, int, int, int], np.ndarray]]:
+        """
+        Trả về (box, H) nếu bia vẫn nằm yên so với lần bắn trước, ngược lại trả về None.
+        """
+        with self.lock:
+            if self.H is None:
+                return None
+            x1, y1, x2, y2 = self.box
+            current = self._gray(frame[y1:y2, x1:x2])
+            if current.shape != self.template.shape:
+                self.invalidate()
+                return None
+            new_points, status, _ = cv2.calcOpticalFlowPyrLK(self.template, current, self.points, None,
+                                                             winSize=(15, 15), maxLevel=2)
+            if new_points is None:
+                self.invalidate()
+                return None
+            tracked = status.reshape(-1).astype(bool)
+            if tracked.sum() < max(self.min_points, self.min_track_ratio * len(self.points)):
+                self.invalidate()
+                return None
+            shift = np.linalg.norm((new_points - self.points).reshape(-1, 2)[tracked], axis=1)
+            if float(np.median(shift)) > self.max_shift:
+                self.invalidate()
+                return None
+            return self.box, self.H